@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sys
+from subprocess import CalledProcessError
+
+sys.path.append('lib')
+sys.path.append('hooks')
+
+from charmhelpers.core.hookenv import action_get, action_set, action_fail, log
+from ceph.balance_utils import apply_reweights, get_osd_df, plan_reweights
+
+if __name__ == '__main__':
+    method = action_get('method')
+    try:
+        plan = plan_reweights(get_osd_df(service='admin'),
+                              target_var=action_get('target-var'),
+                              max_change=action_get('max-change'),
+                              max_osds=action_get('max-osds'),
+                              method=method)
+        applied = 0
+        if not action_get('dry-run'):
+            applied = apply_reweights(
+                plan, method=method,
+                batch_size=action_get('batch-size'),
+                batch_interval=action_get('batch-interval'),
+                service='admin')
+    except CalledProcessError as e:
+        log(e)
+        action_fail("Balancing OSDs failed with message: {}".format(str(e)))
+    else:
+        action_set({'message': json.dumps(plan, sort_keys=True),
+                    'adjustments': len(plan),
+                    'applied': applied})
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sys
+
+sys.path.append('lib')
+sys.path.append('hooks')
+
+from charmhelpers.core.hookenv import action_get, action_set
+from ceph.cache_flush import get_flush_jobs, job_alive, RUNNING
+
+if __name__ == '__main__':
+    jobs = get_flush_jobs()
+    cache_pool = action_get('cache-pool')
+    if cache_pool:
+        jobs = dict((pool, job) for pool, job in jobs.items()
+                    if pool == cache_pool)
+    for job in jobs.values():
+        if job.get('state') == RUNNING:
+            job['alive'] = job_alive(job)
+    action_set({'message': json.dumps(jobs, sort_keys=True)})
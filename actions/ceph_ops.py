@@ -12,15 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from fnmatch import fnmatch
+from glob import glob
 from subprocess import CalledProcessError, check_output
+import gzip
+import json
+import os
 import rados
+import re
 import sys
+import time
+import yaml
 
 sys.path.append('hooks')
+sys.path.append('lib')
 
-from charmhelpers.core.hookenv import log, action_get, action_fail
+from charmhelpers.core.hookenv import log, action_get, action_fail, \
+    service_name
+from charmhelpers.core.host import mkdir
 from charmhelpers.contrib.storage.linux.ceph import pool_set, \
-    set_pool_quota, snapshot_pool, remove_pool_snapshot
+    set_pool_quota, snapshot_pool, remove_pool_snapshot, validator
+from ceph.broker import POOL_KEYS
+
+
+# Upper bound on concurrent librados requests issued by a single action
+MAX_POOL_WORKERS = 8
 
 
 # Connect to Ceph via Librados and return a connection
@@ -110,6 +128,144 @@ def set_pool():
     pool_set(service='ceph', pool_name=pool_name, key=key, value=value)
 
 
+def parse_pool_matrix(matrix):
+    """
+    Parses a YAML or JSON mapping of pool names to pool keys.
+
+    Raises ValueError if the matrix is not a mapping keyed by pool name.
+    """
+    try:
+        parsed = yaml.safe_load(matrix)
+    except yaml.YAMLError as e:
+        raise ValueError("Unable to parse pool matrix: {}".format(e))
+    if not isinstance(parsed, dict):
+        raise ValueError("Pool matrix must be a mapping of pool names")
+    return parsed
+
+
+def validate_pool_value(key, value):
+    """
+    Validates a pool value against broker.POOL_KEYS.
+
+    Returns the value, converted to float for float keys, or raises
+    ValueError if the key is unknown or the value is not valid for it.
+    """
+    if key not in POOL_KEYS:
+        raise ValueError("Invalid key '{}'".format(key))
+    validator_params = POOL_KEYS[key]
+    if validator_params[0] is float and isinstance(value, int):
+        value = float(value)
+    try:
+        validator(value, *validator_params)
+    except AssertionError as e:
+        raise ValueError(str(e))
+    return value
+
+
+def pool_mon_command(cluster, command):
+    """
+    Runs a monitor command over an existing cluster connection.
+
+    Returns the command output or raises ValueError with the monitor's
+    error message.
+    """
+    ret, out, status = cluster.mon_command(json.dumps(command), b'')
+    if ret != 0:
+        raise ValueError(status or "mon_command returned {}".format(ret))
+    return out
+
+
+def run_pool_commands(items, command_fn, max_workers=MAX_POOL_WORKERS):
+    """
+    Runs one monitor command per (pool, key, value) item concurrently.
+
+    A single cluster connection is shared by all the commands. The result
+    maps each pool to a dict of the outcome for each of its keys, errors
+    are reported as {'error': message} against the key that failed.
+    """
+    results = {}
+    cluster = connect()
+    if cluster is None:
+        action_fail("Unable to connect to the Ceph cluster")
+        return None
+
+    def run(item):
+        pool, key, value = item
+        try:
+            return command_fn(cluster, pool, key, value)
+        except (ValueError, rados.Error) as e:
+            return {'error': str(e)}
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for (pool, key, _), outcome in zip(items,
+                                               executor.map(run, items)):
+                results.setdefault(pool, {})[key] = outcome
+    finally:
+        cluster.shutdown()
+    return results
+
+
+def set_pool_value(cluster, pool, key, value):
+    """Sets a pool key through librados, as 'ceph osd pool set' would."""
+    pool_mon_command(cluster, {'prefix': 'osd pool set', 'pool': pool,
+                               'var': key, 'val': str(value).lower()})
+    return 'ok'
+
+
+def get_pool_value(cluster, pool, key, value=None):
+    """
+    Returns the value of a pool key read through librados.
+
+    Raises ValueError if the monitor does not report the value under the
+    requested key.
+    """
+    out = pool_mon_command(cluster, {'prefix': 'osd pool get', 'pool': pool,
+                                     'var': key, 'format': 'json'})
+    result = json.loads(out.decode('UTF-8'))
+    if not isinstance(result, dict) or key not in result:
+        raise ValueError("No value for {} in the monitor's reply".format(key))
+    return result[key]
+
+
+def set_pool_matrix(matrix, max_workers=MAX_POOL_WORKERS):
+    """
+    Sets many keys on many pools from a mapping of pool to {key: value}.
+
+    Every value is validated before anything is changed, invalid values
+    are reported against their key and are not applied.
+    """
+    items = []
+    results = {}
+    for pool, settings in matrix.items():
+        if not isinstance(settings, dict):
+            results[pool] = {'error': "Pool settings must be a mapping"}
+            continue
+        for key, value in settings.items():
+            try:
+                items.append((pool, key, validate_pool_value(key, value)))
+            except ValueError as e:
+                results.setdefault(pool, {})[key] = {'error': str(e)}
+    if items:
+        applied = run_pool_commands(items, set_pool_value,
+                                    max_workers=max_workers)
+        if applied is None:
+            return None
+        for pool, outcome in applied.items():
+            results.setdefault(pool, {}).update(outcome)
+    return results
+
+
+def get_pool_matrix(matrix, max_workers=MAX_POOL_WORKERS):
+    """Returns many keys of many pools from a mapping of pool to [keys]."""
+    items = []
+    for pool, keys in matrix.items():
+        if isinstance(keys, str):
+            keys = [keys]
+        items.extend((pool, key, None) for key in keys or [])
+    return run_pool_commands(items, get_pool_value, max_workers=max_workers)
+
+
 def pool_stats():
     """
     Returns statistics for a pool.
@@ -133,6 +289,266 @@ def pool_stats():
         action_fail(str(e))
 
 
+def get_ioctx_stats(cluster, pool_name):
+    """
+    Returns statistics for a pool on an existing cluster connection.
+
+    Errors are reported against the pool rather than raised so that one
+    pool being removed does not fail the whole listing.
+    """
+    try:
+        ioctx = cluster.open_ioctx(pool_name)
+        try:
+            return ioctx.get_stats()
+        finally:
+            ioctx.close()
+    except rados.Error as e:
+        return {'error': str(e)}
+
+
+def all_pool_stats(pool_glob='*', max_workers=MAX_POOL_WORKERS):
+    """
+    Returns statistics for every pool matching a glob.
+
+    A single cluster connection is shared and the statistics of the
+    pools are read concurrently by up to max_workers threads. The result
+    is a list with one dict per pool, sorted by pool name.
+    """
+    cluster = connect()
+    if cluster is None:
+        action_fail("Unable to connect to the Ceph cluster")
+        return None
+    try:
+        pools = sorted(pool for pool in cluster.list_pools()
+                       if fnmatch(pool, pool_glob))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            stats = executor.map(
+                lambda pool: get_ioctx_stats(cluster, pool), pools)
+            table = []
+            for pool, pool_stats in zip(pools, stats):
+                row = {'pool': pool}
+                row.update(pool_stats)
+                table.append(row)
+        return table
+    except (rados.Error,
+            rados.IOError,
+            rados.ObjectNotFound,
+            rados.NoData,
+            rados.NoSpace,
+            rados.PermissionError) as e:
+        action_fail(str(e))
+    finally:
+        cluster.shutdown()
+
+
+# Directory on the unit that large action results are written to
+ACTION_OUTPUT_DIR = '/var/lib/charm/{}/action-output'
+# Files kept per action in ACTION_OUTPUT_DIR, older ones are removed
+ACTION_OUTPUT_KEEP = 5
+
+# Keys of an 'osd df tree' node which are not useful in a flat OSD listing
+OSD_DF_SKIP_KEYS = ('children', 'depth', 'pool_weights', 'type_id')
+
+# Sort orders available to osd_df_rows, largest first except for id
+OSD_DF_SORT_KEYS = {
+    'id': (lambda row: row['id'], False),
+    'utilization': (lambda row: row.get('utilization', 0), True),
+    'var': (lambda row: row.get('var', 0), True),
+    'pgs': (lambda row: row.get('pgs', 0), True),
+}
+
+
+def flatten_osd_df_tree(df_tree):
+    """
+    Returns one row per OSD from the output of 'ceph osd df tree -f json'.
+
+    Each row carries the OSD's usage along with the name of the host and
+    root it sits under in the CRUSH hierarchy.
+    """
+    nodes = dict((node['id'], node) for node in df_tree.get('nodes', []))
+    parents = {}
+    for node in nodes.values():
+        for child in node.get('children', []):
+            parents[child] = node['id']
+
+    def ancestor(node_id, bucket_type):
+        while node_id in parents:
+            node_id = parents[node_id]
+            if nodes[node_id]['type'] == bucket_type:
+                return nodes[node_id]['name']
+        return None
+
+    rows = []
+    for node in df_tree.get('nodes', []) + df_tree.get('stray', []):
+        if node.get('type') != 'osd':
+            continue
+        row = dict((key, value) for key, value in node.items()
+                   if key not in OSD_DF_SKIP_KEYS)
+        row['host'] = ancestor(node['id'], 'host')
+        row['root'] = ancestor(node['id'], 'root')
+        rows.append(row)
+    return rows
+
+
+def osd_df_rows(rows, host=None, root=None, min_utilization=None,
+                sort_by=None):
+    """
+    Filters and sorts the rows returned by flatten_osd_df_tree.
+
+    host and root are matched as globs, min_utilization is a percentage.
+    """
+    if host:
+        rows = [row for row in rows
+                if row['host'] and fnmatch(row['host'], host)]
+    if root:
+        rows = [row for row in rows
+                if row['root'] and fnmatch(row['root'], root)]
+    if min_utilization is not None:
+        rows = [row for row in rows
+                if row.get('utilization', 0) >= min_utilization]
+    if sort_by:
+        key, reverse = OSD_DF_SORT_KEYS[sort_by]
+        rows = sorted(rows, key=key, reverse=reverse)
+    return rows
+
+
+def summarize_osd_df(rows):
+    """Returns the OSD count and utilization range of a set of rows."""
+    utilization = [row.get('utilization', 0) for row in rows]
+    summary = {'osds': len(rows)}
+    if utilization:
+        summary.update({
+            'min_utilization': min(utilization),
+            'max_utilization': max(utilization),
+            'avg_utilization': sum(utilization) / len(utilization),
+        })
+    return summary
+
+
+def paginate(rows, offset=0, limit=0):
+    """Returns the rows from offset onwards, at most limit of them if set."""
+    offset = offset or 0
+    if limit:
+        return rows[offset:offset + limit]
+    return rows[offset:]
+
+
+def write_action_output(action_name, data):
+    """
+    Writes an action result to a gzip compressed file on the unit.
+
+    Results too large to pass back through action_set are stored under
+    ACTION_OUTPUT_DIR and the path of the file is returned. Only the newest
+    ACTION_OUTPUT_KEEP files of each action are kept.
+    """
+    output_dir = ACTION_OUTPUT_DIR.format(service_name())
+    mkdir(output_dir, perms=0o700)
+    path = os.path.join(output_dir, '{}-{}.json.gz'.format(
+        action_name, time.strftime('%Y%m%d%H%M%S')))
+    with gzip.open(path, 'wt') as output:
+        json.dump(data, output)
+    # The timestamps sort in the order the files were written
+    previous = sorted(glob(os.path.join(output_dir, '{}-{}.json.gz'.format(
+        action_name, '[0-9]' * 14))))
+    for old in previous[:-ACTION_OUTPUT_KEEP]:
+        os.remove(old)
+    return path
+
+
+def match_pools(cluster, patterns):
+    """Returns the sorted names of the pools matching any of the globs."""
+    return sorted(pool for pool in cluster.list_pools()
+                  if any(fnmatch(pool, pattern) for pattern in patterns))
+
+
+# Timestamp the snapshot-set action appends to its prefix
+SNAPSHOT_TIME_FORMAT = '%Y%m%d%H%M%S'
+
+
+def snapshot_set_name(prefix, when=None):
+    """
+    Returns the name the snapshot-set action gives a snapshot, the prefix
+    followed by a dash and the UTC time.
+    """
+    return '{}-{}'.format(prefix, time.strftime(SNAPSHOT_TIME_FORMAT,
+                                                when or time.gmtime()))
+
+
+def expired_snapshots(snapshots, prefix, keep=0, max_age=0, now=None):
+    """
+    Returns the names of the snapshots a retention policy removes.
+
+    Only snapshots named as snapshot_set_name names them for prefix are
+    considered, so snapshots taken by hand or by other tools are left
+    alone. Of those the newest keep are retained and any older than
+    max_age days are removed, either limit is ignored when 0.
+    """
+    now = now or datetime.now()
+    pattern = re.compile(r'{}-\d{{14}}$'.format(re.escape(prefix)))
+    ours = sorted((snap for snap in snapshots if pattern.match(snap[0])),
+                  key=lambda snap: snap[1], reverse=True)
+    expired = []
+    for index, (name, timestamp) in enumerate(ours):
+        if ((keep and index >= keep) or
+                (max_age and now - timestamp > timedelta(days=max_age))):
+            expired.append(name)
+    return expired
+
+
+def snapshot_and_prune(cluster, pool, snapshot_name, prefix, keep=0,
+                       max_age=0):
+    """
+    Snapshots a pool and removes its expired snapshots through librados.
+
+    Errors are reported against the pool rather than raised.
+    """
+    try:
+        ioctx = cluster.open_ioctx(pool)
+        try:
+            ioctx.create_snap(snapshot_name)
+            removed = []
+            if keep or max_age:
+                snapshots = [(snap.name, snap.get_timestamp())
+                             for snap in ioctx.list_snaps()]
+                for name in expired_snapshots(snapshots, prefix, keep=keep,
+                                              max_age=max_age):
+                    ioctx.remove_snap(name)
+                    removed.append(name)
+            return {'snapshot': snapshot_name, 'removed': removed}
+        finally:
+            ioctx.close()
+    except rados.Error as e:
+        return {'error': str(e)}
+
+
+def snapshot_pool_set(patterns, snapshot_name, prefix, keep=0, max_age=0,
+                      max_workers=MAX_POOL_WORKERS):
+    """
+    Snapshots every pool matching a list of globs under the same name.
+
+    The pools are snapshotted concurrently over one cluster connection and
+    the retention policy of expired_snapshots is applied to each. Returns
+    a dict of the outcome keyed by pool name.
+    """
+    cluster = connect()
+    if cluster is None:
+        action_fail("Unable to connect to the Ceph cluster")
+        return None
+    try:
+        pools = match_pools(cluster, patterns)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            outcomes = executor.map(
+                lambda pool: snapshot_and_prune(cluster, pool, snapshot_name,
+                                                prefix, keep=keep,
+                                                max_age=max_age),
+                pools)
+            return dict(zip(pools, outcomes))
+    except rados.Error as e:
+        action_fail(str(e))
+    finally:
+        cluster.shutdown()
+
+
 def delete_pool_snapshot():
     """
     Delete a pool snapshot.
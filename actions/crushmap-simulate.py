@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import binascii
+import json
+import sys
+from subprocess import CalledProcessError
+
+sys.path.append('lib')
+sys.path.append('hooks')
+
+from charmhelpers.core.hookenv import action_get, action_set, action_fail, log
+from ceph.pg_utils import simulate_crushmap
+
+if __name__ == '__main__':
+    try:
+        crushmap = base64.b64decode(action_get('map')).decode('UTF-8')
+    except (TypeError, binascii.Error, UnicodeDecodeError) as e:
+        action_fail("Unable to base64 decode the map: {}".format(e))
+        sys.exit(0)
+    try:
+        report = simulate_crushmap(crushmap, service='admin')
+    except CalledProcessError as e:
+        log(e)
+        action_fail("Simulating the CRUSH map failed with message: "
+                    "{}".format(str(e)))
+    else:
+        action_set({'message': json.dumps(report, sort_keys=True),
+                    'pgs-remapped': report['total']['pgs_remapped'],
+                    'bytes-moved': report['total']['bytes_moved']})
@@ -16,27 +16,25 @@
 
 import sys
 
+sys.path.append('lib')
 sys.path.append('hooks')
 
-import rados
-from ceph_ops import connect
+from subprocess import CalledProcessError
 from charmhelpers.core.hookenv import action_get, log, action_fail
+from ceph.broker import handle_delete_pool
 
 
 def remove_pool():
     try:
         pool_name = action_get("name")
-        cluster = connect()
         log("Deleting pool: {}".format(pool_name))
-        cluster.delete_pool(str(pool_name))  # Convert from unicode
-        cluster.shutdown()
-    except (rados.IOError,
-            rados.ObjectNotFound,
-            rados.NoData,
-            rados.NoSpace,
-            rados.PermissionError) as e:
+        ret = handle_delete_pool(request={'name': pool_name},
+                                 service='admin')
+        if ret and ret.get('exit-code'):
+            action_fail(ret['stderr'])
+    except CalledProcessError as e:
         log(e)
-        action_fail(e)
+        action_fail("Deleting pool failed with message: {}".format(str(e)))
 
 
 if __name__ == '__main__':
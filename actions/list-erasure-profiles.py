@@ -14,21 +14,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import sys
 from subprocess import check_output, CalledProcessError
 
 sys.path.append('hooks')
+sys.path.append('lib')
 
 from charmhelpers.core.hookenv import action_get, log, action_set, action_fail
+from ceph.broker import load_erasure_profiles
 
 if __name__ == '__main__':
-    name = action_get("name")
     try:
-        out = check_output(['ceph',
-                            '--id', 'admin',
-                            'osd',
-                            'erasure-code-profile',
-                            'ls']).decode('UTF-8')
+        if action_get("format") == 'json':
+            out = json.dumps(load_erasure_profiles(service='admin'),
+                             sort_keys=True)
+        else:
+            out = check_output(['ceph',
+                                '--id', 'admin',
+                                'osd',
+                                'erasure-code-profile',
+                                'ls']).decode('UTF-8')
         action_set({'message': out})
     except CalledProcessError as e:
         log(e)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sys
+from subprocess import CalledProcessError
+
+sys.path.append('lib')
+sys.path.append('hooks')
+
+from charmhelpers.core.hookenv import action_get, action_set, action_fail, log
+from ceph.pg_utils import get_pg_plan
+
+if __name__ == '__main__':
+    try:
+        plan = get_pg_plan(service='admin',
+                           pgs_per_osd=action_get('pgs-per-osd'),
+                           max_pgs_per_osd=action_get('max-pgs-per-osd'))
+    except CalledProcessError as e:
+        log(e)
+        action_fail("Planning placement groups failed with message: "
+                    "{}".format(str(e)))
+    else:
+        increases = [pool for pool in plan
+                     if pool['target_pg_num'] > pool['pg_num']]
+        action_set({'message': json.dumps(plan, sort_keys=True),
+                    'increases': len(increases)})
@@ -14,16 +14,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import sys
 from subprocess import check_output, CalledProcessError
 
 sys.path.append('hooks')
 
 from charmhelpers.core.hookenv import log, action_set, action_get, action_fail
+from ceph_ops import get_pool_matrix, parse_pool_matrix
 
-if __name__ == '__main__':
-    name = action_get('pool-name')
-    key = action_get('key')
+
+def get_matrix(matrix):
+    """Reads a matrix of pool keys and reports the value of each."""
+    try:
+        results = get_pool_matrix(parse_pool_matrix(matrix))
+    except ValueError as e:
+        action_fail(str(e))
+        return
+    if results is None:
+        return
+    action_set({'message': json.dumps(results, sort_keys=True)})
+    failed = [pool for pool, outcome in results.items()
+              if any(isinstance(value, dict) and 'error' in value
+                     for value in outcome.values())]
+    if failed:
+        action_fail("Getting pool values failed for pools: {}".format(
+            ', '.join(sorted(failed))))
+
+
+def get_single(name, key):
+    """Reads a single key of a single pool."""
     try:
         out = check_output(['ceph', '--id', 'admin',
                             'osd', 'pool', 'get', name, key]).decode('UTF-8')
@@ -31,3 +51,15 @@ if __name__ == '__main__':
     except CalledProcessError as e:
         log(e)
         action_fail("Pool get failed with message: {}".format(str(e)))
+
+
+if __name__ == '__main__':
+    matrix = action_get('matrix')
+    name = action_get('pool-name')
+    key = action_get('key')
+    if matrix:
+        get_matrix(matrix)
+    elif name and key:
+        get_single(name, key)
+    else:
+        action_fail("Either matrix or pool-name and key are required")
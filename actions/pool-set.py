@@ -15,18 +15,37 @@
 # limitations under the License.
 
 from subprocess import CalledProcessError
+import json
 import sys
 
 sys.path.append('lib')
 sys.path.append('hooks')
 
-from charmhelpers.core.hookenv import action_get, log, action_fail
+from charmhelpers.core.hookenv import action_get, action_set, log, action_fail
 from ceph.broker import handle_set_pool_value
+from ceph_ops import parse_pool_matrix, set_pool_matrix
 
-if __name__ == '__main__':
-    name = action_get("pool-name")
-    key = action_get("key")
-    value = action_get("value")
+
+def set_matrix(matrix):
+    """Applies a matrix of pool settings and reports the outcome per key."""
+    try:
+        results = set_pool_matrix(parse_pool_matrix(matrix))
+    except ValueError as e:
+        action_fail(str(e))
+        return
+    if results is None:
+        return
+    action_set({'message': json.dumps(results, sort_keys=True)})
+    failed = [pool for pool, outcome in results.items()
+              if 'error' in outcome or
+              any(isinstance(value, dict) for value in outcome.values())]
+    if failed:
+        action_fail("Setting pool values failed for pools: {}".format(
+            ', '.join(sorted(failed))))
+
+
+def set_single(name, key, value):
+    """Sets a single key on a single pool."""
     request = {'name': name,
                'key': key,
                'value': value}
@@ -37,3 +56,16 @@ if __name__ == '__main__':
         log(str(e))
         action_fail("Setting pool key: {} and value: {} failed with "
                     "message: {}".format(key, value, str(e)))
+
+
+if __name__ == '__main__':
+    matrix = action_get("matrix")
+    name = action_get("pool-name")
+    key = action_get("key")
+    value = action_get("value")
+    if matrix:
+        set_matrix(matrix)
+    elif name and key and value is not None:
+        set_single(name, key, value)
+    else:
+        action_fail("Either matrix or pool-name, key and value are required")
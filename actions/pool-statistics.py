@@ -14,13 +14,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import sys
 
 sys.path.append('hooks')
 from subprocess import check_output, CalledProcessError
-from charmhelpers.core.hookenv import log, action_set, action_fail
+from charmhelpers.core.hookenv import log, action_get, action_set, action_fail
+from ceph_ops import all_pool_stats
 
 if __name__ == '__main__':
+    if action_get("per-pool"):
+        stats = all_pool_stats(pool_glob=action_get("pools"))
+        if stats is not None:
+            action_set({'message': json.dumps(stats, sort_keys=True)})
+        sys.exit(0)
     try:
         out = check_output(['ceph', '--id', 'admin',
                             'df']).decode('UTF-8')
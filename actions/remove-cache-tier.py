@@ -14,17 +14,44 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from subprocess import CalledProcessError
+from subprocess import CalledProcessError, check_call
 import sys
 
 sys.path.append('hooks')
+sys.path.append('lib')
 
-from charmhelpers.contrib.storage.linux.ceph import Pool, pool_exists
-from charmhelpers.core.hookenv import action_get, log, action_fail
+from charmhelpers.contrib.storage.linux.ceph import (
+    Pool,
+    ceph_version,
+    get_cache_mode,
+    pool_exists,
+)
+from charmhelpers.core.hookenv import action_get, action_set, log, action_fail
+from ceph.cache_flush import start_flush_job
 
 __author__ = 'chris'
 
 
+def flush_in_background(backer_pool, cache_pool):
+    """Stop caching writes and leave the flush to a background job."""
+    cmd = ['ceph', '--id', 'admin', 'osd', 'tier', 'cache-mode',
+           cache_pool, 'forward']
+    if ceph_version() >= '10.1':
+        # Jewel added a mandatory flag
+        cmd.append('--yes-i-really-mean-it')
+    try:
+        check_call(cmd)
+    except CalledProcessError as err:
+        log("Setting forward mode failed with message: {}".format(str(err)))
+        action_fail("remove-cache-tier failed. Setting forward mode failed "
+                    "with message: {}".format(str(err)))
+        return
+    job = start_flush_job(cache_pool, backer_pool, service='admin')
+    action_set({'message': "Flushing {} in the background, follow it with "
+                           "the cache-flush-status action".format(cache_pool),
+                'pid': job['pid']})
+
+
 def delete_cache_tier():
     backer_pool = action_get("backer-pool")
     cache_pool = action_get("cache-pool")
@@ -42,6 +69,11 @@ def delete_cache_tier():
         action_fail("remove-cache-tier failed. Cache pool {} must exist "
                     "before calling this".format(cache_pool))
 
+    if (action_get("background") and
+            get_cache_mode('admin', cache_pool) == 'writeback'):
+        flush_in_background(backer_pool, cache_pool)
+        return
+
     pool = Pool(service='admin', name=backer_pool)
     try:
         pool.remove_cache_tier(cache_pool=cache_pool)
@@ -16,16 +16,20 @@
 
 import sys
 
+sys.path.append('lib')
 sys.path.append('hooks')
 from subprocess import CalledProcessError
 from charmhelpers.core.hookenv import action_get, log, action_fail
-from charmhelpers.contrib.storage.linux.ceph import rename_pool
+from ceph.broker import handle_rename_pool
 
 if __name__ == '__main__':
     name = action_get("pool-name")
     new_name = action_get("new-name")
     try:
-        rename_pool(service='admin', old_name=name, new_name=new_name)
+        ret = handle_rename_pool(request={'name': name, 'new-name': new_name},
+                                 service='admin')
+        if ret and ret.get('exit-code'):
+            action_fail(ret['stderr'])
     except CalledProcessError as e:
         log(e)
         action_fail("Renaming pool failed with message: {}".format(str(e)))
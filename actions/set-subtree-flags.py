@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sys
+import time
+from subprocess import CalledProcessError
+
+sys.path.append('lib')
+sys.path.append('hooks')
+
+from charmhelpers.core.hookenv import action_get, action_set, action_fail, log
+from ceph.utils import set_subtree_flags
+
+if __name__ == '__main__':
+    bucket = action_get('bucket')
+    flags = action_get('flags').split()
+    expires = int(time.time()) + action_get('duration') * 60
+    try:
+        targets = set_subtree_flags(bucket, flags, expires, service='admin')
+    except (CalledProcessError, ValueError) as e:
+        log(e)
+        action_fail("Setting {} on {} failed with message: {}".format(
+            ' '.join(flags), bucket, str(e)))
+    else:
+        action_set({'message': json.dumps(targets, sort_keys=True),
+                    'expires': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                             time.gmtime(expires))})
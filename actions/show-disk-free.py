@@ -14,19 +14,53 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import sys
 
 sys.path.append('hooks')
 from subprocess import check_output, CalledProcessError
 from charmhelpers.core.hookenv import log, action_get, action_set, action_fail
+from ceph_ops import (
+    flatten_osd_df_tree,
+    osd_df_rows,
+    paginate,
+    summarize_osd_df,
+    write_action_output,
+)
+
+
+def show_osds():
+    """Returns the filtered, sorted and paginated OSDs as JSON."""
+    out = check_output(['ceph', '--id', 'admin',
+                        'osd', 'df', 'tree', '-f', 'json']).decode('UTF-8')
+    rows = osd_df_rows(flatten_osd_df_tree(json.loads(out)),
+                       host=action_get("host"),
+                       root=action_get("root"),
+                       min_utilization=action_get("min-utilization"),
+                       sort_by=action_get("sort-by"))
+    result = {'summary': summarize_osd_df(rows), 'total': len(rows)}
+    if action_get("compress"):
+        # The complete listing goes to the file, only the summary is returned
+        result['path'] = write_action_output('show-disk-free',
+                                             {'osds': rows})
+    else:
+        offset = action_get("offset")
+        page = paginate(rows, offset=offset, limit=action_get("limit"))
+        result.update({'offset': offset, 'count': len(page), 'osds': page})
+    action_set({'message': json.dumps(result)})
+
 
 if __name__ == '__main__':
-    # constrained to enum: json,json-pretty,xml,xml-pretty,plain
+    # constrained to enum: json,json-pretty,xml,xml-pretty,plain,osd-list
     fmt = action_get("format")
     try:
-        out = check_output(['ceph', '--id', 'admin',
-                            'osd', 'df', 'tree', '-f', fmt]).decode('UTF-8')
-        action_set({'message': out})
+        if fmt == 'osd-list':
+            show_osds()
+        else:
+            out = check_output(['ceph', '--id', 'admin',
+                                'osd', 'df', 'tree', '-f',
+                                fmt]).decode('UTF-8')
+            action_set({'message': out})
     except CalledProcessError as e:
         log(e)
         action_fail(
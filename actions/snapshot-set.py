@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sys
+
+sys.path.append('hooks')
+
+from charmhelpers.core.hookenv import action_get, action_set, action_fail
+from ceph_ops import snapshot_pool_set, snapshot_set_name
+
+if __name__ == '__main__':
+    prefix = action_get('prefix')
+    snapshot_name = action_get('snapshot-name') or snapshot_set_name(prefix)
+    results = snapshot_pool_set(action_get('pools').split(), snapshot_name,
+                                prefix, keep=action_get('keep'),
+                                max_age=action_get('max-age'))
+    if results is not None:
+        action_set({'message': json.dumps(results, sort_keys=True),
+                    'snapshot-name': snapshot_name})
+        failed = sorted(pool for pool, outcome in results.items()
+                        if 'error' in outcome)
+        if not results:
+            action_fail("No pools matched {}".format(action_get('pools')))
+        elif failed:
+            action_fail("Snapshot failed for pools: {}".format(
+                ', '.join(failed)))
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+from subprocess import CalledProcessError
+
+sys.path.append('lib')
+sys.path.append('hooks')
+
+from charmhelpers.core.hookenv import action_get, action_set, action_fail, log
+from ceph.utils import unset_subtree_flags
+
+if __name__ == '__main__':
+    bucket = action_get('bucket')
+    flags = action_get('flags')
+    try:
+        cleared = unset_subtree_flags(
+            bucket, flags=flags.split() if flags else None, service='admin')
+    except CalledProcessError as e:
+        log(e)
+        action_fail("Clearing flags on {} failed with message: {}".format(
+            bucket, str(e)))
+    else:
+        action_set({'message': 'Cleared {} on {}'.format(
+            ' '.join(cleared) or 'no flags', bucket)})
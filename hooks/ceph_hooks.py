@@ -14,27 +14,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import json
 import os
 import subprocess
 import socket
+import sqlite3
 import sys
+import time
 import uuid
 
 sys.path.append('lib')
 import ceph.utils as ceph
+from ceph.cache_flush import (
+    flush_status_message,
+    resume_flush_jobs,
+)
 from ceph.broker import (
     process_requests
 )
 
 from charmhelpers.core import hookenv
+from charmhelpers.core import unitdata
 from charmhelpers.core.hookenv import (
     log,
     DEBUG,
+    ERROR,
     config,
     relation_ids,
     related_units,
     is_relation_made,
     relation_get,
+    prefetch_relation_data,
     relation_set,
     leader_set, leader_get,
     is_leader,
@@ -84,6 +95,11 @@ NAGIOS_PLUGINS = '/usr/local/lib/nagios/plugins'
 SCRIPTS_DIR = '/usr/local/bin'
 STATUS_FILE = '/var/lib/nagios/cat-ceph-status.txt'
 STATUS_CRONFILE = '/etc/cron.d/cat-ceph-health'
+BROKER_RSP_CACHE_KEY = 'broker-rsp-cache.{}.{}'
+# Revision history kept per unitdata key, and how often it is pruned
+UNITDATA_KEEP_REVISIONS = 10
+UNITDATA_COMPACT_INTERVAL = 24 * 60 * 60
+UNITDATA_COMPACTED_KEY = 'charm.unitdata-compacted'
 
 
 def check_for_upgrade():
@@ -246,6 +262,7 @@ def get_mon_hosts():
     rel_ids = relation_ids('mon')
     if config('no-bootstrap'):
         rel_ids += relation_ids('bootstrap-source')
+    prefetch_relation_data(rel_ids)
 
     for relid in rel_ids:
         for unit in related_units(relid):
@@ -264,7 +281,9 @@ def get_peer_units():
     """
     units = {}
     units[local_unit()] = True
-    for relid in relation_ids('mon'):
+    rel_ids = relation_ids('mon')
+    prefetch_relation_data(rel_ids)
+    for relid in rel_ids:
         for unit in related_units(relid):
             addr = relation_get('ceph-public-address', unit, relid)
             units[unit] = addr is not None
@@ -299,7 +318,9 @@ def bootstrap_source_relation_changed():
 
     curr_fsid = leader_get('fsid')
     curr_secret = leader_get('monitor-secret')
-    for relid in relation_ids('bootstrap-source'):
+    rel_ids = relation_ids('bootstrap-source')
+    prefetch_relation_data(rel_ids)
+    for relid in rel_ids:
         for unit in related_units(relid=relid):
             mon_secret = relation_get('monitor-secret', unit, relid)
             fsid = relation_get('fsid', unit, relid)
@@ -395,18 +416,23 @@ def mon_relation():
 
 
 def notify_osds():
-    for relid in relation_ids('osd'):
+    rel_ids = relation_ids('osd')
+    prefetch_relation_data(rel_ids)
+    for relid in rel_ids:
         for unit in related_units(relid):
             osd_relation(relid=relid, unit=unit)
 
 
 def notify_radosgws():
-    for relid in relation_ids('radosgw'):
+    rel_ids = relation_ids('radosgw')
+    prefetch_relation_data(rel_ids)
+    for relid in rel_ids:
         for unit in related_units(relid):
             radosgw_relation(relid=relid, unit=unit)
 
 
 def notify_client():
+    prefetch_relation_data(relation_ids('client') + relation_ids('mds'))
     for relid in relation_ids('client'):
         client_relation_joined(relid)
         for unit in related_units(relid):
@@ -418,6 +444,63 @@ def notify_client():
             mds_relation_joined(relid=relid, unit=unit)
 
 
+def process_broker_request(relid, unit, broker_req):
+    """Process a broker request from a remote unit, replaying the stored
+    response when the unit resends a request that was already handled.
+
+    Responses are cached per relation and remote unit together with the
+    request id and a digest of the requested ops. A cached response is only
+    replayed while the pools the request created are still present in the
+    cluster.
+
+    :param relid: The relation the request was received on, defaults to the
+                  relation of the running hook.
+    :param unit: The remote unit the request was received from.
+    :param broker_req: The JSON encoded broker request.
+    :returns: The JSON encoded broker response.
+    """
+    try:
+        request = json.loads(broker_req)
+        digest = hashlib.sha256(json.dumps(request['ops'], sort_keys=True)
+                                .encode('UTF-8')).hexdigest()
+    except (ValueError, TypeError, KeyError):
+        return process_requests(broker_req)
+
+    db = unitdata.kv()
+    cache_key = BROKER_RSP_CACHE_KEY.format(relid or hookenv.relation_id(),
+                                            unit)
+    cached = db.get(cache_key)
+    if (cached and cached['request-id'] == request.get('request-id') and
+            cached['digest'] == digest and
+            broker_request_applied(request['ops'])):
+        log('Replaying cached response to broker request {} from {}'
+            .format(request.get('request-id'), unit), level=DEBUG)
+        return cached['rsp']
+
+    rsp = process_requests(broker_req)
+    if json.loads(rsp).get('exit-code') == 0:
+        db.set(cache_key, {'request-id': request.get('request-id'),
+                           'digest': digest,
+                           'rsp': rsp})
+    return rsp
+
+
+def broker_request_applied(ops):
+    """Check that the pools created by a broker request still exist.
+
+    :param ops: list of broker request operations.
+    :returns: boolean. True if every requested pool is present.
+    """
+    pools = set(op.get('name') for op in ops
+                if op.get('op') == 'create-pool' and op.get('name'))
+    if not pools:
+        return True
+    try:
+        return pools.issubset(ceph.list_pools('admin'))
+    except subprocess.CalledProcessError:
+        return False
+
+
 @hooks.hook('osd-relation-joined')
 @hooks.hook('osd-relation-changed')
 def osd_relation(relid=None, unit=None):
@@ -438,7 +521,8 @@ def osd_relation(relid=None, unit=None):
         """Process broker request(s)."""
         if 'broker_req' in settings:
             if ceph.is_leader():
-                rsp = process_requests(settings['broker_req'])
+                rsp = process_broker_request(relid, unit,
+                                             settings['broker_req'])
                 unit_id = unit.replace('/', '-')
                 unit_response_key = 'broker-rsp-' + unit_id
                 data[unit_response_key] = rsp
@@ -496,7 +580,8 @@ def radosgw_relation(relid=None, unit=None):
         """Process broker request(s)."""
         if 'broker_req' in settings:
             if ceph.is_leader():
-                rsp = process_requests(settings['broker_req'])
+                rsp = process_broker_request(relid, unit,
+                                             settings['broker_req'])
                 unit_id = unit.replace('/', '-')
                 unit_response_key = 'broker-rsp-' + unit_id
                 data[unit_response_key] = rsp
@@ -528,7 +613,8 @@ def mds_relation_joined(relid=None, unit=None):
         """Process broker request(s)."""
         if 'broker_req' in settings:
             if ceph.is_leader():
-                rsp = process_requests(settings['broker_req'])
+                rsp = process_broker_request(relid, unit,
+                                             settings['broker_req'])
                 unit_id = unit.replace('/', '-')
                 unit_response_key = 'broker-rsp-' + unit_id
                 data[unit_response_key] = rsp
@@ -597,7 +683,8 @@ def client_relation_changed(relid=None, unit=None):
             if not ceph.is_leader():
                 log("Not leader - ignoring broker request", level=DEBUG)
             else:
-                rsp = process_requests(settings['broker_req'])
+                rsp = process_broker_request(relid, unit,
+                                             settings['broker_req'])
                 unit_id = unit.replace('/', '-')
                 unit_response_key = 'broker-rsp-' + unit_id
                 # broker_rsp is being left for backward compatibility,
@@ -704,7 +791,11 @@ def assess_status():
 
     # active - bootstrapped + quorum status check
     if ceph.is_bootstrapped() and ceph.is_quorum():
-        status_set('active', 'Unit is ready and clustered')
+        message = 'Unit is ready and clustered'
+        flushing = flush_status_message()
+        if flushing:
+            message = '{}, {}'.format(message, flushing)
+        status_set('active', message)
     else:
         # Unit should be running and clustered, but no quorum
         # TODO: should this be blocked or waiting?
@@ -714,15 +805,54 @@ def assess_status():
         # reboot the ceph-mon process
 
 
+def compact_unit_state(now=None):
+    """Prune old unitdata revisions and compact the database file.
+
+    Runs at most once per UNITDATA_COMPACT_INTERVAL. Pruning commits pending
+    writes, so this is only run from an atexit callback, once the hook has
+    succeeded.
+    """
+    now = now or time.time()
+    db = unitdata.kv()
+    if now - db.get(UNITDATA_COMPACTED_KEY, 0) < UNITDATA_COMPACT_INTERVAL:
+        return
+    try:
+        pruned = db.prune_revisions(keep=UNITDATA_KEEP_REVISIONS)
+        db.compact()
+        db.set(UNITDATA_COMPACTED_KEY, now)
+    except sqlite3.OperationalError as e:
+        # e.g. locked by another process, try again next time
+        log('Unable to compact unit state: {}'.format(e), level=DEBUG)
+        return
+    log('Pruned {} unit state revisions'.format(pruned), level=DEBUG)
+
+
 @hooks.hook('update-status')
 @harden()
 def update_status():
     log('Updating status.')
+    hookenv.atexit(compact_unit_state)
+    for cache_pool in resume_flush_jobs():
+        log('Resumed the interrupted flush of cache pool {}'.format(
+            cache_pool))
+    if is_leader() and ceph.is_bootstrapped():
+        try:
+            ceph.expire_subtree_flags()
+        except subprocess.CalledProcessError as e:
+            log('Unable to clear expired OSD flags: {}'.format(e),
+                level=ERROR)
 
 
 if __name__ == '__main__':
+    hookenv.buffer_log()
+    hookenv.buffer_relation_set()
+    # Unit state is committed once, after the hook and any other atexit
+    # callbacks have succeeded
+    hookenv.atexit(unitdata.kv().flush)
     try:
         hooks.execute(sys.argv)
     except UnregisteredHookError as e:
         log('Unknown hook {} - skipping.'.format(e))
+    hookenv.flush_relation_set()
     assess_status()
+    hookenv.log_cache_stats()
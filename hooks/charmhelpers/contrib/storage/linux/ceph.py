@@ -196,7 +196,8 @@ class Pool(object):
             check_call(['ceph', '--id', self.service, 'osd', 'tier', 'remove-overlay', self.name])
             check_call(['ceph', '--id', self.service, 'osd', 'tier', 'remove', self.name, cache_pool])
 
-    def get_pgs(self, pool_size, percent_data=DEFAULT_POOL_WEIGHT):
+    def get_pgs(self, pool_size, percent_data=DEFAULT_POOL_WEIGHT,
+                osd_count=None):
         """Return the number of placement groups to use when creating the pool.
 
         Returns the number of placement groups which should be specified when
@@ -216,9 +217,11 @@ class Pool(object):
         the default rule will be dependent upon the type of pool being
         created (replicated or erasure).
 
-        This code makes no attempt to determine the number of OSDs which can be
-        selected for the specific rule, rather it is left to the user to tune
-        in the form of 'expected-osd-count' config option.
+        Callers which know the CRUSH rule the pool will use should pass the
+        number of OSDs that rule can select as osd_count. Otherwise no attempt
+        is made to determine the number of OSDs which can be selected for the
+        specific rule, rather it is left to the user to tune in the form of
+        'expected-osd-count' config option.
 
         :param pool_size: int. pool_size is either the number of replicas for
             replicated pools or the K+M sum for erasure coded pools
@@ -229,6 +232,10 @@ class Pool(object):
             increased. NOTE: the default is primarily to handle the scenario
             where related charms requiring pools has not been upgraded to
             include an update to indicate their relative usage of the pools.
+        :param osd_count: int. the number of OSDs eligible to be selected by
+            the pool's CRUSH rule. When not provided every OSD in the cluster
+            is counted, and expected-osd-count is used if larger. Otherwise
+            expected-osd-count is scaled by the rule's share of the OSDs.
         :return: int.  The number of pgs to use.
         """
 
@@ -243,10 +250,18 @@ class Pool(object):
 
         # If the expected-osd-count is specified, then use the max between
         # the expected-osd-count and the actual osd_count
-        osd_list = get_osds(self.service)
         expected = config('expected-osd-count') or 0
-
-        if osd_list:
+        osd_list = None if osd_count else get_osds(self.service)
+
+        if osd_count:
+            # The OSDs eligible for the pool's CRUSH rule are already known.
+            # expected-osd-count is for the whole cluster, so only the rule's
+            # share of it is used to allow for OSDs still being deployed.
+            all_osds = get_osds(self.service) if expected else None
+            if all_osds:
+                share = float(min(osd_count, len(all_osds))) / len(all_osds)
+                osd_count = max(int(expected * share), osd_count)
+        elif osd_list:
             osd_count = max(expected, len(osd_list))
 
             # Log a message to provide some insight if the calculations claim
@@ -291,16 +306,17 @@ class Pool(object):
 
 class ReplicatedPool(Pool):
     def __init__(self, service, name, pg_num=None, replicas=2,
-                 percent_data=10.0):
+                 percent_data=10.0, osd_count=None):
         super(ReplicatedPool, self).__init__(service=service, name=name)
         self.replicas = replicas
         if pg_num:
             # Since the number of placement groups were specified, ensure
             # that there aren't too many created.
-            max_pgs = self.get_pgs(self.replicas, 100.0)
+            max_pgs = self.get_pgs(self.replicas, 100.0, osd_count=osd_count)
             self.pg_num = min(pg_num, max_pgs)
         else:
-            self.pg_num = self.get_pgs(self.replicas, percent_data)
+            self.pg_num = self.get_pgs(self.replicas, percent_data,
+                                       osd_count=osd_count)
 
     def create(self):
         if not pool_exists(self.service, self.name):
@@ -320,18 +336,23 @@ class ReplicatedPool(Pool):
 # Default jerasure erasure coded pool
 class ErasurePool(Pool):
     def __init__(self, service, name, erasure_code_profile="default",
-                 percent_data=10.0):
+                 percent_data=10.0, osd_count=None, profile=None):
         super(ErasurePool, self).__init__(service=service, name=name)
         self.erasure_code_profile = erasure_code_profile
         self.percent_data = percent_data
+        self.osd_count = osd_count
+        # The parameters of erasure_code_profile, if already known
+        self.profile = profile
 
     def create(self):
         if not pool_exists(self.service, self.name):
             # Try to find the erasure profile information in order to properly
             # size the number of placement groups. The size of an erasure
             # coded placement group is calculated as k+m.
-            erasure_profile = get_erasure_profile(self.service,
-                                                  self.erasure_code_profile)
+            erasure_profile = self.profile
+            if erasure_profile is None:
+                erasure_profile = get_erasure_profile(
+                    self.service, self.erasure_code_profile)
 
             # Check for errors
             if erasure_profile is None:
@@ -348,7 +369,8 @@ class ErasurePool(Pool):
 
             k = int(erasure_profile['k'])
             m = int(erasure_profile['m'])
-            pgs = self.get_pgs(k + m, self.percent_data)
+            pgs = self.get_pgs(k + m, self.percent_data,
+                               osd_count=self.osd_count)
             # Create it
             cmd = ['ceph', '--id', self.service, 'osd', 'pool', 'create',
                    self.name, str(pgs), str(pgs),
@@ -606,7 +628,8 @@ def remove_erasure_profile(service, profile_name):
 def create_erasure_profile(service, profile_name, erasure_plugin_name='jerasure',
                            failure_domain='host',
                            data_chunks=2, coding_chunks=1,
-                           locality=None, durability_estimator=None):
+                           locality=None, durability_estimator=None,
+                           exists=None):
     """
     Create a new erasure code profile if one does not already exist for it.  Updates
     the profile if it exists. Please see http://docs.ceph.com/docs/master/rados/operations/erasure-code-profile/
@@ -620,6 +643,7 @@ def create_erasure_profile(service, profile_name, erasure_plugin_name='jerasure'
     :param coding_chunks: int
     :param locality: int
     :param durability_estimator: int
+    :param exists: bool. Whether the profile already exists, looked up if None
     :return: None.  Can raise CalledProcessError
     """
     version = ceph_version()
@@ -648,7 +672,9 @@ def create_erasure_profile(service, profile_name, erasure_plugin_name='jerasure'
         # For Shec erasure codes
         cmd.append('c=' + str(durability_estimator))
 
-    if erasure_profile_exists(service, profile_name):
+    if exists is None:
+        exists = erasure_profile_exists(service, profile_name)
+    if exists:
         cmd.append('--force')
 
     try:
@@ -804,7 +830,7 @@ def create_pool(service, name, replicas=3, pg_num=None):
 
 def delete_pool(service, name):
     """Delete a RADOS pool from ceph."""
-    cmd = ['ceph', '--id', service, 'osd', 'pool', 'delete', name,
+    cmd = ['ceph', '--id', service, 'osd', 'pool', 'delete', name, name,
            '--yes-i-really-really-mean-it']
     check_call(cmd)
 
@@ -19,10 +19,11 @@
 #  Charm Helpers Developers <juju@lists.ubuntu.com>
 
 from __future__ import print_function
+import atexit as sys_atexit
 import copy
 from distutils.version import LooseVersion
 from functools import wraps
-from collections import namedtuple
+from collections import defaultdict, namedtuple, OrderedDict
 import glob
 import os
 import json
@@ -48,7 +49,93 @@ DEBUG = "DEBUG"
 TRACE = "TRACE"
 MARKER = object()
 
-cache = {}
+# Relative severity of the juju-log levels, unknown levels count as INFO
+LOG_LEVELS = {
+    TRACE: 5,
+    DEBUG: 10,
+    INFO: 20,
+    WARNING: 30,
+    ERROR: 40,
+    CRITICAL: 50,
+}
+
+
+class HookCache(object):
+    """Return values of @cached functions for the rest of the hook.
+
+    Entries are keyed on the function and its arguments. Each entry is also
+    indexed under the function's name and under every string argument it
+    was called with, such as a unit name or relation id, so that flushing
+    one of those only visits the entries that mention it.
+
+    Hits and misses are counted per function name, see :meth:`stats`.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.index = defaultdict(set)
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    @staticmethod
+    def _key(func, args, kwargs):
+        key = (func, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # Unhashable arguments such as lists or dicts
+            key = (func, repr(args), repr(sorted(kwargs.items())))
+        return key
+
+    @staticmethod
+    def _tags(func, args, kwargs):
+        tags = set([func.__name__])
+        for value in list(args) + list(kwargs.values()):
+            if isinstance(value, six.string_types):
+                tags.add(value)
+        return tags
+
+    def get(self, func, args, kwargs):
+        """Return (True, value) if cached, else (False, None)."""
+        key = self._key(func, args, kwargs)
+        if key in self.entries:
+            self.hits[func.__name__] += 1
+            return True, self.entries[key]
+        self.misses[func.__name__] += 1
+        return False, None
+
+    def set(self, func, args, kwargs, value):
+        key = self._key(func, args, kwargs)
+        self.entries[key] = value
+        for tag in self._tags(func, args, kwargs):
+            self.index[tag].add(key)
+
+    def flush(self, tag):
+        """Drop every entry for the function named tag or called with tag
+        as one of its arguments."""
+        for key in self.index.pop(tag, ()):
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry and reset the hit and miss counts."""
+        self.entries.clear()
+        self.index.clear()
+        self.hits.clear()
+        self.misses.clear()
+
+    def stats(self):
+        """Hit and miss counts per function name.
+
+        :returns: Dict[str, Tuple[int, int]]. Maps name to (hits, misses).
+        """
+        return dict((name, (self.hits[name], self.misses[name]))
+                    for name in set(self.hits) | set(self.misses))
+
+    def __len__(self):
+        return len(self.entries)
+
+
+cache = HookCache()
 
 
 def cached(func):
@@ -66,37 +153,35 @@ def cached(func):
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        global cache
-        key = str((func, args, kwargs))
-        try:
-            return cache[key]
-        except KeyError:
-            pass  # Drop out of the exception handler scope.
+        found, res = cache.get(func, args, kwargs)
+        if found:
+            return res
         res = func(*args, **kwargs)
-        cache[key] = res
+        cache.set(func, args, kwargs, res)
         return res
     wrapper._wrapped = func
     return wrapper
 
 
 def flush(key):
-    """Flushes any entries from function cache where the
-    key is found in the function+args """
-    flush_list = []
-    for item in cache:
-        if key in item:
-            flush_list.append(item)
-    for item in flush_list:
-        del cache[item]
+    """Flushes any entries from function cache for the function named key
+    or that were called with key as an argument"""
+    cache.flush(key)
 
 
-def log(message, level=None):
-    """Write a message to the juju log"""
+def log_cache_stats(level=DEBUG):
+    """Log the hit and miss counts of the function cache."""
+    stats = cache.stats()
+    if stats:
+        log('Function cache hits/misses: {}'.format(', '.join(
+            '{} {}/{}'.format(name, hits, misses)
+            for name, (hits, misses) in sorted(stats.items()))), level=level)
+
+
+def _juju_log(message, level=None):
     command = ['juju-log']
     if level:
         command += ['-l', level]
-    if not isinstance(message, six.string_types):
-        message = repr(message)
     command += [message]
     # Missing juju-log should not cause failures in unit tests
     # Send log output to stderr
@@ -112,6 +197,74 @@ def log(message, level=None):
             raise
 
 
+_log_buffer = None
+
+
+def log(message, level=None):
+    """Write a message to the juju log"""
+    if not isinstance(message, six.string_types):
+        message = repr(message)
+    if _log_buffer is not None:
+        _log_buffer.add(message, level)
+    else:
+        _juju_log(message, level)
+
+
+class LogBuffer(object):
+    """Collects log messages and writes them to the juju log in batches.
+
+    Messages below min_level are dropped before anything else is done. The
+    remaining messages are held until max_messages are pending or flush is
+    called, and then written with one juju-log call per run of messages
+    sharing a level.
+    """
+
+    def __init__(self, min_level=None, max_messages=50):
+        self.min_level = LOG_LEVELS.get((min_level or TRACE).upper(), 0)
+        self.max_messages = max_messages
+        self.pending = []
+
+    def add(self, message, level=None):
+        severity = LOG_LEVELS.get((level or INFO).upper(), LOG_LEVELS[INFO])
+        if severity < self.min_level:
+            return
+        self.pending.append((level, message))
+        if len(self.pending) >= self.max_messages:
+            self.flush()
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        while pending:
+            level = pending[0][0]
+            count = 1
+            while count < len(pending) and pending[count][0] == level:
+                count += 1
+            _juju_log('\n'.join(message for _, message in pending[:count]),
+                      level)
+            pending = pending[count:]
+
+
+def buffer_log(min_level=None, max_messages=50):
+    """Buffer log messages for the rest of the process, see LogBuffer.
+
+    Pending messages are flushed when the process exits.
+
+    :returns: LogBuffer. The buffer in use.
+    """
+    global _log_buffer
+    if _log_buffer is None:
+        _log_buffer = LogBuffer(min_level=min_level,
+                                max_messages=max_messages)
+        sys_atexit.register(flush_log)
+    return _log_buffer
+
+
+def flush_log():
+    """Write any buffered log messages to the juju log."""
+    if _log_buffer is not None:
+        _log_buffer.flush()
+
+
 class Serializable(UserDict):
     """Wrapper, an object that can be serialized to yaml or json"""
 
@@ -354,27 +507,50 @@ class Config(dict):
 
 
 @cached
-def config(scope=None):
-    """Juju charm configuration"""
-    config_cmd_line = ['config-get']
-    if scope is not None:
-        config_cmd_line.append(scope)
-    else:
-        config_cmd_line.append('--all')
-    config_cmd_line.append('--format=json')
+def _config_data():
+    """Load the complete charm configuration with a single config-get.
+
+    Scoped lookups through :func:`config` read this data directly. It is
+    kept apart from the :class:`Config` object, which also carries previous
+    values for options that config-get leaves out once they are unset.
+    """
+    config_cmd_line = ['config-get', '--all', '--format=json']
     try:
-        config_data = json.loads(
+        return json.loads(
             subprocess.check_output(config_cmd_line).decode('UTF-8'))
-        if scope is not None:
-            return config_data
-        return Config(config_data)
     except ValueError:
         return None
 
 
+@cached
+def _config_all():
+    config_data = _config_data()
+    if config_data is None:
+        return None
+    return Config(copy.deepcopy(config_data))
+
+
+def config(scope=None):
+    """Juju charm configuration"""
+    if scope is None:
+        return _config_all()
+    config_data = _config_data()
+    if config_data is None:
+        return None
+    return copy.deepcopy(config_data.get(scope))
+
+
 @cached
 def relation_get(attribute=None, unit=None, rid=None):
     """Get relation information"""
+    if _relation_buffer is not None and unit and unit == local_unit():
+        # Pending writes must be visible when reading back our own data
+        _relation_buffer.flush(rid)
+    if unit and rid and (rid, unit) in _relation_data:
+        settings = _relation_data[(rid, unit)]
+        if attribute is None:
+            return settings.copy()
+        return settings.get(attribute)
     _args = ['relation-get', '--format=json']
     if rid:
         _args.append('-r')
@@ -392,22 +568,57 @@ def relation_get(attribute=None, unit=None, rid=None):
         raise
 
 
-def relation_set(relation_id=None, relation_settings=None, **kwargs):
-    """Set relation information for the current unit"""
-    relation_settings = relation_settings if relation_settings else {}
+_relation_data = {}
+
+
+def prefetch_relation_data(relation_ids, max_workers=8):
+    """Load the settings of every related unit on relation_ids up front.
+
+    Each unit's settings are read with one ``relation-get -``, run
+    max_workers at a time. Later relation_get calls for those units and
+    relation ids, with or without an attribute, are answered from memory
+    instead of forking relation-get again. Units that were already
+    loaded are skipped, so calling this more than once is cheap.
+
+    :param relation_ids: List[str]. Relation ids to load.
+    :param max_workers: int. Number of relation-get calls run at once.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    wanted = [(rid, unit)
+              for rid in relation_ids or []
+              for unit in related_units(rid)
+              if (rid, unit) not in _relation_data]
+    if not wanted:
+        return
+
+    def load(key):
+        rid, unit = key
+        return relation_get._wrapped(unit=unit, rid=rid) or {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for key, settings in zip(wanted, executor.map(load, wanted)):
+            _relation_data[key] = settings
+
+
+_relation_set_accepts_file = None
+_relation_buffer = None
+
+
+def relation_set_accepts_file():
+    """Whether relation-set supports --file, probed once per process."""
+    global _relation_set_accepts_file
+    if _relation_set_accepts_file is None:
+        _relation_set_accepts_file = "--file" in subprocess.check_output(
+            ['relation-set', '--help'], universal_newlines=True)
+    return _relation_set_accepts_file
+
+
+def _relation_set(relation_id, settings):
     relation_cmd_line = ['relation-set']
-    accepts_file = "--file" in subprocess.check_output(
-        relation_cmd_line + ["--help"], universal_newlines=True)
     if relation_id is not None:
         relation_cmd_line.extend(('-r', relation_id))
-    settings = relation_settings.copy()
-    settings.update(kwargs)
-    for key, value in settings.items():
-        # Force value to be a string: it always should, but some call
-        # sites pass in things like dicts or numbers.
-        if value is not None:
-            settings[key] = "{}".format(value)
-    if accepts_file:
+    if relation_set_accepts_file():
         # --file was introduced in Juju 1.23.2. Use it by default if
         # available, since otherwise we'll break if the relation data is
         # too big. Ideally we should tell relation-set to read the data from
@@ -424,10 +635,91 @@ def relation_set(relation_id=None, relation_settings=None, **kwargs):
             else:
                 relation_cmd_line.append('{}={}'.format(key, value))
         subprocess.check_call(relation_cmd_line)
+
+
+def relation_set(relation_id=None, relation_settings=None, **kwargs):
+    """Set relation information for the current unit"""
+    relation_settings = relation_settings if relation_settings else {}
+    settings = relation_settings.copy()
+    settings.update(kwargs)
+    for key, value in settings.items():
+        # Force value to be a string: it always should, but some call
+        # sites pass in things like dicts or numbers.
+        if value is not None:
+            settings[key] = "{}".format(value)
+    if _relation_buffer is not None:
+        _relation_buffer.add(relation_id, settings)
+        return
+    _relation_set(relation_id, settings)
     # Flush cache of any relation-gets for local unit
     flush(local_unit())
 
 
+class RelationBuffer(object):
+    """Collects relation settings and writes them per relation id.
+
+    Settings for the same relation id are merged, later values winning,
+    and written with a single relation-set call when flush is called.
+    Reading the local unit's settings back with relation_get writes out
+    that relation id's pending settings first, so callers see their own
+    writes as they would without the buffer.
+    """
+
+    def __init__(self):
+        self.pending = OrderedDict()
+
+    @staticmethod
+    def _key(rid):
+        return rid if rid is not None else relation_id()
+
+    def add(self, relation_id, settings):
+        key = self._key(relation_id)
+        if key not in self.pending:
+            # Any cached read of our own data is stale from here on. Later
+            # writes to the same id need not flush again: a read in between
+            # would already have written the pending settings out.
+            flush(local_unit())
+            self.pending[key] = {}
+        self.pending[key].update(settings)
+
+    def flush(self, relation_id=None):
+        """Write pending settings for relation_id, or for every relation id
+        if relation_id is None."""
+        if relation_id is None:
+            keys = list(self.pending)
+        else:
+            keys = [self._key(relation_id)]
+        written = False
+        for key in keys:
+            settings = self.pending.pop(key, None)
+            if settings:
+                _relation_set(key, settings)
+                written = True
+        if written:
+            flush(local_unit())
+
+
+def buffer_relation_set():
+    """Buffer relation_set calls for the rest of the process, see
+    RelationBuffer.
+
+    Pending settings are not written automatically; the hook must call
+    flush_relation_set before it exits so that failures are reported.
+
+    :returns: RelationBuffer. The buffer in use.
+    """
+    global _relation_buffer
+    if _relation_buffer is None:
+        _relation_buffer = RelationBuffer()
+    return _relation_buffer
+
+
+def flush_relation_set():
+    """Write any buffered relation settings with relation-set."""
+    if _relation_buffer is not None:
+        _relation_buffer.flush()
+
+
 def relation_clear(r_id=None):
     ''' Clears any relation data already set on relation r_id '''
     settings = relation_get(rid=r_id,
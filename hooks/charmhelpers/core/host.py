@@ -23,6 +23,7 @@ import os
 import re
 import pwd
 import glob
+import stat
 import grp
 import random
 import string
@@ -883,16 +884,26 @@ def chdir(directory):
         os.chdir(cur)
 
 
-def chownr(path, owner, group, follow_links=True, chowntopdir=False):
+def chownr(path, owner, group, follow_links=True, chowntopdir=False,
+           max_workers=8, progress=None):
     """Recursively change user and group ownership of files and directories
     in given path. Doesn't chown path itself by default, only its children.
 
+    Directories are read with os.scandir by a pool of max_workers threads,
+    and entries that already have the requested uid and gid are left alone.
+
     :param str path: The string path to start changing ownership.
     :param str owner: The owner string to use when looking up the uid.
     :param str group: The group string to use when looking up the gid.
     :param bool follow_links: Also follow and chown links if True
     :param bool chowntopdir: Also chown path itself if True
+    :param int max_workers: Number of directories scanned at once.
+    :param progress: Optional callable, called as progress(checked, changed)
+        with running totals each time a directory has been processed.
+    :return tuple(int, int): Number of entries checked and changed.
     """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
     uid = pwd.getpwnam(owner).pw_uid
     gid = grp.getgrnam(group).gr_gid
     if follow_links:
@@ -900,16 +911,62 @@ def chownr(path, owner, group, follow_links=True, chowntopdir=False):
     else:
         chown = os.lchown
 
+    def fix(full, st):
+        if st.st_uid == uid and st.st_gid == gid:
+            return 0
+        chown(full, uid, gid)
+        return 1
+
+    def scan(directory):
+        subdirs = []
+        checked = changed = 0
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            # Removed or unreadable, as os.walk would skip it
+            return subdirs, checked, changed
+        for entry in entries:
+            try:
+                if (not follow_links and entry.is_symlink() and
+                        not os.path.exists(entry.path)):
+                    continue
+                st = entry.stat(follow_symlinks=follow_links)
+            except OSError:
+                # Broken symlink, or removed since the scan
+                continue
+            checked += 1
+            changed += fix(entry.path, st)
+            if stat.S_ISDIR(st.st_mode):
+                subdirs.append((entry.path, (st.st_dev, st.st_ino)))
+        return subdirs, checked, changed
+
+    checked = changed = 0
     if chowntopdir:
         broken_symlink = os.path.lexists(path) and not os.path.exists(path)
         if not broken_symlink:
-            chown(path, uid, gid)
-    for root, dirs, files in os.walk(path, followlinks=follow_links):
-        for name in dirs + files:
-            full = os.path.join(root, name)
-            broken_symlink = os.path.lexists(full) and not os.path.exists(full)
-            if not broken_symlink:
-                chown(full, uid, gid)
+            checked += 1
+            changed += fix(path, os.stat(path) if follow_links
+                           else os.lstat(path))
+    if not os.path.isdir(path):
+        return checked, changed
+    top = os.stat(path)
+    # Guards against symlink loops when following links
+    seen = set([(top.st_dev, top.st_ino)])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set([executor.submit(scan, path)])
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, dir_checked, dir_changed = future.result()
+                checked += dir_checked
+                changed += dir_changed
+                for subdir, key in subdirs:
+                    if key not in seen:
+                        seen.add(key)
+                        pending.add(executor.submit(scan, subdir))
+                if progress:
+                    progress(checked, changed)
+    return checked, changed
 
 
 def lchownr(path, owner, group):
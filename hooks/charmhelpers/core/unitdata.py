@@ -156,6 +156,8 @@ import pprint
 import sqlite3
 import sys
 
+import six
+
 __author__ = 'Kapil Thangavelu <kapil.foss@gmail.com>'
 
 
@@ -177,10 +179,13 @@ class Storage(object):
                     os.environ.get('CHARM_DIR', ''), '.unit-state.db')
         with open(self.db_path, 'a') as f:
             os.fchmod(f.fileno(), 0o600)
-        self.conn = sqlite3.connect('%s' % self.db_path)
+        # Transactions are begun explicitly, see _begin. Before Python 3.6
+        # the sqlite3 module would otherwise commit before every savepoint.
+        self.conn = sqlite3.connect('%s' % self.db_path, isolation_level=None)
         self.cursor = self.conn.cursor()
         self.revision = None
         self._closed = False
+        self._savepoints = 0
         self._init()
 
     def close(self):
@@ -210,8 +215,9 @@ class Storage(object):
             names in the returned dict
         :return dict: A (possibly empty) dict of key-value mappings
         """
-        self.cursor.execute("select key, data from kv where key like ?",
-                            ['%s%%' % key_prefix])
+        where, params = _prefix_range(key_prefix)
+        self.cursor.execute("select key, data from kv where %s" % where,
+                            params)
         result = self.cursor.fetchall()
 
         if not result:
@@ -229,13 +235,14 @@ class Storage(object):
         :param str prefix: Optional prefix to apply to all keys in `mapping`
             before setting
         """
-        for k, v in mapping.items():
-            self.set("%s%s" % (prefix, k), v)
+        self._upsert([("%s%s" % (prefix, k), json.dumps(v))
+                      for k, v in mapping.items()])
 
     def unset(self, key):
         """
         Remove a key from the database entirely.
         """
+        self._begin()
         self.cursor.execute('delete from kv where key=?', [key])
         if self.revision and self.cursor.rowcount:
             self.cursor.execute(
@@ -251,6 +258,7 @@ class Storage(object):
         :param str prefix: Optional prefix to apply to all keys in ``keys``
             before removing.
         """
+        self._begin()
         if keys is not None:
             keys = ['%s%s' % (prefix, key) for key in keys]
             self.cursor.execute('delete from kv where key in (%s)' % ','.join(['?'] * len(keys)), keys)
@@ -259,8 +267,8 @@ class Storage(object):
                     'insert into kv_revisions values %s' % ','.join(['(?, ?, ?)'] * len(keys)),
                     list(itertools.chain.from_iterable((key, self.revision, json.dumps('DELETED')) for key in keys)))
         else:
-            self.cursor.execute('delete from kv where key like ?',
-                                ['%s%%' % prefix])
+            where, params = _prefix_range(prefix)
+            self.cursor.execute('delete from kv where %s' % where, params)
             if self.revision and self.cursor.rowcount:
                 self.cursor.execute(
                     'insert into kv_revisions values (?, ?, ?)',
@@ -273,50 +281,61 @@ class Storage(object):
         :param str key: Key to set the value for
         :param value: Any JSON-serializable value to be set
         """
-        serialized = json.dumps(value)
+        self._upsert([(key, json.dumps(value))])
+        return value
 
-        self.cursor.execute('select data from kv where key=?', [key])
-        exists = self.cursor.fetchone()
+    def _begin(self):
+        """Start a transaction for the writes that follow, unless one, or
+        a :meth:`transaction` block, is already open."""
+        if not self.conn.in_transaction:
+            self.cursor.execute('begin')
 
-        # Skip mutations to the same value
-        if exists:
-            if exists[0] == serialized:
-                return value
+    def _upsert(self, rows):
+        """Write (key, serialized) rows whose data differs from the stored
+        value, and record them against the current hook revision.
 
-        if not exists:
-            self.cursor.execute(
-                'insert into kv (key, data) values (?, ?)',
-                (key, serialized))
-        else:
-            self.cursor.execute('''
-            update kv
-            set data = ?
-            where key = ?''', [serialized, key])
-
-        # Save
-        if not self.revision:
-            return value
+        Both statements skip unchanged rows in SQL, so a batch of any size
+        costs two executemany calls.
+        """
+        if not rows:
+            return
+        self._begin()
+        if self.revision:
+            # Must run first: it compares against the values being replaced
+            self.cursor.executemany(
+                '''insert or replace into kv_revisions (revision, key, data)
+                select ?, ?, ?
+                where not exists (
+                    select 1 from kv where key = ? and data = ?)''',
+                [(self.revision, key, data, key, data) for key, data in rows])
+        self.cursor.executemany(
+            '''insert or replace into kv (key, data)
+            select ?, ?
+            where not exists (select 1 from kv where key = ? and data = ?)''',
+            [(key, data, key, data) for key, data in rows])
 
-        self.cursor.execute(
-            'select 1 from kv_revisions where key=? and revision=?',
-            [key, self.revision])
-        exists = self.cursor.fetchone()
+    @contextlib.contextmanager
+    def transaction(self):
+        """Apply the writes made in the block together or not at all.
 
-        if not exists:
-            self.cursor.execute(
-                '''insert into kv_revisions (
-                revision, key, data) values (?, ?, ?)''',
-                (self.revision, key, serialized))
+        Transactions nest. An exception rolls back only the writes made in
+        the block and is re-raised. Otherwise the writes are kept, and are
+        committed on leaving the block if no other writes were pending when
+        it was entered; inside a hook scope they are committed with it.
+        """
+        name = 'unitdata_%d' % self._savepoints
+        self._savepoints += 1
+        self.cursor.execute('savepoint %s' % name)
+        try:
+            yield self
+        except Exception:
+            self.cursor.execute('rollback to %s' % name)
+            self.cursor.execute('release %s' % name)
+            raise
         else:
-            self.cursor.execute(
-                '''
-                update kv_revisions
-                set data = ?
-                where key = ?
-                and   revision = ?''',
-                [serialized, key, self.revision])
-
-        return value
+            self.cursor.execute('release %s' % name)
+        finally:
+            self._savepoints -= 1
 
     def delta(self, mapping, prefix):
         """
@@ -352,6 +371,7 @@ class Storage(object):
         """Scope all future interactions to the current hook execution
         revision."""
         assert not self.revision
+        self._begin()
         self.cursor.execute(
             'insert into hooks (hook, date) values (?, ?)',
             (name or sys.argv[0],
@@ -376,6 +396,9 @@ class Storage(object):
             self.conn.rollback()
 
     def _init(self):
+        # Readers no longer block the hook's writer and commits cost a
+        # single append to the log.
+        self.cursor.execute('pragma journal_mode=wal')
         self.cursor.execute('''
             create table if not exists kv (
                key text,
@@ -389,6 +412,9 @@ class Storage(object):
                data text,
                primary key (key, revision)
                )''')
+        self.cursor.execute('''
+            create index if not exists kv_revisions_revision
+               on kv_revisions (revision)''')
         self.cursor.execute('''
             create table if not exists hooks (
                version integer primary key autoincrement,
@@ -397,6 +423,54 @@ class Storage(object):
                )''')
         self.conn.commit()
 
+    def prune_revisions(self, keep=10):
+        """Delete all but the newest revisions of every key.
+
+        Hook records no longer referenced by any revision are deleted too.
+        Pending writes are committed.
+
+        :param int keep: Number of revisions kept per key
+        :return int: Number of revisions deleted
+        """
+        self._begin()
+        self.cursor.execute('''
+            delete from kv_revisions
+            where revision not in (
+                select r.revision from kv_revisions r
+                where r.key = kv_revisions.key
+                order by r.revision desc
+                limit ?)''', [keep])
+        pruned = self.cursor.rowcount
+        self.cursor.execute('''
+            delete from hooks
+            where version not in (select revision from kv_revisions)
+            and version != ?''', [self.revision or -1])
+        self.flush()
+        return pruned
+
+    def compact(self, pages=None):
+        """Return free pages in the database file to the file system.
+
+        The first call switches the database to incremental auto-vacuum,
+        which takes one full VACUUM. Later calls free at most `pages` pages
+        each, or all of them if `pages` is None. Pending writes are
+        committed first.
+
+        :param int pages: Maximum number of pages to free
+        """
+        self.flush()
+        self.cursor.execute('pragma auto_vacuum')
+        if self.cursor.fetchone()[0] != 2:
+            self.cursor.execute('pragma auto_vacuum=incremental')
+            self.cursor.execute('vacuum')
+            return
+        if pages is None:
+            self.cursor.execute('pragma incremental_vacuum')
+        else:
+            self.cursor.execute('pragma incremental_vacuum(%d)' % pages)
+        # Each step of the statement frees one page
+        self.cursor.fetchall()
+
     def gethistory(self, key, deserialize=False):
         self.cursor.execute(
             '''
@@ -417,6 +491,22 @@ class Storage(object):
         pprint.pprint(self.cursor.fetchall(), stream=fh)
 
 
+def _prefix_range(prefix):
+    """Where clause and parameters matching keys that start with prefix.
+
+    A range on the primary key can use its index, unlike LIKE with a bound
+    parameter, and treats '%' and '_' in the prefix literally.
+    """
+    if not prefix:
+        return 'key is not null', []
+    if ord(prefix[-1]) == sys.maxunicode:
+        return ('key >= ? and substr(key, 1, ?) = ?',
+                [prefix, len(prefix), prefix])
+    # Keys sort by their UTF-8 bytes, which follows code point order
+    upper = prefix[:-1] + six.unichr(ord(prefix[-1]) + 1)
+    return 'key >= ? and key < ?', [prefix, upper]
+
+
 def _parse_history(d):
     return (d[0], d[1], json.loads(d[2]), d[3],
             datetime.datetime.strptime(d[-1], "%Y-%m-%dT%H:%M:%S.%f"))
@@ -0,0 +1,153 @@
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+
+from subprocess import check_call, check_output
+
+from charmhelpers.core.hookenv import (
+    log,
+    INFO,
+)
+
+# Adjust the CRUSH weight, which persists and also steers new data
+CRUSH_WEIGHT = 'crush-weight'
+# Adjust the 0-1 override reweight, which is reset if the OSD is marked out
+OVERRIDE_REWEIGHT = 'reweight'
+
+DEFAULT_TARGET_VAR = 1.05
+DEFAULT_MAX_CHANGE = 0.05
+
+# Number of bytes in the unit CRUSH weights are expressed in (TiB)
+CRUSH_WEIGHT_UNIT_KB = 1024 ** 3
+
+
+def get_osd_df(service='admin'):
+    """Return the utilization of every OSD from 'ceph osd df'.
+
+    :param service: The ceph client to run the command under.
+    :returns: list of dicts, one per OSD, as reported by ceph.
+    :raises: CalledProcessError if the ceph command fails.
+    """
+    out = check_output(['ceph', '--id', service, 'osd', 'df',
+                        '--format=json'])
+    return json.loads(out.decode('UTF-8'))['nodes']
+
+
+def average_utilization(nodes):
+    """Return the utilization of the cluster as a whole, in percent.
+
+    :param nodes: list of OSD dicts as returned by get_osd_df.
+    :returns: float. 0.0 if no OSD reports any capacity.
+    """
+    kb = sum(node.get('kb', 0) for node in nodes)
+    if not kb:
+        return 0.0
+    return sum(node.get('kb_used', 0) for node in nodes) * 100.0 / kb
+
+
+def plan_reweights(nodes, target_var=DEFAULT_TARGET_VAR,
+                   max_change=DEFAULT_MAX_CHANGE, max_osds=None,
+                   method=CRUSH_WEIGHT):
+    """Plan the weight changes needed to even out OSD utilization.
+
+    Only OSDs whose utilization relative to the cluster average (the VAR
+    column of 'ceph osd df') lies outside 1 +/- (target_var - 1) are
+    changed, those furthest out first. Each weight is scaled by the inverse
+    of its VAR, limited to max_change of its current value so that a single
+    step never moves too much data. CRUSH weights are not raised beyond the
+    capacity of the OSD, override reweights not beyond 1.
+
+    :param nodes: list of OSD dicts as returned by get_osd_df.
+    :param target_var: float. The highest acceptable VAR.
+    :param max_change: float. The largest fraction of its weight an OSD may
+                       gain or lose in one plan.
+    :param max_osds: int. The most OSDs to change, unlimited if not set.
+    :param method: CRUSH_WEIGHT or OVERRIDE_REWEIGHT.
+    :returns: list of dicts with the OSD id, name, var and the current and
+              new weight of each OSD to change.
+    """
+    weight_key = 'crush_weight' if method == CRUSH_WEIGHT else 'reweight'
+    nodes = [node for node in nodes
+             if node.get('kb') and node.get(weight_key)]
+    average = average_utilization(nodes)
+    if not average:
+        return []
+
+    band = target_var - 1
+    outliers = []
+    for node in nodes:
+        var = node.get('utilization', 0) / average
+        if abs(var - 1) > band:
+            outliers.append((var, node))
+    outliers.sort(key=lambda outlier: abs(outlier[0] - 1), reverse=True)
+
+    plan = []
+    for var, node in outliers:
+        weight = node[weight_key]
+        new_weight = weight / var if var else weight * (1 + max_change)
+        new_weight = min(max(new_weight, weight * (1 - max_change)),
+                         weight * (1 + max_change))
+        if method == CRUSH_WEIGHT:
+            new_weight = min(new_weight,
+                             max(weight,
+                                 float(node['kb']) / CRUSH_WEIGHT_UNIT_KB))
+        else:
+            new_weight = min(new_weight, 1.0)
+        new_weight = round(new_weight, 4)
+        if new_weight == round(weight, 4):
+            continue
+        plan.append({'osd': node['id'],
+                     'name': node.get('name', 'osd.{}'.format(node['id'])),
+                     'var': round(var, 4),
+                     'weight': weight,
+                     'new_weight': new_weight})
+        if max_osds and len(plan) >= max_osds:
+            break
+    return plan
+
+
+def apply_reweights(plan, method=CRUSH_WEIGHT, batch_size=5,
+                    batch_interval=60, service='admin'):
+    """Apply a plan from plan_reweights in rate limited batches.
+
+    :param plan: list of changes as returned by plan_reweights.
+    :param method: CRUSH_WEIGHT or OVERRIDE_REWEIGHT.
+    :param batch_size: int. The number of OSDs to change at once.
+    :param batch_interval: int. Seconds to wait between batches, giving the
+                           cluster time to start the resulting backfill.
+    :param service: The ceph client to run the commands under.
+    :returns: int. The number of OSDs changed.
+    :raises: CalledProcessError if a ceph command fails, changes made by
+             earlier batches are left in place.
+    """
+    batch_size = max(batch_size, 1)
+    applied = 0
+    for start in range(0, len(plan), batch_size):
+        if start:
+            time.sleep(batch_interval)
+        for change in plan[start:start + batch_size]:
+            if method == CRUSH_WEIGHT:
+                cmd = ['ceph', '--id', service, 'osd', 'crush', 'reweight',
+                       change['name'], str(change['new_weight'])]
+            else:
+                cmd = ['ceph', '--id', service, 'osd', 'reweight',
+                       str(change['osd']), str(change['new_weight'])]
+            log("Changing {} weight of {} from {} to {}".format(
+                method, change['name'], change['weight'],
+                change['new_weight']), level=INFO)
+            check_call(cmd)
+            applied += 1
+    return applied
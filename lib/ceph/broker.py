@@ -22,9 +22,13 @@ from ceph.utils import (
     get_cephfs,
     get_osd_weight
 )
-from ceph.crush_utils import Crushmap
+from ceph.crush_utils import (
+    Crushmap,
+    get_crush_rule_resolver,
+)
 
 from charmhelpers.core.hookenv import (
+    cached,
     log,
     DEBUG,
     INFO,
@@ -33,8 +37,7 @@ from charmhelpers.core.hookenv import (
 from charmhelpers.contrib.storage.linux.ceph import (
     create_erasure_profile,
     delete_pool,
-    erasure_profile_exists,
-    get_osds,
+    get_erasure_profile,
     monitor_key_get,
     monitor_key_set,
     pool_exists,
@@ -83,6 +86,8 @@ POOL_KEYS = {
     "fast_read": [bool],
 }
 
+CEPHX_KEY_PREFIX = 'cephx.'
+
 CEPH_BUCKET_TYPES = [
     'osd',
     'host',
@@ -143,6 +148,71 @@ def process_requests(reqs):
     return resp
 
 
+def load_erasure_profiles(service='admin'):
+    """Load every erasure code profile and its parameters.
+
+    The OSD map carries all the profiles, so a single ``osd dump`` replaces
+    an ``erasure-code-profile get`` per profile.
+
+    :param service: The ceph client to run the command under.
+    :returns: dict of profile parameters keyed by profile name.
+    :raises: CalledProcessError if the ceph command fails.
+    """
+    out = check_output(['ceph', '--id', service,
+                        'osd', 'dump', '--format=json'])
+    return json.loads(out.decode('UTF-8')).get('erasure_code_profiles', {})
+
+
+class ErasureProfileRegistry(object):
+    """In-memory view of the erasure code profiles of the cluster.
+
+    The profiles are loaded with :func:`load_erasure_profiles` the first
+    time they are needed and existence and parameter lookups are then
+    answered from memory. Profiles changed through the registry are
+    re-read individually.
+    """
+
+    def __init__(self, service='admin'):
+        self.service = service
+        self._profiles = None
+
+    @property
+    def profiles(self):
+        if self._profiles is None:
+            self._profiles = load_erasure_profiles(service=self.service)
+        return self._profiles
+
+    def exists(self, name):
+        """Return whether the named profile exists."""
+        return name in self.profiles
+
+    def get(self, name):
+        """Return a copy of the parameters of a profile, or None."""
+        profile = self.profiles.get(name)
+        return dict(profile) if profile is not None else None
+
+    def refresh(self, name):
+        """Re-read a single profile after it was created or changed."""
+        profile = get_erasure_profile(self.service, name)
+        if profile is None:
+            self.profiles.pop(name, None)
+        else:
+            self.profiles[name] = profile
+
+    def create(self, profile_name, **kwargs):
+        """Create or update a profile, see :func:`create_erasure_profile`."""
+        create_erasure_profile(service=self.service,
+                               profile_name=profile_name,
+                               exists=self.exists(profile_name), **kwargs)
+        self.refresh(profile_name)
+
+
+@cached
+def get_erasure_profile_registry(service='admin'):
+    """Return an ErasureProfileRegistry shared for the rest of the hook."""
+    return ErasureProfileRegistry(service=service)
+
+
 def handle_create_erasure_profile(request, service):
     """Create an erasure profile.
 
@@ -164,54 +234,75 @@ def handle_create_erasure_profile(request, service):
         log(msg, level=ERROR)
         return {'exit-code': 1, 'stderr': msg}
 
-    create_erasure_profile(service=service, erasure_plugin_name=erasure_type,
-                           profile_name=name, failure_domain=failure_domain,
-                           data_chunks=k, coding_chunks=m, locality=l)
+    registry = get_erasure_profile_registry(service=service)
+    registry.create(profile_name=name, erasure_plugin_name=erasure_type,
+                    failure_domain=failure_domain, data_chunks=k,
+                    coding_chunks=m, locality=l)
 
 
-def handle_add_permissions_to_key(request, service):
+def handle_add_permissions_to_key(request, service, store=None):
     """Groups are defined by the key cephx.groups.(namespace-)?-(name). This
     key will contain a dict serialized to JSON with data about the group,
     including pools and members.
 
     A group can optionally have a namespace defined that will be used to
     further restrict pool access.
+
+    :param request: dict of request operations and params
+    :param service: The ceph client to run the command under.
+    :param store: PermissionStore to apply the change to. If not supplied a
+                  new store is loaded and flushed before returning.
+    :returns: dict. exit-code and reason if not 0
     """
     resp = {'exit-code': 0}
 
+    flush = store is None
+    if store is None:
+        store = PermissionStore(service=service)
+
     service_name = request.get('name')
     group_name = request.get('group')
     group_namespace = request.get('group-namespace')
     if group_namespace:
         group_name = "{}-{}".format(group_namespace, group_name)
-    group = get_group(group_name=group_name)
-    service_obj = get_service_groups(service=service_name,
-                                     namespace=group_namespace)
+    group = store.get_group(group_name=group_name)
+    service_obj = store.get_service_groups(service=service_name,
+                                           namespace=group_namespace)
     if request.get('object-prefix-permissions'):
         service_obj['object_prefix_perms'] = request.get(
             'object-prefix-permissions')
-    format("Service object: {}".format(service_obj))
+    log("Service object: {}".format(service_obj), level=DEBUG)
     permission = request.get('group-permission') or "rwx"
     if service_name not in group['services']:
         group['services'].append(service_name)
-    save_group(group=group, group_name=group_name)
+    store.save_group(group=group, group_name=group_name)
     if permission not in service_obj['group_names']:
         service_obj['group_names'][permission] = []
     if group_name not in service_obj['group_names'][permission]:
         service_obj['group_names'][permission].append(group_name)
-    save_service(service=service_obj, service_name=service_name)
-    service_obj['groups'] = _build_service_groups(service_obj,
-                                                  group_namespace)
-    update_service_permissions(service_name, service_obj, group_namespace)
+    store.save_service(service=service_obj, service_name=service_name)
+    store.mark_service(service_name, namespace=group_namespace)
+
+    if flush:
+        store.flush()
 
     return resp
 
 
 def update_service_permissions(service, service_obj=None, namespace=None):
-    """Update the key permissions for the named client in Ceph"""
+    """Update the key permissions for the named client in Ceph
+
+    The capabilities are only rewritten when they differ from what the
+    cluster already has for the key, as every rewrite bumps the auth epoch.
+    """
     if not service_obj:
         service_obj = get_service_groups(service=service, namespace=namespace)
     permissions = pool_permission_list_for_service(service_obj)
+    caps = dict(zip(permissions[::2], permissions[1::2]))
+    if get_service_caps(service) == caps:
+        log("Key capabilities for client.{} are up to date".format(service),
+            level=DEBUG)
+        return
     call = ['ceph', 'auth', 'caps', 'client.{}'.format(service)] + permissions
     try:
         check_call(call)
@@ -219,17 +310,47 @@ def update_service_permissions(service, service_obj=None, namespace=None):
         log("Error updating key capabilities: {}".format(e))
 
 
-def add_pool_to_group(pool, group, namespace=None):
-    """Add a named pool to a named group"""
+def get_service_caps(service):
+    """Get the current capabilities of the named client from Ceph
+
+    :param service: The name of the client key, without the client. prefix.
+    :returns: dict of capabilities keyed by subsystem or None if the key
+              does not exist or can not be read.
+    """
+    cmd = ['ceph', 'auth', 'get', 'client.{}'.format(service),
+           '--format=json']
+    try:
+        out = check_output(cmd).decode('UTF-8')
+        return json.loads(out)[0]['caps']
+    except (CalledProcessError, ValueError, IndexError, KeyError,
+            TypeError) as e:
+        log("Unable to read key capabilities for client.{}: {}".format(
+            service, e), level=DEBUG)
+        return None
+
+
+def add_pool_to_group(pool, group, namespace=None, store=None):
+    """Add a named pool to a named group
+
+    :param store: PermissionStore to apply the change to. If not supplied a
+                  new store is loaded and flushed before returning.
+    """
+    flush = store is None
+    if store is None:
+        store = PermissionStore()
+
     group_name = group
     if namespace:
         group_name = "{}-{}".format(namespace, group_name)
-    group = get_group(group_name=group_name)
+    group = store.get_group(group_name=group_name)
     if pool not in group['pools']:
         group["pools"].append(pool)
-    save_group(group, group_name=group_name)
+    store.save_group(group, group_name=group_name)
     for service in group['services']:
-        update_service_permissions(service, namespace=namespace)
+        store.mark_service(service, namespace=namespace)
+
+    if flush:
+        store.flush()
 
 
 def pool_permission_list_for_service(service):
@@ -273,7 +394,7 @@ def get_service_groups(service, namespace=None):
     }
     """
     service_json = monitor_key_get(service='admin',
-                                   key="cephx.services.{}".format(service))
+                                   key=get_service_key(service_name=service))
     try:
         service = json.loads(service_json)
     except (TypeError, ValueError):
@@ -337,7 +458,7 @@ def save_service(service_name, service):
     """Persist a service in the monitor cluster"""
     service['groups'] = {}
     return monitor_key_set(service='admin',
-                           key="cephx.services.{}".format(service_name),
+                           key=get_service_key(service_name=service_name),
                            value=json.dumps(service, sort_keys=True))
 
 
@@ -354,11 +475,218 @@ def get_group_key(group_name):
     return 'cephx.groups.{}'.format(group_name)
 
 
-def handle_erasure_pool(request, service):
+def get_service_key(service_name):
+    """Build service key"""
+    return 'cephx.services.{}'.format(service_name)
+
+
+def load_cephx_records(service='admin'):
+    """Load every cephx group and service record from the monitor cluster.
+
+    Uses a single ``config-key dump`` restricted to the ``cephx.`` prefix,
+    falling back to an unfiltered dump on releases which do not accept a
+    prefix argument.
+
+    :param service: The ceph client to run the command under.
+    :returns: dict. Raw (JSON encoded) record values keyed by config-key, or
+              None if the release has no ``config-key dump`` (pre Luminous).
+    """
+    cmd = ['ceph', '--id', service, 'config-key', 'dump']
+    try:
+        out = check_output(cmd + [CEPHX_KEY_PREFIX])
+    except CalledProcessError:
+        try:
+            out = check_output(cmd)
+        except CalledProcessError:
+            return None
+    records = json.loads(out.decode('UTF-8'))
+    return {key: value for key, value in records.items()
+            if key.startswith(CEPHX_KEY_PREFIX)}
+
+
+class PermissionStore(object):
+    """In-memory model of the cephx group and service records.
+
+    The records are read with one ``config-key dump`` the first time they are
+    needed. Releases without ``config-key dump`` read each record with
+    ``config-key get`` when it is first used instead. Changes are held in
+    memory until :meth:`flush`, which writes back only the keys whose value
+    changed and then issues one ``auth caps`` per service marked as
+    affected.
+    """
+
+    def __init__(self, service='admin'):
+        self.service = service
+        self._records = None
+        self._per_key = False
+        self._changed_keys = set()
+        self._affected_services = collections.OrderedDict()
+        # Earlier values of the records changed since checkpoint()
+        self._undo = None
+
+    @property
+    def records(self):
+        if self._records is None:
+            self._records = load_cephx_records(service=self.service)
+            if self._records is None:
+                self._records = {}
+                self._per_key = True
+        return self._records
+
+    def _get_record(self, key):
+        records = self.records
+        if self._per_key and key not in records:
+            records[key] = monitor_key_get(service=self.service, key=key)
+        return records.get(key)
+
+    def _load(self, key):
+        try:
+            return json.loads(self._get_record(key))
+        except (TypeError, ValueError):
+            return None
+
+    def _save(self, key, obj):
+        value = json.dumps(obj, sort_keys=True)
+        current = self._get_record(key)
+        if current != value:
+            if self._undo is not None:
+                self._undo.setdefault(key, current)
+            self.records[key] = value
+            self._changed_keys.add(key)
+
+    def checkpoint(self):
+        """Start recording the changes :meth:`restore` can undo."""
+        self._undo = {}
+
+    def restore(self):
+        """Undo the record changes made since :meth:`checkpoint`.
+
+        The earlier values are staged like any other change, so the next
+        :meth:`flush` writes back records it had already written and
+        recomputes the caps of the services marked meanwhile.
+        """
+        for key, value in (self._undo or {}).items():
+            if value is None:
+                # Records are never created by the changes undone here
+                self.records.pop(key, None)
+                self._changed_keys.discard(key)
+            else:
+                self.records[key] = value
+                self._changed_keys.add(key)
+        self._undo = None
+
+    def get_group(self, group_name):
+        """Return the group record, see :func:`get_group`."""
+        group = self._load(get_group_key(group_name=group_name))
+        if not group:
+            group = {
+                'pools': [],
+                'services': []
+            }
+        return group
+
+    def save_group(self, group, group_name):
+        """Stage a group record for writing."""
+        self._save(get_group_key(group_name=group_name), group)
+
+    def get_service_groups(self, service, namespace=None):
+        """Return the service record, see :func:`get_service_groups`."""
+        service_obj = self._load(get_service_key(service_name=service))
+        if service_obj:
+            service_obj['groups'] = self.build_service_groups(service_obj,
+                                                              namespace)
+        else:
+            service_obj = {'group_names': {}, 'groups': {}}
+        return service_obj
+
+    def build_service_groups(self, service, namespace=None):
+        """Rebuild the 'groups' dict for a service, see
+        :func:`_build_service_groups`."""
+        all_groups = {}
+        for groups in service['group_names'].values():
+            for group in groups:
+                name = group
+                if namespace:
+                    name = "{}-{}".format(namespace, name)
+                all_groups[group] = self.get_group(group_name=name)
+        return all_groups
+
+    def save_service(self, service_name, service):
+        """Stage a service record for writing."""
+        record = dict(service)
+        record['groups'] = {}
+        self._save(get_service_key(service_name=service_name), record)
+
+    def mark_service(self, service, namespace=None):
+        """Flag a service as needing its key capabilities recomputed."""
+        self._affected_services[service] = namespace
+
+    def group_names(self):
+        """Return the names of every group in the store."""
+        prefix = get_group_key(group_name='')
+        keys = self.records
+        if self._per_key:
+            keys = json.loads(check_output(
+                ['ceph', '--id', self.service, 'config-key', 'list',
+                 '--format=json']).decode('UTF-8'))
+        return sorted(key[len(prefix):] for key in keys
+                      if key.startswith(prefix))
+
+    def _group_namespace(self, group_name, service):
+        """Return the namespace a service uses to refer to a group."""
+        service_obj = self._load(get_service_key(service_name=service)) or {}
+        groups = set(group for groups in
+                     service_obj.get('group_names', {}).values()
+                     for group in groups)
+        if group_name in groups:
+            return None
+        for group in groups:
+            if group_name.endswith('-{}'.format(group)):
+                return group_name[:-len(group) - 1]
+        return None
+
+    def _replace_pool(self, pool, new_pool=None):
+        for group_name in self.group_names():
+            group = self.get_group(group_name=group_name)
+            if pool not in group['pools']:
+                continue
+            pools = [p for p in group['pools'] if p != pool]
+            if new_pool and new_pool not in pools:
+                pools.insert(group['pools'].index(pool), new_pool)
+            group['pools'] = pools
+            self.save_group(group, group_name=group_name)
+            for service in group['services']:
+                self.mark_service(service, namespace=self._group_namespace(
+                    group_name, service))
+
+    def rename_pool(self, old_name, new_name):
+        """Rename a pool in every group referring to it."""
+        self._replace_pool(old_name, new_pool=new_name)
+
+    def remove_pool(self, pool):
+        """Remove a pool from every group referring to it."""
+        self._replace_pool(pool)
+
+    def flush(self):
+        """Write changed records and update caps for affected services."""
+        for key in sorted(self._changed_keys):
+            monitor_key_set(service=self.service, key=key,
+                            value=self.records[key])
+        self._changed_keys.clear()
+
+        for service, namespace in self._affected_services.items():
+            service_obj = self.get_service_groups(service=service,
+                                                  namespace=namespace)
+            update_service_permissions(service, service_obj, namespace)
+        self._affected_services.clear()
+
+
+def handle_erasure_pool(request, service, store=None):
     """Create a new erasure coded pool.
 
     :param request: dict of request operations and params.
     :param service: The ceph client to run the command under.
+    :param store: PermissionStore used to record group membership.
     :returns: dict. exit-code and reason if not 0.
     """
     pool_name = request.get('name')
@@ -381,21 +709,26 @@ def handle_erasure_pool(request, service):
         # Add the pool to the group named "group_name"
         add_pool_to_group(pool=pool_name,
                           group=group_name,
-                          namespace=group_namespace)
+                          namespace=group_namespace,
+                          store=store)
 
     # TODO: Default to 3/2 erasure coding. I believe this requires min 5 osds
-    if not erasure_profile_exists(service=service, name=erasure_profile):
+    profiles = get_erasure_profile_registry(service=service)
+    if not profiles.exists(erasure_profile):
         # TODO: Fail and tell them to create the profile or default
         msg = ("erasure-profile {} does not exist.  Please create it with: "
                "create-erasure-profile".format(erasure_profile))
         log(msg, level=ERROR)
         return {'exit-code': 1, 'stderr': msg}
 
-    pool = ErasurePool(service=service, name=pool_name,
-                       erasure_code_profile=erasure_profile,
-                       percent_data=weight)
     # Ok make the erasure pool
     if not pool_exists(service=service, name=pool_name):
+        pool = ErasurePool(service=service, name=pool_name,
+                           erasure_code_profile=erasure_profile,
+                           percent_data=weight,
+                           osd_count=get_erasure_pool_osd_count(
+                               service, erasure_profile),
+                           profile=profiles.get(erasure_profile))
         log("Creating pool '{}' (erasure_profile={})"
             .format(pool.name, erasure_profile), level=INFO)
         pool.create()
@@ -405,11 +738,60 @@ def handle_erasure_pool(request, service):
         set_pool_quota(service=service, pool_name=pool_name, max_bytes=quota)
 
 
-def handle_replicated_pool(request, service):
+def get_replicated_pool_osd_count(service):
+    """Count the OSDs new replicated pools are placed on.
+
+    New replicated pools use the default replicated CRUSH rule, so only the
+    OSDs reachable by that rule are counted rather than the whole cluster.
+
+    :param service: The ceph client to run the command under.
+    :returns: int or None if the rule's OSDs can not be determined.
+    """
+    try:
+        resolver = get_crush_rule_resolver(service=service)
+        rule = resolver.default_replicated_rule()
+        if rule is None:
+            return None
+        return len(resolver.rule_osds(rule)) or None
+    except (CalledProcessError, OSError, ValueError, KeyError) as e:
+        log("Unable to resolve OSDs for the default CRUSH rule: {}"
+            .format(e), level=DEBUG)
+        return None
+
+
+def get_erasure_pool_osd_count(service, erasure_profile):
+    """Count the OSDs an erasure coded pool will be placed on.
+
+    The CRUSH rule of an erasure coded pool is generated from its profile,
+    so the OSDs below the profile's root (and device class) are counted.
+
+    :param service: The ceph client to run the command under.
+    :param erasure_profile: The name of the erasure profile of the pool.
+    :returns: int or None if the OSDs can not be determined.
+    """
+    profile = get_erasure_profile_registry(service=service).get(
+        erasure_profile)
+    if not profile:
+        return None
+    # Luminous renamed the ruleset-* profile keys to crush-*
+    root = (profile.get('crush-root') or profile.get('ruleset-root') or
+            'default')
+    try:
+        resolver = get_crush_rule_resolver(service=service)
+        return len(resolver.bucket_osds(
+            root, device_class=profile.get('crush-device-class'))) or None
+    except (CalledProcessError, OSError, ValueError, KeyError) as e:
+        log("Unable to resolve OSDs below CRUSH root {}: {}".format(root, e),
+            level=DEBUG)
+        return None
+
+
+def handle_replicated_pool(request, service, store=None):
     """Create a new replicated pool.
 
     :param request: dict of request operations and params.
     :param service: The ceph client to run the command under.
+    :param store: PermissionStore used to record group membership.
     :returns: dict. exit-code and reason if not 0.
     """
     pool_name = request.get('name')
@@ -420,11 +802,6 @@ def handle_replicated_pool(request, service):
 
     # Optional params
     pg_num = request.get('pg_num')
-    if pg_num:
-        # Cap pg_num to max allowed just in case.
-        osds = get_osds(service)
-        if osds:
-            pg_num = min(pg_num, (len(osds) * 100 // replicas))
 
     # Check for missing params
     if pool_name is None or replicas is None:
@@ -437,24 +814,32 @@ def handle_replicated_pool(request, service):
         # Add the pool to the group named "group_name"
         add_pool_to_group(pool=pool_name,
                           group=group_name,
-                          namespace=group_namespace)
-
-    kwargs = {}
-    if pg_num:
-        kwargs['pg_num'] = pg_num
-    if weight:
-        kwargs['percent_data'] = weight
-    if replicas:
-        kwargs['replicas'] = replicas
-
-    pool = ReplicatedPool(service=service,
-                          name=pool_name, **kwargs)
+                          namespace=group_namespace,
+                          store=store)
+
     if not pool_exists(service=service, name=pool_name):
+        # The CRUSH rule is only resolved when the pool has to be sized
+        osd_count = get_replicated_pool_osd_count(service)
+        kwargs = {}
+        if pg_num:
+            # Cap pg_num to max allowed just in case.
+            if osd_count:
+                pg_num = min(pg_num, (osd_count * 100 // replicas))
+            kwargs['pg_num'] = pg_num
+        if weight:
+            kwargs['percent_data'] = weight
+        if replicas:
+            kwargs['replicas'] = replicas
+        if osd_count:
+            kwargs['osd_count'] = osd_count
+
+        pool = ReplicatedPool(service=service,
+                              name=pool_name, **kwargs)
         log("Creating pool '{}' (replicas={})".format(pool.name, replicas),
             level=INFO)
         pool.create()
     else:
-        log("Pool '{}' already exists - skipping create".format(pool.name),
+        log("Pool '{}' already exists - skipping create".format(pool_name),
             level=DEBUG)
 
     # Set a quota if requested
@@ -490,6 +875,28 @@ def handle_create_cache_tier(request, service):
     p.add_cache_tier(cache_pool=cache_pool, mode=cache_mode)
 
 
+def get_pool_tiers(service, pool_name):
+    """Return the cache tier relationships of a pool.
+
+    :param service: The ceph client to run the command under.
+    :param pool_name: The name of the pool.
+    :returns: dict with the names of the cache pools tiered on the pool
+              under 'tiers' and the name of the pool it is a cache tier of,
+              or None, under 'tier_of'.
+    :raises: CalledProcessError if the ceph command fails.
+    """
+    out = check_output(['ceph', '--id', service,
+                        'osd', 'dump', '--format=json'])
+    pools = json.loads(out.decode('UTF-8'))['pools']
+    names = dict((pool['pool'], pool['pool_name']) for pool in pools)
+    for pool in pools:
+        if pool['pool_name'] == pool_name:
+            return {'tiers': [names[tier] for tier in pool.get('tiers', [])
+                              if tier in names],
+                    'tier_of': names.get(pool.get('tier_of', -1))}
+    return {'tiers': [], 'tier_of': None}
+
+
 def handle_remove_cache_tier(request, service):
     """Remove a cache tier from the cold pool.
 
@@ -511,6 +918,107 @@ def handle_remove_cache_tier(request, service):
     pool.remove_cache_tier(cache_pool=cache_pool)
 
 
+def handle_rename_pool(request, service, store=None):
+    """Rename a pool and every cephx group that refers to it.
+
+    Cache tier relationships are kept by pool id so survive the rename.
+    If the group records can not be updated the pool is renamed back and
+    the records are restored to name the old pool again. A pool
+    that has already been renamed, e.g. by an earlier attempt at the same
+    request, only has its group records brought up to date.
+
+    :param request: dict of request operations and params.
+    :param service: The ceph client to run the command under.
+    :param store: PermissionStore to apply the change to. If not supplied a
+                  new store is loaded and flushed before returning.
+    :returns: dict. exit-code and reason if not 0.
+    """
+    old_name = request.get('name')
+    new_name = request.get('new-name')
+    old_exists = pool_exists(service=service, name=old_name)
+    new_exists = pool_exists(service=service, name=new_name)
+    if old_exists and new_exists:
+        msg = "Pool '{}' already exists, not renaming".format(new_name)
+        log(msg, level=ERROR)
+        return {'exit-code': 1, 'stderr': msg}
+    if not old_exists and not new_exists:
+        msg = "Pool '{}' does not exist, not renaming".format(old_name)
+        log(msg, level=ERROR)
+        return {'exit-code': 1, 'stderr': msg}
+
+    flush = store is None
+    if store is None:
+        store = PermissionStore()
+
+    if not old_exists:
+        log("Pool '{}' has already been renamed to '{}'".format(
+            old_name, new_name), level=INFO)
+        store.rename_pool(old_name, new_name)
+        if flush:
+            store.flush()
+        return
+
+    store.checkpoint()
+    rename_pool(service=service, old_name=old_name, new_name=new_name)
+    try:
+        store.rename_pool(old_name, new_name)
+        if flush:
+            store.flush()
+    except CalledProcessError as e:
+        log("Unable to update groups for pool '{}', renaming it back: "
+            "{}".format(old_name, e), level=ERROR)
+        rename_pool(service=service, old_name=new_name, new_name=old_name)
+        store.restore()
+        if flush:
+            store.flush()
+        raise
+
+
+def handle_delete_pool(request, service, store=None):
+    """Delete a pool, its cache tier relationships and group memberships.
+
+    Cache tiers on the pool, or the pool itself if it is a cache tier, are
+    removed first as Ceph refuses to delete a pool which is part of a tier.
+    The pool is then dropped from every cephx group referring to it. A pool
+    that no longer exists is not an error, so a resent request succeeds.
+
+    :param request: dict of request operations and params.
+    :param service: The ceph client to run the command under.
+    :param store: PermissionStore to apply the change to. If not supplied a
+                  new store is loaded and flushed before returning.
+    :returns: dict. exit-code and reason if not 0.
+    """
+    pool_name = request.get('name')
+    flush = store is None
+    if store is None:
+        store = PermissionStore()
+
+    if not pool_exists(service=service, name=pool_name):
+        log("Pool '{}' does not exist, nothing to delete".format(pool_name),
+            level=INFO)
+        store.remove_pool(pool_name)
+        if flush:
+            store.flush()
+        return
+
+    tiers = get_pool_tiers(service=service, pool_name=pool_name)
+    for cache_pool in tiers['tiers']:
+        log("Removing cache tier '{}' from pool '{}'".format(
+            cache_pool, pool_name), level=INFO)
+        Pool(name=pool_name, service=service).remove_cache_tier(
+            cache_pool=cache_pool)
+    if tiers['tier_of']:
+        log("Removing cache tier '{}' from pool '{}'".format(
+            pool_name, tiers['tier_of']), level=INFO)
+        Pool(name=tiers['tier_of'], service=service).remove_cache_tier(
+            cache_pool=pool_name)
+
+    delete_pool(service=service, name=pool_name)
+    store.remove_pool(pool_name)
+    if flush:
+        store.flush()
+
+
 def handle_set_pool_value(request, service):
     """Sets an arbitrary pool value.
 
@@ -790,9 +1298,20 @@ def process_requests_v1(reqs):
     Takes a list of requests (dicts) and processes each one. If an error is
     found, processing stops and the client is notified in the response.
 
+    Changes to cephx groups are collected for the whole request and the key
+    capabilities of each affected service are recomputed once at the end.
+
     Returns a response dict containing the exit code (non-zero if any
     operation failed along with an explanation).
     """
+    store = PermissionStore()
+    try:
+        return _process_requests_v1(reqs, store)
+    finally:
+        store.flush()
+
+
+def _process_requests_v1(reqs, store):
     ret = None
     log("Processing {} ceph broker requests".format(len(reqs)), level=INFO)
     for req in reqs:
@@ -806,9 +1325,11 @@ def process_requests_v1(reqs):
 
             # Default to replicated if pool_type isn't given
             if pool_type == 'erasure':
-                ret = handle_erasure_pool(request=req, service=svc)
+                ret = handle_erasure_pool(request=req, service=svc,
+                                          store=store)
             else:
-                ret = handle_replicated_pool(request=req, service=svc)
+                ret = handle_replicated_pool(request=req, service=svc,
+                                             store=store)
         elif op == "create-cephfs":
             ret = handle_create_cephfs(request=req, service=svc)
         elif op == "create-cache-tier":
@@ -818,13 +1339,9 @@ def process_requests_v1(reqs):
         elif op == "create-erasure-profile":
             ret = handle_create_erasure_profile(request=req, service=svc)
         elif op == "delete-pool":
-            pool = req.get('name')
-            ret = delete_pool(service=svc, name=pool)
+            ret = handle_delete_pool(request=req, service=svc, store=store)
         elif op == "rename-pool":
-            old_name = req.get('name')
-            new_name = req.get('new-name')
-            ret = rename_pool(service=svc, old_name=old_name,
-                              new_name=new_name)
+            ret = handle_rename_pool(request=req, service=svc, store=store)
         elif op == "snapshot-pool":
             pool = req.get('name')
             snapshot_name = req.get('snapshot-name')
@@ -850,7 +1367,8 @@ def process_requests_v1(reqs):
         elif op == "move-osd-to-bucket":
             ret = handle_put_osd_in_bucket(request=req, service=svc)
         elif op == "add-permissions-to-key":
-            ret = handle_add_permissions_to_key(request=req, service=svc)
+            ret = handle_add_permissions_to_key(request=req, service=svc,
+                                                store=store)
         else:
             msg = "Unknown operation '{}'".format(op)
             log(msg, level=ERROR)
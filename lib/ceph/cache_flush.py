@@ -0,0 +1,293 @@
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Flush and evict a writeback cache tier in the background.
+
+Flushing a large writeback tier with 'rados cache-flush-evict-all' blocks
+the calling hook or action for as long as it takes. Instead the command is
+run by a detached job process which follows its progress through the
+object count of the cache pool. The job records its state in a JSON file
+per cache pool, away from the charm's unitdata database which hooks hold
+locked while they run. The state can be followed with the
+cache-flush-status action and the unit's workload status, and the job is
+restarted by update-status if it was interrupted. Evicted objects leave
+the cache pool, so a restarted job only has what is left to do.
+
+The job outlives the action which started it and so can not use juju-log,
+everything it reports goes through its state file.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from charmhelpers.core.hookenv import service_name
+from charmhelpers.core.host import mkdir
+
+# Directory holding the state file of the flush job of each cache pool
+CACHE_FLUSH_DIR = '/var/lib/charm/{}/cache-flush'
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Seconds between progress updates of a running job
+POLL_INTERVAL = 10
+
+
+def flush_state_dir():
+    """Return the directory holding the flush job state files."""
+    return CACHE_FLUSH_DIR.format(service_name())
+
+
+def _state_path(cache_pool, state_dir=None):
+    return os.path.join(state_dir or flush_state_dir(),
+                        '{}.json'.format(cache_pool))
+
+
+def get_flush_job(cache_pool, state_dir=None):
+    """Return the recorded state of the flush job for a cache pool.
+
+    :param cache_pool: The name of the cache pool.
+    :param state_dir: Directory of the state files, see flush_state_dir.
+    :returns: dict or None if no job was ever started for the pool.
+    """
+    try:
+        with open(_state_path(cache_pool, state_dir)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def get_flush_jobs(state_dir=None):
+    """Return the state of every flush job keyed by cache pool."""
+    state_dir = state_dir or flush_state_dir()
+    try:
+        names = os.listdir(state_dir)
+    except OSError:
+        return {}
+    jobs = {}
+    for name in sorted(names):
+        if not name.endswith('.json'):
+            continue
+        job = get_flush_job(name[:-len('.json')], state_dir=state_dir)
+        if job:
+            jobs[job['cache_pool']] = job
+    return jobs
+
+
+def save_flush_job(job, state_dir=None):
+    """Record the state of a flush job.
+
+    The file is replaced atomically so readers never see a partial write.
+    """
+    state_dir = state_dir or flush_state_dir()
+    job['updated'] = int(time.time())
+    if not os.path.isdir(state_dir):
+        mkdir(state_dir, perms=0o700)
+    fd, tmp_path = tempfile.mkstemp(dir=state_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(job, f, sort_keys=True)
+    os.rename(tmp_path, _state_path(job['cache_pool'], state_dir))
+
+
+def process_start_time(pid):
+    """Return when a process started, in clock ticks since boot.
+
+    :returns: int or None if the process does not exist.
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            stat = f.read()
+    except (IOError, OSError):
+        return None
+    # The command name in brackets may itself contain spaces, the start
+    # time is the 22nd field and so the 20th after it.
+    try:
+        return int(stat[stat.rindex(')') + 1:].split()[19])
+    except (ValueError, IndexError):
+        return None
+
+
+def job_alive(job):
+    """Return whether the process of a flush job is still running.
+
+    After a reboot the recorded pid may have been reused by another
+    process, so the process must also have the recorded start time.
+    """
+    try:
+        os.kill(job['pid'], 0)
+    except (OSError, KeyError, TypeError):
+        return False
+    start_time = process_start_time(job['pid'])
+    return start_time is not None and start_time == job.get('pid_start')
+
+
+def start_flush_job(cache_pool, backer_pool, service='admin',
+                    state_dir=None):
+    """Start, or restart, the background flush of a cache tier.
+
+    The cache pool should already be in forward or proxy mode so that new
+    writes stop landing on it. Once every object is flushed and evicted
+    the job removes the overlay and the tier from the backer pool.
+
+    :param cache_pool: The name of the cache pool to flush.
+    :param backer_pool: The name of the pool the cache tier sits on.
+    :param service: The ceph client to run the commands under.
+    :param state_dir: Directory of the state files, see flush_state_dir.
+    :returns: dict. The state of the job.
+    """
+    state_dir = state_dir or flush_state_dir()
+    job = get_flush_job(cache_pool, state_dir=state_dir)
+    if job and job.get('state') == RUNNING and job_alive(job):
+        return job
+    job = job if job and job.get('state') == RUNNING else {}
+    job.update({'cache_pool': cache_pool,
+                'backer_pool': backer_pool,
+                'service': service,
+                'state': RUNNING,
+                'flushed': job.get('flushed', 0),
+                'started': job.get('started', int(time.time()))})
+    lib_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [lib_dir, os.path.join(os.path.dirname(lib_dir), 'hooks')])
+    with open(os.devnull, 'r+b') as devnull:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'ceph.cache_flush', cache_pool,
+             state_dir],
+            stdin=devnull, stdout=devnull, stderr=devnull, env=env,
+            start_new_session=True)
+    job.update({'pid': process.pid,
+                'pid_start': process_start_time(process.pid)})
+    save_flush_job(job, state_dir=state_dir)
+    return job
+
+
+def resume_flush_jobs():
+    """Restart the flush jobs which were interrupted.
+
+    :returns: list. The cache pools whose jobs were restarted.
+    """
+    resumed = []
+    for cache_pool, job in get_flush_jobs().items():
+        if job.get('state') == RUNNING and not job_alive(job):
+            start_flush_job(cache_pool, job['backer_pool'],
+                            service=job.get('service', 'admin'))
+            resumed.append(cache_pool)
+    return resumed
+
+
+def flush_status_message():
+    """Summarise the running flush jobs for the workload status.
+
+    :returns: str. Empty if no job is running.
+    """
+    running = []
+    for cache_pool, job in sorted(get_flush_jobs().items()):
+        if job.get('state') != RUNNING:
+            continue
+        progress = '{} objects'.format(job.get('flushed', 0))
+        if job.get('total'):
+            progress = '{}%'.format(min(100, job.get('flushed', 0) * 100 //
+                                        job['total']))
+        running.append('{} {}'.format(cache_pool, progress))
+    if not running:
+        return ''
+    return 'flushing cache {}'.format(', '.join(running))
+
+
+def get_pool_objects(service, pool):
+    """Return the number of objects in a pool according to 'ceph df'.
+
+    :returns: int or None if the pool is not listed.
+    """
+    out = subprocess.check_output(['ceph', '--id', service, 'df',
+                                   '--format=json'])
+    for entry in json.loads(out.decode('UTF-8'))['pools']:
+        if entry['name'] == pool:
+            return entry['stats']['objects']
+    return None
+
+
+def remove_tier(service, cache_pool, backer_pool):
+    """Detach a flushed cache pool from its backer pool."""
+    subprocess.check_call(['ceph', '--id', service, 'osd', 'tier',
+                           'remove-overlay', backer_pool])
+    subprocess.check_call(['ceph', '--id', service, 'osd', 'tier',
+                           'remove', backer_pool, cache_pool])
+
+
+def _update_progress(job, service, cache_pool, state_dir):
+    try:
+        remaining = get_pool_objects(service, cache_pool)
+    except (subprocess.CalledProcessError, ValueError, KeyError):
+        # Progress is informational, carry on flushing regardless
+        return
+    if remaining is None:
+        return
+    job['total'] = max(job.get('total') or 0, remaining)
+    job['flushed'] = job['total'] - remaining
+    save_flush_job(job, state_dir=state_dir)
+
+
+def run_flush_job(cache_pool, state_dir, poll_interval=POLL_INTERVAL):
+    """Flush and evict every object of a cache pool, then remove the tier.
+
+    'rados cache-flush-evict-all' does the work in one process, and the
+    object count of the cache pool is sampled every poll_interval seconds
+    to record its progress.
+
+    :param cache_pool: The name of the cache pool, whose job must have
+                       been recorded by start_flush_job.
+    :param state_dir: Directory of the state files.
+    :param poll_interval: int. Seconds between progress updates.
+    """
+    job = get_flush_job(cache_pool, state_dir=state_dir)
+    job.update({'state': RUNNING, 'pid': os.getpid(),
+                'pid_start': process_start_time(os.getpid())})
+    service = job.get('service', 'admin')
+    _update_progress(job, service, cache_pool, state_dir)
+    try:
+        with open(os.devnull, 'r+b') as devnull:
+            process = subprocess.Popen(
+                ['rados', '--id', service, '-p', cache_pool,
+                 'cache-flush-evict-all'],
+                stdin=devnull, stdout=devnull, stderr=subprocess.PIPE)
+        while True:
+            try:
+                _, err = process.communicate(timeout=poll_interval)
+                break
+            except subprocess.TimeoutExpired:
+                _update_progress(job, service, cache_pool, state_dir)
+        _update_progress(job, service, cache_pool, state_dir)
+        if process.returncode:
+            job.update({'state': FAILED,
+                        'error': err.decode('UTF-8', 'replace').strip() or
+                        'cache-flush-evict-all exited with {}'.format(
+                            process.returncode)})
+        else:
+            remove_tier(service, cache_pool, job['backer_pool'])
+            job['state'] = DONE
+    except (OSError, subprocess.CalledProcessError) as e:
+        job.update({'state': FAILED, 'error': str(e)})
+    finally:
+        save_flush_job(job, state_dir=state_dir)
+
+
+if __name__ == '__main__':
+    run_flush_job(sys.argv[1], sys.argv[2])
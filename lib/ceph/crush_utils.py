@@ -12,12 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import re
+import socket
 
 from subprocess import check_output, CalledProcessError
 
 from charmhelpers.core.hookenv import (
+    cached,
     log,
+    DEBUG,
     ERROR,
 )
 
@@ -49,6 +53,14 @@ CRUSHMAP_BUCKETS_RE = re.compile(r"root\s+(.+)\s+\{\s*id\s+(-?\d+)")
 # so that we can extract the IDs from a crushmap
 CRUSHMAP_ID_RE = re.compile(r"id\s+(-?\d+)")
 
+# This regular expression matches the lines printed by
+# crushtool --test --show-mappings, like:
+# CRUSH rule 0 x 12 [3,1,5]
+CRUSHTOOL_MAPPING_RE = re.compile(r"CRUSH rule (\d+) x (\d+) \[([-\d,]*)\]")
+
+# The OSD id crushtool reports for an erasure coded shard it could not place
+CRUSH_ITEM_NONE = 0x7fffffff
+
 
 class Crushmap(object):
     """An object oriented approach to Ceph crushmap management."""
@@ -152,3 +164,201 @@ class CRUSHBucket(object):
         if isinstance(other, self.__class__):
             return not self.__eq__(other)
         return NotImplemented
+
+
+def get_crush_dump(service='admin'):
+    """Return the CRUSH map as decoded by 'ceph osd crush dump'.
+
+    :param service: The ceph client to run the command under.
+    :returns: dict. The decoded CRUSH map.
+    :raises: CalledProcessError if the ceph command fails.
+    """
+    out = check_output(['ceph', '--id', service,
+                        'osd', 'crush', 'dump', '--format=json'])
+    return json.loads(out.decode('UTF-8'))
+
+
+def find_crush_rule(crush_dump, rule):
+    """Find a rule in a CRUSH map dump.
+
+    :param crush_dump: dict as returned by get_crush_dump.
+    :param rule: The rule name, rule id or ruleset number. Pre-Luminous pools
+                 reference rules by ruleset.
+    :returns: dict describing the rule or None if it was not found.
+    """
+    for crush_rule in crush_dump.get('rules', []):
+        if rule in (crush_rule.get('rule_name'), crush_rule.get('rule_id')):
+            return crush_rule
+    for crush_rule in crush_dump.get('rules', []):
+        if rule == crush_rule.get('ruleset'):
+            return crush_rule
+    return None
+
+
+def get_rule_osds(crush_dump, rule):
+    """Return the OSDs a CRUSH rule is able to select.
+
+    Every bucket named by a 'take' step of the rule is expanded down to its
+    devices. Device class restricted rules take a shadow bucket, so they
+    resolve to the OSDs of that class only.
+
+    :param crush_dump: dict as returned by get_crush_dump.
+    :param rule: The rule name, rule id or ruleset number.
+    :returns: set of OSD ids. Empty if the rule does not exist.
+    """
+    crush_rule = find_crush_rule(crush_dump, rule)
+    if crush_rule is None:
+        return set()
+    return _expand_items(crush_dump,
+                         [step['item'] for step in crush_rule.get('steps', [])
+                          if step.get('op') == 'take'])
+
+
+def get_bucket_osds(crush_dump, bucket_name, device_class=None):
+    """Return the OSDs below a named CRUSH bucket.
+
+    :param crush_dump: dict as returned by get_crush_dump.
+    :param bucket_name: The name of the bucket, e.g. the root of a rule.
+    :param device_class: Optionally restrict the OSDs to a device class.
+    :returns: set of OSD ids. Empty if the bucket does not exist.
+    """
+    if device_class:
+        # Luminous keeps a per class shadow copy of the hierarchy
+        bucket_name = '{}~{}'.format(bucket_name, device_class)
+    return _expand_items(crush_dump,
+                         [bucket['id'] for bucket in crush_dump.get('buckets',
+                                                                    [])
+                          if bucket['name'] == bucket_name])
+
+
+def _expand_items(crush_dump, items):
+    """Expand CRUSH items to the set of devices below them."""
+    buckets = dict((bucket['id'], bucket)
+                   for bucket in crush_dump.get('buckets', []))
+    osds = set()
+    pending = list(items)
+    seen = set()
+    while pending:
+        item = pending.pop()
+        if item >= 0:
+            osds.add(item)
+            continue
+        if item in seen or item not in buckets:
+            continue
+        seen.add(item)
+        pending.extend(child['id'] for child in buckets[item]['items'])
+    return osds
+
+
+class CrushRuleResolver(object):
+    """Resolve the OSDs which CRUSH rules can select.
+
+    The CRUSH map and the configured default rule are read once on first use
+    and the OSDs of each rule or root are cached, so sizing many pools costs
+    a single call of each.
+    """
+
+    # Rule types as reported by 'osd crush dump'
+    REPLICATED = 1
+    ERASURE = 3
+
+    def __init__(self, service='admin'):
+        self.service = service
+        self._crush_dump = None
+        self._rule_osds = {}
+        self._bucket_osds = {}
+        self._default_crush_rule = None
+
+    @property
+    def crush_dump(self):
+        if self._crush_dump is None:
+            self._crush_dump = get_crush_dump(service=self.service)
+        return self._crush_dump
+
+    def rule_osds(self, rule):
+        """Return the set of OSD ids the rule can select."""
+        if rule not in self._rule_osds:
+            self._rule_osds[rule] = get_rule_osds(self.crush_dump, rule)
+        return self._rule_osds[rule]
+
+    def bucket_osds(self, bucket_name, device_class=None):
+        """Return the set of OSD ids below the named bucket."""
+        key = (bucket_name, device_class)
+        if key not in self._bucket_osds:
+            self._bucket_osds[key] = get_bucket_osds(
+                self.crush_dump, bucket_name, device_class=device_class)
+        return self._bucket_osds[key]
+
+    def default_replicated_rule(self):
+        """Return the id of the rule new replicated pools are given.
+
+        This is osd_pool_default_crush_rule when it names a replicated rule
+        in the map, otherwise the lowest numbered replicated rule as the
+        monitors would pick.
+
+        :returns: int or None if the map has no replicated rule.
+        """
+        rules = [rule['rule_id'] for rule in self.crush_dump.get('rules', [])
+                 if rule.get('type') == self.REPLICATED]
+        if not rules:
+            return None
+        if self._default_crush_rule is None:
+            self._default_crush_rule = get_default_crush_rule()
+        configured = self._default_crush_rule
+        if configured in rules:
+            return configured
+        return min(rules)
+
+
+def get_default_crush_rule():
+    """Return the osd_pool_default_crush_rule setting of the local monitor.
+
+    :returns: int. The configured rule id, or -1 if it is unset or the
+              monitor admin socket can not be queried.
+    """
+    cmd = ['ceph', 'daemon', 'mon.{}'.format(socket.gethostname()),
+           'config', 'get', 'osd_pool_default_crush_rule']
+    try:
+        out = check_output(cmd).decode('UTF-8')
+        return int(json.loads(out)['osd_pool_default_crush_rule'])
+    except (CalledProcessError, OSError, ValueError, KeyError) as e:
+        log("Unable to read osd_pool_default_crush_rule: {}".format(e),
+            level=DEBUG)
+        return -1
+
+
+@cached
+def get_crush_rule_resolver(service='admin'):
+    """Return a CrushRuleResolver shared for the rest of the hook."""
+    return CrushRuleResolver(service=service)
+
+
+def compile_crushmap(source_path, compiled_path):
+    """Compile a text CRUSH map with crushtool.
+
+    :param source_path: Path of the decompiled CRUSH map.
+    :param compiled_path: Path to write the compiled map to.
+    :raises: CalledProcessError if the map does not compile.
+    """
+    check_output(['crushtool', '-c', source_path, '-o', compiled_path])
+
+
+def get_rule_mappings(crushmap_path, rule, num_rep, num_x):
+    """Simulate the placement of inputs 0 to num_x - 1 through a rule.
+
+    :param crushmap_path: Path of a compiled CRUSH map.
+    :param rule: int. The rule to place the inputs with.
+    :param num_rep: int. The number of OSDs to choose for each input.
+    :param num_x: int. The number of inputs to place.
+    :returns: list of the OSD ids chosen for each input, indexed by input.
+    :raises: CalledProcessError if crushtool fails.
+    """
+    out = check_output(['crushtool', '-i', crushmap_path, '--test',
+                        '--show-mappings', '--rule', str(rule),
+                        '--num-rep', str(num_rep),
+                        '--min-x', '0', '--max-x', str(num_x - 1)])
+    mappings = [[] for _ in range(num_x)]
+    for _, x, osds in CRUSHTOOL_MAPPING_RE.findall(out.decode('UTF-8')):
+        if int(x) < num_x:
+            mappings[int(x)] = [int(osd) for osd in osds.split(',') if osd]
+    return mappings
@@ -0,0 +1,407 @@
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import json
+import math
+import os
+import socket
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import check_output, CalledProcessError
+
+from ceph.crush_utils import (
+    CRUSH_ITEM_NONE,
+    compile_crushmap,
+    get_crush_rule_resolver,
+    get_rule_mappings,
+)
+
+from charmhelpers.core.hookenv import (
+    config,
+    log,
+    DEBUG,
+)
+from charmhelpers.contrib.storage.linux.ceph import (
+    DEFAULT_MINIMUM_PGS,
+    DEFAULT_PGS_PER_OSD_TARGET,
+    DEFAULT_POOL_WEIGHT,
+)
+
+# Default of the mon_max_pg_per_osd option since Luminous. Pool creation
+# and pg_num increases which would push an OSD beyond it are refused.
+DEFAULT_MAX_PGS_PER_OSD = 200
+
+# Pool type recorded in the OSD map for erasure coded pools
+POOL_TYPE_ERASURE = 3
+
+# Upper bound on concurrent crushtool simulations
+MAX_SIMULATION_WORKERS = 4
+
+
+def nearest_power_of_two(num_pg):
+    """Round a placement group count to a power of two.
+
+    Follows the same rule as Pool.get_pgs: the nearest lower power of two is
+    used unless it is more than 25% below the original value, in which case
+    the next power of two up is used.
+
+    :param num_pg: The ideal number of placement groups.
+    :returns: int. The power of two to use, never less than
+              DEFAULT_MINIMUM_PGS.
+    """
+    if num_pg < DEFAULT_MINIMUM_PGS:
+        num_pg = DEFAULT_MINIMUM_PGS
+    exponent = math.floor(math.log(num_pg, 2))
+    nearest = 2 ** exponent
+    if (num_pg - nearest) > (num_pg * 0.25):
+        return int(nearest * 2)
+    return int(nearest)
+
+
+def get_max_pgs_per_osd():
+    """Return the mon_max_pg_per_osd setting of the local monitor.
+
+    :returns: int. The configured value, or DEFAULT_MAX_PGS_PER_OSD if the
+              monitor admin socket can not be queried.
+    """
+    cmd = ['ceph', 'daemon', 'mon.{}'.format(socket.gethostname()),
+           'config', 'get', 'mon_max_pg_per_osd']
+    try:
+        out = check_output(cmd).decode('UTF-8')
+        return int(json.loads(out)['mon_max_pg_per_osd'])
+    except (CalledProcessError, OSError, ValueError, KeyError) as e:
+        log("Unable to read mon_max_pg_per_osd, assuming {}: {}".format(
+            DEFAULT_MAX_PGS_PER_OSD, e), level=DEBUG)
+        return DEFAULT_MAX_PGS_PER_OSD
+
+
+def get_pools(service='admin'):
+    """Return the placement details of every pool in the cluster.
+
+    :param service: The ceph client to run the command under.
+    :returns: list of dicts with the pool name, rule, size and pg_num.
+    :raises: CalledProcessError if the ceph command fails.
+    """
+    out = check_output(['ceph', '--id', service,
+                        'osd', 'dump', '--format=json'])
+    pools = []
+    for pool in json.loads(out.decode('UTF-8'))['pools']:
+        # Luminous renamed crush_ruleset to crush_rule
+        rule = pool.get('crush_rule', pool.get('crush_ruleset'))
+        pools.append({
+            'name': pool['pool_name'],
+            'rule': rule,
+            'size': pool['size'],
+            'pg_num': pool['pg_num'],
+            'type': pool.get('type'),
+        })
+    return pools
+
+
+def get_pool_usage(service='admin'):
+    """Return the bytes used by each pool as reported by 'ceph df'.
+
+    :param service: The ceph client to run the command under.
+    :returns: dict of bytes used keyed by pool name.
+    :raises: CalledProcessError if the ceph command fails.
+    """
+    out = check_output(['ceph', '--id', service, 'df', '--format=json'])
+    return dict((pool['name'], pool['stats'].get('bytes_used', 0))
+                for pool in json.loads(out.decode('UTF-8'))['pools'])
+
+
+def set_pool_weights(pools, usage):
+    """Derive the percentage of data each pool holds within its rule.
+
+    The weight a client requested for a pool is not recorded in the cluster
+    so the share of the data actually stored is used instead. Rules which
+    hold no data yet fall back to DEFAULT_POOL_WEIGHT for each pool.
+
+    :param pools: list of pool dicts as returned by get_pools, updated in
+                  place with a 'weight' key.
+    :param usage: dict of bytes used keyed by pool name.
+    """
+    by_rule = collections.defaultdict(list)
+    for pool in pools:
+        by_rule[pool['rule']].append(pool)
+    for members in by_rule.values():
+        total = sum(usage.get(pool['name'], 0) for pool in members)
+        for pool in members:
+            if total:
+                pool['weight'] = (usage.get(pool['name'], 0) * 100.0 /
+                                  total)
+            else:
+                pool['weight'] = DEFAULT_POOL_WEIGHT
+
+
+def get_pgs_per_osd(pools, rule_osds, key='pg_num'):
+    """Return the number of placement group copies mapped to each OSD.
+
+    :param pools: list of pool dicts with a rule, size and the key to count.
+    :param rule_osds: dict of OSD id sets keyed by rule.
+    :param key: The pool attribute holding the pg_num to count.
+    :returns: dict of placement group counts keyed by OSD id.
+    """
+    load = collections.defaultdict(float)
+    for pool in pools:
+        osds = rule_osds.get(pool['rule'])
+        if not osds:
+            continue
+        share = float(pool[key] * pool['size']) / len(osds)
+        for osd in osds:
+            load[osd] += share
+    return load
+
+
+def plan_pg_nums(pools, rule_osds, pgs_per_osd=DEFAULT_PGS_PER_OSD_TARGET,
+                 max_pgs_per_osd=DEFAULT_MAX_PGS_PER_OSD):
+    """Plan pg_num for every pool in the cluster at once.
+
+    Each pool is sized from the OSDs its rule can select and its weight
+    within that rule, so that the OSDs behind each rule carry pgs_per_osd
+    placement groups. Pools are never shrunk. When the plan would push an
+    OSD above max_pgs_per_osd the largest increase touching that OSD is
+    halved until the plan fits.
+
+    :param pools: list of pool dicts with name, rule, size, pg_num and
+                  weight keys. Updated in place with 'osd_count' and
+                  'target_pg_num' keys.
+    :param rule_osds: dict of OSD id sets keyed by rule.
+    :param pgs_per_osd: int. The number of placement groups to target for
+                        each OSD.
+    :param max_pgs_per_osd: int. The hard limit of placement groups on any
+                            single OSD.
+    :returns: list. The updated pools.
+    """
+    by_rule = collections.defaultdict(list)
+    for pool in pools:
+        by_rule[pool['rule']].append(pool)
+
+    for rule, members in by_rule.items():
+        osd_count = len(rule_osds.get(rule, ()))
+        # Weights above 100% in total would overcommit the rule's OSDs.
+        total = sum(pool['weight'] for pool in members)
+        scale = 100.0 / total if total > 100 else 1.0
+        for pool in members:
+            pool['osd_count'] = osd_count
+            if not osd_count:
+                pool['target_pg_num'] = pool['pg_num']
+                continue
+            num_pg = (pgs_per_osd * osd_count *
+                      pool['weight'] * scale / 100.0) / pool['size']
+            pool['target_pg_num'] = max(pool['pg_num'],
+                                        nearest_power_of_two(num_pg))
+
+    while True:
+        load = get_pgs_per_osd(pools, rule_osds, key='target_pg_num')
+        overloaded = [osd for osd in load if load[osd] > max_pgs_per_osd]
+        if not overloaded:
+            break
+        osd = max(overloaded, key=load.get)
+        candidates = [pool for pool in pools
+                      if osd in rule_osds.get(pool['rule'], ()) and
+                      pool['target_pg_num'] > pool['pg_num']]
+        if not candidates:
+            log("osd.{} is above {} placement groups with the current "
+                "pg_num values".format(osd, max_pgs_per_osd), level=DEBUG)
+            break
+        largest = max(candidates,
+                      key=lambda pool: (float(pool['target_pg_num'] *
+                                              pool['size']) /
+                                        pool['osd_count']))
+        largest['target_pg_num'] = max(largest['pg_num'],
+                                       largest['target_pg_num'] // 2)
+
+    return pools
+
+
+def get_pg_plan(service='admin', pgs_per_osd=None, max_pgs_per_osd=None):
+    """Gather the cluster state and plan pg_num for every pool.
+
+    :param service: The ceph client to run the commands under.
+    :param pgs_per_osd: int. Placement groups to target per OSD, defaults to
+                        the pgs-per-osd charm option.
+    :param max_pgs_per_osd: int. Placement group limit per OSD, defaults to
+                            the monitor's mon_max_pg_per_osd.
+    :returns: list of planned pool dicts, see plan_pg_nums.
+    :raises: CalledProcessError if any of the ceph commands fail.
+    """
+    pgs_per_osd = (pgs_per_osd or config('pgs-per-osd') or
+                   DEFAULT_PGS_PER_OSD_TARGET)
+    max_pgs_per_osd = max_pgs_per_osd or get_max_pgs_per_osd()
+
+    pools = get_pools(service=service)
+    set_pool_weights(pools, get_pool_usage(service=service))
+    resolver = get_crush_rule_resolver(service=service)
+    rule_osds = dict((pool['rule'], resolver.rule_osds(pool['rule']))
+                     for pool in pools)
+
+    return plan_pg_nums(pools, rule_osds, pgs_per_osd=pgs_per_osd,
+                        max_pgs_per_osd=max_pgs_per_osd)
+
+
+def count_moved_shards(old, new, erasure=False):
+    """Return how many shards of a placement group change OSD.
+
+    Replicas may be reordered without moving data, erasure coded shards
+    may not.
+
+    :param old: list of OSD ids the placement group maps to now.
+    :param new: list of OSD ids the placement group would map to.
+    :param erasure: bool. Whether the shard position is significant.
+    :returns: int. The number of shards which would have to be backfilled.
+    """
+    if erasure:
+        return sum(1 for index, osd in enumerate(new)
+                   if osd != CRUSH_ITEM_NONE and
+                   (index >= len(old) or old[index] != osd))
+    return len(set(new) - set(old) - set([CRUSH_ITEM_NONE]))
+
+
+def get_osd_load(pools, mappings):
+    """Return the number of placement group shards mapped to each OSD.
+
+    :param pools: list of pool dicts with a rule, size and pg_num.
+    :param mappings: dict of per input OSD lists keyed by (rule, size).
+    :returns: dict of shard counts keyed by OSD id.
+    """
+    load = collections.defaultdict(int)
+    for pool in pools:
+        for osds in mappings[(pool['rule'], pool['size'])][:pool['pg_num']]:
+            for osd in osds:
+                if osd != CRUSH_ITEM_NONE:
+                    load[osd] += 1
+    return load
+
+
+def summarize_osd_load(load, top=5):
+    """Summarise how evenly shards are spread across OSDs.
+
+    :param load: dict of shard counts keyed by OSD id.
+    :param top: int. The number of most loaded OSDs to list.
+    :returns: dict with the min, max, mean and standard deviation of the
+              load and the most loaded OSDs.
+    """
+    if not load:
+        return {}
+    counts = list(load.values())
+    mean = float(sum(counts)) / len(counts)
+    stddev = math.sqrt(sum((count - mean) ** 2 for count in counts) /
+                       len(counts))
+    most_loaded = sorted(load.items(), key=lambda item: (-item[1], item[0]))
+    return {
+        'osds': len(counts),
+        'min': min(counts),
+        'max': max(counts),
+        'mean': round(mean, 2),
+        'stddev': round(stddev, 2),
+        'most_loaded': [{'osd': osd, 'shards': count}
+                        for osd, count in most_loaded[:top]],
+    }
+
+
+def compare_mappings(pools, usage, current, proposed):
+    """Estimate the data movement between two sets of simulated mappings.
+
+    :param pools: list of pool dicts as returned by get_pools.
+    :param usage: dict of bytes used keyed by pool name.
+    :param current: dict of per input OSD lists keyed by (rule, size)
+                    under the current CRUSH map.
+    :param proposed: dict of the same under the proposed CRUSH map.
+    :returns: dict with the movement of each pool, the totals and the
+              OSD load under both maps.
+    """
+    report = {'pools': [],
+              'total': {'pgs_remapped': 0, 'shards_moved': 0,
+                        'bytes_moved': 0}}
+    for pool in pools:
+        key = (pool['rule'], pool['size'])
+        erasure = pool.get('type') == POOL_TYPE_ERASURE
+        remapped = moved = 0
+        for old, new in zip(current[key][:pool['pg_num']],
+                            proposed[key][:pool['pg_num']]):
+            shards = count_moved_shards(old, new, erasure=erasure)
+            if shards:
+                remapped += 1
+                moved += shards
+        # Data is assumed to be spread evenly across a pool's shards
+        total_shards = pool['pg_num'] * pool['size']
+        bytes_moved = (usage.get(pool['name'], 0) * moved // total_shards
+                       if total_shards else 0)
+        report['pools'].append({'name': pool['name'],
+                                'pg_num': pool['pg_num'],
+                                'pgs_remapped': remapped,
+                                'shards_moved': moved,
+                                'bytes_moved': bytes_moved})
+        report['total']['pgs_remapped'] += remapped
+        report['total']['shards_moved'] += moved
+        report['total']['bytes_moved'] += bytes_moved
+    report['osd_load'] = {
+        'current': summarize_osd_load(get_osd_load(pools, current)),
+        'proposed': summarize_osd_load(get_osd_load(pools, proposed)),
+    }
+    return report
+
+
+def simulate_crushmap(crushmap, service='admin',
+                      max_workers=MAX_SIMULATION_WORKERS):
+    """Predict the effect of replacing the CRUSH map on every pool.
+
+    The placement of each pool's placement groups is simulated under the
+    current and the proposed map with crushtool, one simulation per rule
+    and pool size running in parallel. crushtool places the inputs
+    0..pg_num-1 rather than the hashed placement seeds the OSDs use, so
+    the result is a statistical estimate of the movement rather than an
+    exact list of the placement groups which will move.
+
+    :param crushmap: str. The proposed CRUSH map in text form.
+    :param service: The ceph client to run the commands under.
+    :param max_workers: int. The number of crushtool processes to run at
+                        once.
+    :returns: dict, see compare_mappings.
+    :raises: CalledProcessError if the map does not compile or any of the
+             commands fail.
+    """
+    pools = get_pools(service=service)
+    usage = get_pool_usage(service=service)
+    # Pools sharing a rule and size share mappings for their first inputs
+    num_x = {}
+    for pool in pools:
+        key = (pool['rule'], pool['size'])
+        num_x[key] = max(num_x.get(key, 0), pool['pg_num'])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        maps = {'current': os.path.join(tmpdir, 'current.bin'),
+                'proposed': os.path.join(tmpdir, 'proposed.bin')}
+        check_output(['ceph', '--id', service, 'osd', 'getcrushmap',
+                      '-o', maps['current']])
+        source = os.path.join(tmpdir, 'proposed.txt')
+        with open(source, 'w') as f:
+            f.write(crushmap)
+        compile_crushmap(source, maps['proposed'])
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict(
+                ((name, key), executor.submit(get_rule_mappings, path,
+                                              key[0], key[1], count))
+                for name, path in maps.items()
+                for key, count in num_x.items())
+            mappings = {'current': {}, 'proposed': {}}
+            for (name, key), future in futures.items():
+                mappings[name][key] = future.result()
+
+    return compare_mappings(pools, usage, mappings['current'],
+                            mappings['proposed'])
@@ -15,8 +15,10 @@
 import collections
 import ctypes
 import errno
+import grp
 import json
 import os
+import pwd
 import pyudev
 import random
 import re
@@ -26,8 +28,6 @@ import sys
 import time
 import shutil
 
-from datetime import datetime
-
 from charmhelpers.core import hookenv
 from charmhelpers.core import templating
 from charmhelpers.core.decorators import retry_on_exception
@@ -37,7 +37,6 @@ from charmhelpers.core.host import (
     lsb_release,
     mkdir,
     mounts,
-    owner,
     service_restart,
     service_start,
     service_stop,
@@ -74,6 +73,11 @@ from charmhelpers.contrib.openstack.utils import (
     get_os_codename_install_source,
 )
 
+from ceph.crush_utils import (
+    get_bucket_osds,
+    get_crush_dump,
+)
+
 CEPH_BASE_DIR = os.path.join(os.sep, 'var', 'lib', 'ceph')
 OSD_BASE_DIR = os.path.join(CEPH_BASE_DIR, 'osd')
 HDPARM_FILE = os.path.join(os.sep, 'etc', 'hdparm.conf')
@@ -1337,7 +1341,7 @@ def add_keyring_to_ceph(keyring, secret, hostname, path, done, init_marker):
     subprocess.check_call(['ceph-mon', '--mkfs',
                            '-i', hostname,
                            '--keyring', keyring])
-    chownr(path, ceph_user(), ceph_user())
+    fix_ownership(path)
     with open(done, 'w'):
         pass
     with open(init_marker, 'w'):
@@ -1534,7 +1538,7 @@ def osdize_dir(path, encrypt=False, bluestore=False):
         return
 
     mkdir(path, owner=ceph_user(), group=ceph_user(), perms=0o755)
-    chownr('/var/lib/ceph', ceph_user(), ceph_user())
+    fix_ownership(CEPH_BASE_DIR)
     cmd = [
         'sudo', '-u', ceph_user(),
         'ceph-disk',
@@ -1723,17 +1727,12 @@ def upgrade_monitor(new_version):
             service_stop('ceph-mon-all')
         apt_install(packages=determine_packages(), fatal=True)
 
-        owner = ceph_user()
-
         # Ensure the files and directories under /var/lib/ceph is chowned
         # properly as part of the move to the Jewel release, which moved the
         # ceph daemons to running as ceph:ceph instead of root:root.
         if new_version == 'jewel':
             # Ensure the ownership of Ceph's directories is correct
-            chownr(path=os.path.join(os.sep, "var", "lib", "ceph"),
-                   owner=owner,
-                   group=owner,
-                   follow_links=True)
+            fix_ownership(CEPH_BASE_DIR, follow_links=True)
 
         # Ensure that mon directory is user writable
         hostname = socket.gethostname()
@@ -2098,10 +2097,9 @@ def enable_osd(osd_num):
 def update_owner(path, recurse_dirs=True):
     """Changes the ownership of the specified path.
 
-    Changes the ownership of the specified path to the new ceph daemon user
-    using the system's native chown functionality. This may take awhile,
-    so this method will issue a set_status for any changes of ownership which
-    recurses into directory structures.
+    Changes the ownership of the specified path to the new ceph daemon user.
+    Directory structures are handled by fix_ownership, which may take awhile
+    and reports its progress with status_set.
 
     :param path: the path to recursively change ownership for
     :param recurse_dirs: boolean indicating whether to recursively change the
@@ -2109,23 +2107,59 @@ def update_owner(path, recurse_dirs=True):
                          simply change the ownership of the path.
     :raises CalledProcessError: if an error occurs issuing the chown system
                                 command
+    :raises OSError: if an entry of a directory structure cannot be changed
     """
     user = ceph_user()
-    user_group = '{ceph_user}:{ceph_user}'.format(ceph_user=user)
-    cmd = ['chown', user_group, path]
     if os.path.isdir(path) and recurse_dirs:
-        status_set('maintenance', ('Updating ownership of %s to %s' %
-                                   (path, user)))
-        cmd.insert(1, '-R')
+        # As chown -R, symlinks such as an OSD's block and journal links are
+        # changed themselves rather than the devices they point at.
+        fix_ownership(path, follow_links=False, chowntopdir=True)
+        return
 
+    user_group = '{ceph_user}:{ceph_user}'.format(ceph_user=user)
     log('Changing ownership of {path} to {user}'.format(
         path=path, user=user_group), DEBUG)
-    start = datetime.now()
-    subprocess.check_call(cmd)
-    elapsed_time = (datetime.now() - start)
+    subprocess.check_call(['chown', user_group, path])
+
+
+OWNERSHIP_PROGRESS_INTERVAL = 10
+
 
-    log('Took {secs} seconds to change the ownership of path: {path}'.format(
-        secs=elapsed_time.total_seconds(), path=path), DEBUG)
+def fix_ownership(path, follow_links=True, chowntopdir=False,
+                  interval=OWNERSHIP_PROGRESS_INTERVAL):
+    """Changes the ownership of everything under path to the ceph user.
+
+    Entries that are already owned by the ceph user are skipped, and the
+    number of entries checked and changed, along with the rate, is
+    reported through status_set every interval seconds.
+
+    :param path: the path to recursively change ownership for
+    :param follow_links: boolean indicating whether to follow symlinks
+    :param chowntopdir: boolean indicating whether to also change path itself
+    :param interval: seconds between progress updates
+    :raises OSError: if an entry cannot be changed
+    """
+    user = ceph_user()
+    start = time.time()
+    last = [start]
+
+    def progress(checked, changed):
+        now = time.time()
+        if now - last[0] < interval:
+            return
+        last[0] = now
+        rate = checked / (now - start)
+        status_set('maintenance',
+                   'Updating ownership of {}: {} checked, {} changed '
+                   '({:.0f} entries/s)'.format(path, checked, changed, rate))
+
+    status_set('maintenance',
+               'Updating ownership of {} to {}'.format(path, user))
+    checked, changed = chownr(path, user, user, follow_links=follow_links,
+                              chowntopdir=chowntopdir, progress=progress)
+    log('Changed the ownership of {} of {} entries under {} in {:.1f} '
+        'seconds'.format(changed, checked, path, time.time() - start),
+        DEBUG)
 
 
 def list_pools(service):
@@ -2148,6 +2182,30 @@ def list_pools(service):
         raise
 
 
+@cached
+def _uid_name(uid):
+    return pwd.getpwuid(uid).pw_name
+
+
+@cached
+def _gid_name(gid):
+    return grp.getgrgid(gid).gr_name
+
+
+def _child_dir_owners(path):
+    """Returns (name, uid, gid) of each directory in path, sorted.
+
+    :raises OSError: if path can not be listed
+    """
+    owners = []
+    for entry in os.scandir(path):
+        if not entry.is_dir():
+            continue
+        st = entry.stat()
+        owners.append((entry.name, st.st_uid, st.st_gid))
+    return sorted(owners)
+
+
 def dirs_need_ownership_update(service):
     """Determines if directories still need change of ownership.
 
@@ -2156,6 +2214,8 @@ def dirs_need_ownership_update(service):
     necessary due to the upgrade from Hammer to Jewel where the daemon user
     changes from root: to ceph:.
 
+    Each uid and gid is resolved to a name once per hook.
+
     :param service: the name of the service folder to check (e.g. osd, mon)
     :returns: boolean. True if the directories need a change of ownership,
              False otherwise.
@@ -2165,13 +2225,13 @@ def dirs_need_ownership_update(service):
     """
     expected_owner = expected_group = ceph_user()
     path = os.path.join(CEPH_BASE_DIR, service)
-    for child in _get_child_dirs(path):
-        curr_owner, curr_group = owner(child)
-
-        if (curr_owner == expected_owner) and (curr_group == expected_group):
+    for name, uid, gid in _child_dir_owners(path):
+        if (_uid_name(uid) == expected_owner and
+                _gid_name(gid) == expected_group):
             continue
 
-        log('Directory "%s" needs its ownership updated' % child, DEBUG)
+        log('Directory "%s" needs its ownership updated' %
+            os.path.join(path, name), DEBUG)
         return True
 
     # All child directories had the expected ownership
@@ -2292,6 +2352,127 @@ def reweight_osd(osd_num, new_weight):
         raise
 
 
+# config-key recording the OSD flags set on CRUSH subtrees and their expiry
+SUBTREE_FLAGS_KEY = 'charm.subtree-flags'
+
+# Flags which Ceph can apply to individual OSDs and CRUSH subtrees
+SUBTREE_FLAGS = ['noout', 'noin', 'nodown', 'noup']
+
+
+def get_subtree_flags(service='admin'):
+    """Returns the OSD flags the charm has set on CRUSH subtrees.
+
+    :param service: The ceph client to run the command under.
+    :returns: dict keyed by bucket name of dicts holding the 'expires'
+              timestamp and the targets each flag was applied to.
+    """
+    records = monitor_key_get(service, SUBTREE_FLAGS_KEY)
+    return json.loads(records) if records else {}
+
+
+def _save_subtree_flags(records, service='admin'):
+    monitor_key_set(service, SUBTREE_FLAGS_KEY,
+                    json.dumps(records, sort_keys=True))
+
+
+def _osd_flag_cmd(operation, flag, targets, service='admin'):
+    return (['ceph', '--id', service, 'osd',
+             '{}-{}'.format(operation, flag)] + targets)
+
+
+def set_subtree_flags(bucket, flags, expires, service='admin'):
+    """Sets OSD flags on every OSD under a CRUSH bucket.
+
+    The flags are applied to the bucket itself where Ceph supports it
+    (Nautilus onwards) and to each OSD under it otherwise. The flags are
+    recorded along with an expiry so expire_subtree_flags can clear them.
+
+    :param bucket: The name of the CRUSH bucket, e.g. a rack or host.
+    :param flags: list of flags from SUBTREE_FLAGS.
+    :param expires: int. Unix timestamp after which the flags are cleared.
+    :param service: The ceph client to run the commands under.
+    :returns: dict. The targets each flag was applied to.
+    :raises: ValueError if a flag is not supported or the bucket holds no
+             OSDs, CalledProcessError if a ceph command fails.
+    """
+    if cmp_pkgrevno('ceph', '12.0.0') < 0:
+        raise ValueError("Per OSD flags require Ceph Luminous or later")
+    invalid = set(flags) - set(SUBTREE_FLAGS)
+    if invalid:
+        raise ValueError("Unsupported flags: {}".format(
+            ', '.join(sorted(invalid))))
+
+    if cmp_pkgrevno('ceph', '14.0.0') >= 0:
+        targets = [bucket]
+    else:
+        # Before Nautilus only OSD ids are accepted
+        targets = ['osd.{}'.format(osd) for osd in sorted(
+            get_bucket_osds(get_crush_dump(service=service), bucket))]
+        if not targets:
+            raise ValueError("No OSDs found under {}".format(bucket))
+
+    records = get_subtree_flags(service=service)
+    record = records.setdefault(bucket, {'flags': {}})
+    try:
+        for flag in flags:
+            subprocess.check_call(_osd_flag_cmd('add', flag, targets,
+                                                service=service))
+            record['flags'][flag] = targets
+            log('Set {} on {}'.format(flag, bucket))
+    finally:
+        if record['flags']:
+            record['expires'] = int(expires)
+            _save_subtree_flags(records, service=service)
+    return record['flags']
+
+
+def unset_subtree_flags(bucket, flags=None, service='admin'):
+    """Clears OSD flags previously set on a CRUSH bucket.
+
+    :param bucket: The name of the CRUSH bucket.
+    :param flags: list of flags to clear, defaults to all recorded flags.
+    :param service: The ceph client to run the commands under.
+    :returns: list. The flags cleared.
+    :raises: CalledProcessError if a ceph command fails.
+    """
+    records = get_subtree_flags(service=service)
+    record = records.get(bucket, {'flags': {}})
+    if flags is None:
+        flags = list(record['flags'])
+    cleared = []
+    try:
+        for flag in flags:
+            targets = record['flags'].get(flag, [bucket])
+            subprocess.check_call(_osd_flag_cmd('rm', flag, targets,
+                                                service=service))
+            record['flags'].pop(flag, None)
+            cleared.append(flag)
+            log('Unset {} on {}'.format(flag, bucket))
+    finally:
+        if bucket in records:
+            if not record['flags']:
+                del records[bucket]
+            _save_subtree_flags(records, service=service)
+    return cleared
+
+
+def expire_subtree_flags(now=None, service='admin'):
+    """Clears the subtree flags whose expiry has passed.
+
+    :param now: int. The current Unix timestamp, defaults to time.time().
+    :param service: The ceph client to run the commands under.
+    :returns: list. The buckets whose flags were cleared.
+    """
+    now = now or time.time()
+    expired = [bucket for bucket, record
+               in get_subtree_flags(service=service).items()
+               if record.get('expires', 0) <= now]
+    for bucket in expired:
+        log('OSD flags on {} have expired, clearing them'.format(bucket))
+        unset_subtree_flags(bucket, service=service)
+    return expired
+
+
 def determine_packages():
     """Determines packages for installation.
 
@@ -2317,7 +2498,7 @@ def bootstrap_manager():
                                'allow profile mgr', 'osd', 'allow *',
                                'mds', 'allow *', '--out-file',
                                keyring])
-        chownr(path, ceph_user(), ceph_user())
+        fix_ownership(path)
 
         unit = 'ceph-mgr@{}'.format(hostname)
         subprocess.check_call(['systemctl', 'enable', unit])
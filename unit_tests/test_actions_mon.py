@@ -12,7 +12,13 @@
 # limitations under the License.
 
 from mock import mock
+import gzip
+import json
+from datetime import datetime
+import os
+import shutil
 import sys
+import tempfile
 
 from test_utils import CharmTestCase
 
@@ -26,6 +32,7 @@ mock_apt.apt_pkg = mock.MagicMock()
 mock_rados = mock.MagicMock()
 sys.modules['rados'] = mock_rados
 mock_rados.connect = mock.MagicMock()
+mock_rados.Error = type("Error", (Exception,), {})
 
 # mocking for psutil
 mock_psutil = mock.MagicMock()
@@ -52,3 +59,161 @@ class OpsTestCase(CharmTestCase):
         actions.get_health()
         cmd = ['ceph', 'health']
         self.check_output.assert_called_once_with(cmd)
+
+    def test_all_pool_stats(self):
+        cluster = mock.MagicMock()
+        cluster.list_pools.return_value = ['rbd', 'glance', 'nova']
+        cluster.open_ioctx.side_effect = lambda pool: mock.MagicMock(
+            get_stats=mock.MagicMock(return_value={'num_objects': len(pool)}))
+        with mock.patch.object(actions, 'connect', return_value=cluster):
+            stats = actions.all_pool_stats(pool_glob='[gn]*')
+        self.assertEqual(stats, [{'pool': 'glance', 'num_objects': 6},
+                                 {'pool': 'nova', 'num_objects': 4}])
+        cluster.shutdown.assert_called_once_with()
+        self.assertFalse(self.action_fail.called)
+
+    def test_osd_df_rows(self):
+        df_tree = {
+            'nodes': [
+                {'id': -1, 'name': 'default', 'type': 'root',
+                 'children': [-2, -3]},
+                {'id': -2, 'name': 'node-a', 'type': 'host',
+                 'children': [0, 1]},
+                {'id': -3, 'name': 'node-b', 'type': 'host',
+                 'children': [2]},
+                {'id': 0, 'name': 'osd.0', 'type': 'osd', 'depth': 2,
+                 'utilization': 40.0},
+                {'id': 1, 'name': 'osd.1', 'type': 'osd', 'depth': 2,
+                 'utilization': 80.0},
+                {'id': 2, 'name': 'osd.2', 'type': 'osd', 'depth': 2,
+                 'utilization': 60.0},
+            ],
+            'stray': [
+                {'id': 3, 'name': 'osd.3', 'type': 'osd',
+                 'utilization': 0.0},
+            ],
+        }
+        rows = actions.flatten_osd_df_tree(df_tree)
+        self.assertEqual(rows[0], {'id': 0, 'name': 'osd.0', 'type': 'osd',
+                                   'utilization': 40.0,
+                                   'host': 'node-a', 'root': 'default'})
+        self.assertIsNone(rows[3]['host'])
+        filtered = actions.osd_df_rows(rows, root='default',
+                                       min_utilization=50,
+                                       sort_by='utilization')
+        self.assertEqual([row['name'] for row in filtered],
+                         ['osd.1', 'osd.2'])
+        self.assertEqual(
+            [row['name'] for row in actions.osd_df_rows(rows, host='*-b')],
+            ['osd.2'])
+        self.assertEqual(actions.paginate(rows, offset=1, limit=2),
+                         rows[1:3])
+        self.assertEqual(actions.summarize_osd_df(filtered),
+                         {'osds': 2, 'min_utilization': 60.0,
+                          'max_utilization': 80.0,
+                          'avg_utilization': 70.0})
+
+    def test_write_action_output(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        os.mkdir(os.path.join(tmpdir, 'ceph-mon'))
+        stamps = ['20180101000000', '20180101000001', '20180101000002']
+        with mock.patch.object(actions, 'ACTION_OUTPUT_DIR',
+                               os.path.join(tmpdir, '{}')), \
+                mock.patch.object(actions, 'ACTION_OUTPUT_KEEP', 2), \
+                mock.patch.object(actions, 'service_name',
+                                  return_value='ceph-mon'), \
+                mock.patch.object(actions, 'mkdir'), \
+                mock.patch.object(actions.time, 'strftime',
+                                  side_effect=stamps):
+            paths = [actions.write_action_output('show-disk-free',
+                                                 {'osds': [n]})
+                     for n in range(2)]
+            with open(os.path.join(tmpdir, 'ceph-mon',
+                                   'other-20170101000000.json.gz'), 'w'):
+                pass
+            paths.append(actions.write_action_output('show-disk-free',
+                                                     {'osds': [2]}))
+        with gzip.open(paths[-1], 'rt') as f:
+            self.assertEqual(json.load(f), {'osds': [2]})
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(tmpdir, 'ceph-mon'))),
+            ['other-20170101000000.json.gz',
+             'show-disk-free-20180101000001.json.gz',
+             'show-disk-free-20180101000002.json.gz'])
+
+    def test_set_pool_matrix(self):
+        cluster = mock.MagicMock()
+        cluster.mon_command.return_value = (0, b'', '')
+        matrix = actions.parse_pool_matrix(
+            '{glance: {noscrub: true, hit_set_fpp: 1}, '
+            'nova: {size: three, bogus: 1}}')
+        with mock.patch.object(actions, 'connect', return_value=cluster):
+            results = actions.set_pool_matrix(matrix)
+        self.assertEqual(results['glance'], {'noscrub': 'ok',
+                                             'hit_set_fpp': 'ok'})
+        self.assertEqual(results['nova']['bogus'],
+                         {'error': "Invalid key 'bogus'"})
+        self.assertIn('error', results['nova']['size'])
+        commands = sorted(json.loads(call[0][0])['val']
+                          for call in cluster.mon_command.call_args_list)
+        self.assertEqual(commands, ['1.0', 'true'])
+        cluster.shutdown.assert_called_once_with()
+
+    def test_get_pool_matrix(self):
+        cluster = mock.MagicMock()
+        cluster.mon_command.side_effect = [
+            (0, b'{"pool": "glance", "size": 3}', ''),
+            (-2, b'', 'unrecognized variable'),
+            (0, b'{"pool": "glance", "crush_rule": "replicated_rule"}', ''),
+        ]
+        with mock.patch.object(actions, 'connect', return_value=cluster):
+            results = actions.get_pool_matrix(
+                {'glance': ['size', 'bogus', 'crush_ruleset']},
+                max_workers=1)
+        self.assertEqual(results, {'glance': {
+            'size': 3, 'bogus': {'error': 'unrecognized variable'},
+            'crush_ruleset': {'error': "No value for crush_ruleset in the "
+                                       "monitor's reply"}}})
+
+    def test_expired_snapshots(self):
+        now = datetime(2018, 10, 10)
+        snapshots = [('snap-20181009000000', datetime(2018, 10, 9)),
+                     ('snap-20180901000000', datetime(2018, 9, 1)),
+                     ('manual', datetime(2018, 1, 1)),
+                     ('snapshot-20180101000000', datetime(2018, 1, 1)),
+                     ('snapper', datetime(2018, 1, 1)),
+                     ('snap-before-upgrade', datetime(2018, 1, 1)),
+                     ('snap-20181008000000', datetime(2018, 10, 8))]
+        self.assertEqual(actions.expired_snapshots(snapshots, 'snap',
+                                                   keep=2, now=now),
+                         ['snap-20180901000000'])
+        self.assertEqual(actions.expired_snapshots(snapshots, 'snap',
+                                                   max_age=1.5, now=now),
+                         ['snap-20181008000000', 'snap-20180901000000'])
+        self.assertEqual(actions.expired_snapshots(snapshots, 'snap',
+                                                   now=now), [])
+        self.assertEqual(actions.snapshot_set_name(
+            'snap', when=datetime(2018, 10, 8, 2).timetuple()),
+            'snap-20181008020000')
+
+    def test_snapshot_pool_set(self):
+        cluster = mock.MagicMock()
+        cluster.list_pools.return_value = ['glance', 'nova', 'cinder-1']
+        ioctx = mock.MagicMock()
+        old = mock.MagicMock(get_timestamp=lambda: datetime(2018, 1, 1))
+        old.name = 'snap-20180101000000'
+        ioctx.list_snaps.return_value = [old]
+        cluster.open_ioctx.return_value = ioctx
+        with mock.patch.object(actions, 'connect', return_value=cluster):
+            results = actions.snapshot_pool_set(['glance', 'cinder-*'],
+                                                'snap-new', 'snap',
+                                                max_age=30)
+        self.assertEqual(results, {
+            'cinder-1': {'snapshot': 'snap-new',
+                         'removed': ['snap-20180101000000']},
+            'glance': {'snapshot': 'snap-new',
+                       'removed': ['snap-20180101000000']}})
+        ioctx.create_snap.assert_called_with('snap-new')
+        self.assertEqual(ioctx.remove_snap.call_count, 2)
+        cluster.shutdown.assert_called_once_with()
@@ -0,0 +1,65 @@
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from mock import call, patch
+
+from ceph import balance_utils
+
+TIB = balance_utils.CRUSH_WEIGHT_UNIT_KB
+
+# Four 1TiB OSDs at 80%, 50%, 50% and 20% utilization.
+OSD_DF = [
+    {'id': 0, 'name': 'osd.0', 'crush_weight': 1.0, 'reweight': 1.0,
+     'kb': TIB, 'kb_used': TIB * 0.8, 'utilization': 80.0},
+    {'id': 1, 'name': 'osd.1', 'crush_weight': 1.0, 'reweight': 1.0,
+     'kb': TIB, 'kb_used': TIB * 0.5, 'utilization': 50.0},
+    {'id': 2, 'name': 'osd.2', 'crush_weight': 1.0, 'reweight': 1.0,
+     'kb': TIB, 'kb_used': TIB * 0.5, 'utilization': 50.0},
+    {'id': 3, 'name': 'osd.3', 'crush_weight': 0.9, 'reweight': 0.9,
+     'kb': TIB, 'kb_used': TIB * 0.2, 'utilization': 20.0},
+]
+
+
+class BalanceTestCase(unittest.TestCase):
+
+    def test_plan_reweights(self):
+        plan = balance_utils.plan_reweights(OSD_DF, target_var=1.05,
+                                            max_change=0.05)
+        self.assertEqual([(change['name'], change['new_weight'])
+                          for change in plan],
+                         [('osd.0', 0.95), ('osd.3', 0.945)])
+
+    def test_plan_reweights_limits(self):
+        plan = balance_utils.plan_reweights(OSD_DF, max_osds=1,
+                                            method='reweight')
+        self.assertEqual(plan, [{'osd': 0, 'name': 'osd.0', 'var': 1.6,
+                                 'weight': 1.0, 'new_weight': 0.95}])
+        # Within the target nothing changes
+        self.assertEqual(balance_utils.plan_reweights(OSD_DF,
+                                                      target_var=2.0), [])
+
+    @patch.object(balance_utils.time, 'sleep')
+    @patch.object(balance_utils, 'check_call')
+    def test_apply_reweights(self, check_call, sleep):
+        plan = balance_utils.plan_reweights(OSD_DF)
+        self.assertEqual(balance_utils.apply_reweights(
+            plan, batch_size=1, batch_interval=30), 2)
+        check_call.assert_has_calls([
+            call(['ceph', '--id', 'admin', 'osd', 'crush', 'reweight',
+                  'osd.0', '0.95']),
+            call(['ceph', '--id', 'admin', 'osd', 'crush', 'reweight',
+                  'osd.3', '0.945'])])
+        sleep.assert_called_once_with(30)
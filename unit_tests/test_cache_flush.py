@@ -0,0 +1,125 @@
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from mock import MagicMock, patch
+
+from ceph import cache_flush
+
+
+class CacheFlushTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+        patcher = patch.object(cache_flush, 'flush_state_dir',
+                               lambda: self.state_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch.object(cache_flush, 'job_alive', lambda job: False)
+    @patch.object(cache_flush.subprocess, 'Popen')
+    def test_start_and_resume(self, popen):
+        popen.return_value.pid = 1234
+        job = cache_flush.start_flush_job('hot', 'cold')
+        self.assertEqual(job['pid'], 1234)
+        self.assertEqual(popen.call_args[0][0][-4:],
+                         ['-m', 'ceph.cache_flush', 'hot', self.state_dir])
+        job['flushed'] = 10
+        cache_flush.save_flush_job(job)
+        popen.return_value.pid = 5678
+        self.assertEqual(cache_flush.resume_flush_jobs(), ['hot'])
+        job = cache_flush.get_flush_job('hot')
+        self.assertEqual((job['pid'], job['flushed']), (5678, 10))
+
+    def test_job_alive(self):
+        pid = os.getpid()
+        start_time = cache_flush.process_start_time(pid)
+        self.assertIsInstance(start_time, int)
+        self.assertTrue(cache_flush.job_alive({'pid': pid,
+                                               'pid_start': start_time}))
+        # The pid was reused by another process
+        self.assertFalse(cache_flush.job_alive({'pid': pid,
+                                                'pid_start': start_time - 1}))
+        self.assertFalse(cache_flush.job_alive({'pid': pid}))
+        self.assertFalse(cache_flush.job_alive({}))
+
+    @patch.object(cache_flush, 'process_start_time', lambda pid: 42)
+    @patch.object(cache_flush.os, 'kill')
+    @patch.object(cache_flush.subprocess, 'Popen')
+    def test_resume_reused_pid(self, popen, kill):
+        cache_flush.save_flush_job({'cache_pool': 'hot', 'state': 'running',
+                                    'backer_pool': 'cold', 'pid': 1234,
+                                    'pid_start': 41})
+        popen.return_value.pid = 5678
+        self.assertEqual(cache_flush.resume_flush_jobs(), ['hot'])
+        job = cache_flush.get_flush_job('hot')
+        self.assertEqual((job['pid'], job['pid_start']), (5678, 42))
+        self.assertEqual(cache_flush.resume_flush_jobs(), [])
+
+    def test_flush_status_message(self):
+        self.assertEqual(cache_flush.flush_status_message(), '')
+        cache_flush.save_flush_job({'cache_pool': 'hot', 'state': 'running',
+                                    'flushed': 25, 'total': 100})
+        cache_flush.save_flush_job({'cache_pool': 'old', 'state': 'done'})
+        self.assertEqual(cache_flush.flush_status_message(),
+                         'flushing cache hot 25%')
+        self.assertEqual(sorted(cache_flush.get_flush_jobs()),
+                         ['hot', 'old'])
+
+    @patch.object(cache_flush, 'remove_tier')
+    @patch.object(cache_flush.subprocess, 'check_output')
+    @patch.object(cache_flush.subprocess, 'Popen')
+    def test_run_flush_job(self, popen, check_output, remove_tier):
+        remaining = [60, 20, 0]
+
+        def df(cmd):
+            return json.dumps({'pools': [
+                {'name': 'hot', 'stats': {'objects': remaining.pop(0)}},
+            ]}).encode('UTF-8')
+        check_output.side_effect = df
+        process = popen.return_value
+        process.communicate.side_effect = [
+            subprocess.TimeoutExpired('rados', 1), (None, b'')]
+        process.returncode = 0
+        cache_flush.save_flush_job({'cache_pool': 'hot', 'state': 'running',
+                                    'backer_pool': 'cold', 'flushed': 40,
+                                    'total': 100})
+        cache_flush.run_flush_job('hot', self.state_dir)
+        self.assertEqual(popen.call_args[0][0],
+                         ['rados', '--id', 'admin', '-p', 'hot',
+                          'cache-flush-evict-all'])
+        job = cache_flush.get_flush_job('hot')
+        self.assertEqual((job['state'], job['flushed'], job['total']),
+                         ('done', 100, 100))
+        remove_tier.assert_called_once_with('admin', 'hot', 'cold')
+
+    @patch.object(cache_flush, 'remove_tier')
+    @patch.object(cache_flush, 'get_pool_objects', lambda service, pool: 5)
+    @patch.object(cache_flush.subprocess, 'Popen')
+    def test_run_flush_job_failed(self, popen, remove_tier):
+        popen.return_value = MagicMock(returncode=1)
+        popen.return_value.communicate.return_value = (None, b'busy')
+        cache_flush.save_flush_job({'cache_pool': 'hot', 'state': 'running',
+                                    'backer_pool': 'cold', 'flushed': 0})
+        cache_flush.run_flush_job('hot', self.state_dir)
+        job = cache_flush.get_flush_job('hot')
+        self.assertEqual((job['state'], job['error']), ('failed', 'busy'))
+        self.assertFalse(remove_tier.called)
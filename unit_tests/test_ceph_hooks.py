@@ -1,4 +1,5 @@
 import copy
+import json
 import unittest
 import sys
 
@@ -30,6 +31,7 @@ TO_PATCH = [
     'relation_ids',
     'related_units',
     'relation_get',
+    'prefetch_relation_data',
     'relations_of_type',
     'status_set',
 ]
@@ -284,6 +286,75 @@ class RelatedUnitsTestCase(unittest.TestCase):
                 'broker-rsp-glance-0': 'AOK',
                 'broker_rsp': 'AOK'})
 
+    @patch.object(ceph_hooks.ceph, 'list_pools')
+    @patch.object(ceph_hooks.unitdata, 'kv')
+    @patch.object(ceph_hooks, 'process_requests')
+    def test_process_broker_request_cached(self, process_requests, kv,
+                                           list_pools):
+        db = {}
+        kv.return_value.get.side_effect = db.get
+        kv.return_value.set.side_effect = db.__setitem__
+        list_pools.return_value = ['foo']
+        process_requests.return_value = '{"exit-code": 0}'
+        req = json.dumps({'api-version': 1, 'request-id': '1',
+                          'ops': [{'op': 'create-pool', 'name': 'foo'}]})
+        self.assertEqual(
+            ceph_hooks.process_broker_request('client:1', 'glance/0', req),
+            '{"exit-code": 0}')
+        self.assertEqual(
+            ceph_hooks.process_broker_request('client:1', 'glance/0', req),
+            '{"exit-code": 0}')
+        process_requests.assert_called_once_with(req)
+        list_pools.assert_called_once_with('admin')
+
+        # Pool removed out of band, the request is processed again.
+        list_pools.return_value = []
+        ceph_hooks.process_broker_request('client:1', 'glance/0', req)
+        self.assertEqual(process_requests.call_count, 2)
+
+        # A new request id is always processed.
+        list_pools.return_value = ['foo']
+        req = json.dumps({'api-version': 1, 'request-id': '2',
+                          'ops': [{'op': 'create-pool', 'name': 'foo'}]})
+        ceph_hooks.process_broker_request('client:1', 'glance/0', req)
+        self.assertEqual(process_requests.call_count, 3)
+
+        # The same unit on another relation has its own cache entry
+        ceph_hooks.process_broker_request('admin:2', 'glance/0', req)
+        self.assertEqual(process_requests.call_count, 4)
+        self.assertEqual(sorted(db), ['broker-rsp-cache.admin:2.glance/0',
+                                      'broker-rsp-cache.client:1.glance/0'])
+
+    @patch.object(ceph_hooks.unitdata, 'kv')
+    @patch.object(ceph_hooks, 'process_requests')
+    def test_process_broker_request_failure_not_cached(self,
+                                                       process_requests, kv):
+        kv.return_value.get.return_value = None
+        process_requests.return_value = '{"exit-code": 1}'
+        req = json.dumps({'api-version': 1, 'request-id': '1', 'ops': []})
+        ceph_hooks.process_broker_request('client:1', 'glance/0', req)
+        self.assertFalse(kv.return_value.set.called)
+
+    @patch.object(ceph_hooks, 'log', lambda *args, **kwargs: None)
+    @patch.object(ceph_hooks.unitdata, 'kv')
+    def test_compact_unit_state(self, kv):
+        db = kv.return_value
+        db.get.return_value = 1000
+        ceph_hooks.compact_unit_state(now=1000 + 3600)
+        self.assertFalse(db.prune_revisions.called)
+
+        ceph_hooks.compact_unit_state(now=1000 + 86400)
+        db.prune_revisions.assert_called_once_with(keep=10)
+        db.compact.assert_called_once_with()
+        db.set.assert_called_once_with('charm.unitdata-compacted',
+                                       1000 + 86400)
+        self.assertFalse(db.flush.called)
+
+        db.reset_mock()
+        db.prune_revisions.side_effect = ceph_hooks.sqlite3.OperationalError
+        ceph_hooks.compact_unit_state(now=1000 + 86400)
+        self.assertFalse(db.set.called)
+
 
 class BootstrapSourceTestCase(test_utils.CharmTestCase):
 
@@ -399,3 +470,5 @@ class BootstrapSourceTestCase(test_utils.CharmTestCase):
             '172.16.0.2:6789', '172.16.0.3:6789', '172.16.0.4:6789',
             '172.16.10.2:6789', '172.16.10.3:6789', '172.16.10.4:6789',
         ])
+        self.prefetch_relation_data.assert_called_once_with(
+            ['mon:0', 'bootstrap-source:1'])
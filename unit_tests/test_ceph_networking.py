@@ -34,7 +34,7 @@ class CephNetworkSpaceTestCase(test_utils.CharmTestCase):
 
     def tearDown(self):
         # Reset @cached cache
-        hookenv.cache = {}
+        hookenv.cache.clear()
 
     def test_no_network_space_support(self):
         self.get_host_ip.return_value = '192.168.2.1'
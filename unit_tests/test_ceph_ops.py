@@ -15,6 +15,8 @@
 import json
 import unittest
 
+from subprocess import CalledProcessError
+
 from mock import (
     call,
     patch,
@@ -23,11 +25,28 @@ from mock import (
 from ceph import broker
 
 
+def fake_check_output(records, caps=None):
+    """Build a check_output side effect serving config-key dump and auth get
+    from the supplied records and capabilities."""
+    def _check_output(cmd):
+        if 'config-key' in cmd:
+            return json.dumps(records).encode('UTF-8')
+        if caps is None:
+            raise CalledProcessError(2, cmd)
+        return json.dumps([{'caps': caps}]).encode('UTF-8')
+    return _check_output
+
+
 class TestCephOps(unittest.TestCase):
 
+    @patch.object(broker, 'get_erasure_profile')
+    @patch.object(broker, 'load_erasure_profiles', lambda service: {})
+    @patch.object(broker, 'get_erasure_profile_registry',
+                  lambda service: broker.ErasureProfileRegistry(service))
     @patch.object(broker, 'create_erasure_profile')
     @patch.object(broker, 'log', lambda *args, **kwargs: None)
-    def test_create_erasure_profile(self, mock_create_erasure):
+    def test_create_erasure_profile(self, mock_create_erasure,
+                                    mock_get_profile):
         req = json.dumps({'api-version': 1,
                           'ops': [{
                               'op': 'create-erasure-profile',
@@ -44,7 +63,9 @@ class TestCephOps(unittest.TestCase):
                                                data_chunks=3,
                                                locality=None,
                                                failure_domain='rack',
-                                               erasure_plugin_name='jerasure')
+                                               erasure_plugin_name='jerasure',
+                                               exists=False)
+        mock_get_profile.assert_called_once_with('admin', 'foo')
         self.assertEqual(json.loads(rc), {'exit-code': 0})
 
     @patch.object(broker, 'pool_exists')
@@ -89,6 +110,73 @@ class TestCephOps(unittest.TestCase):
         mock_replicated_pool.assert_has_calls(calls)
         self.assertEqual(json.loads(rc), {'exit-code': 0})
 
+    @patch.object(broker, 'pool_exists')
+    @patch.object(broker, 'ReplicatedPool')
+    @patch.object(broker, 'get_crush_rule_resolver')
+    @patch.object(broker, 'log', lambda *args, **kwargs: None)
+    def test_process_requests_replicated_pool_rule_osds(self, mock_resolver,
+                                                        mock_replicated_pool,
+                                                        mock_pool_exists):
+        mock_pool_exists.return_value = False
+        mock_resolver.return_value.default_replicated_rule.return_value = 0
+        mock_resolver.return_value.rule_osds.return_value = set(range(12))
+        reqs = json.dumps({'api-version': 1,
+                           'ops': [{
+                               'op': 'create-pool',
+                               'name': 'foo',
+                               'replicas': 3,
+                               'pg_num': 2048,
+                           }]})
+        rc = broker.process_requests(reqs)
+        mock_resolver.return_value.rule_osds.assert_called_with(0)
+        mock_replicated_pool.assert_called_with(
+            name=u'foo', service='admin', replicas=3, pg_num=400,
+            osd_count=12)
+        self.assertEqual(json.loads(rc), {'exit-code': 0})
+
+        # Nothing is sized for a pool which already exists
+        mock_resolver.reset_mock()
+        mock_replicated_pool.reset_mock()
+        mock_pool_exists.return_value = True
+        rc = broker.process_requests(reqs)
+        self.assertFalse(mock_resolver.called)
+        self.assertFalse(mock_replicated_pool.called)
+        self.assertEqual(json.loads(rc), {'exit-code': 0})
+
+    @patch.object(broker, 'pool_exists')
+    @patch.object(broker, 'ErasurePool')
+    @patch.object(broker, 'get_erasure_profile_registry')
+    @patch.object(broker, 'get_crush_rule_resolver')
+    @patch.object(broker, 'log', lambda *args, **kwargs: None)
+    def test_process_requests_erasure_pool_rule_osds(self, mock_resolver,
+                                                     mock_registry,
+                                                     mock_erasure_pool,
+                                                     mock_pool_exists):
+        mock_pool_exists.return_value = False
+        profile = {'k': '3', 'm': '2', 'crush-root': 'default',
+                   'crush-device-class': 'ssd'}
+        mock_registry.return_value.exists.return_value = True
+        mock_registry.return_value.get.return_value = profile
+        mock_resolver.return_value.bucket_osds.return_value = set(range(6))
+        reqs = json.dumps({'api-version': 1,
+                           'ops': [{
+                               'op': 'create-pool',
+                               'pool-type': 'erasure',
+                               'name': 'foo',
+                               'erasure-profile': 'fast',
+                           }]})
+        rc = broker.process_requests(reqs)
+        mock_resolver.return_value.bucket_osds.assert_called_with(
+            'default', device_class='ssd')
+        mock_erasure_pool.assert_called_with(
+            service='admin', name='foo', erasure_code_profile='fast',
+            percent_data=None, osd_count=6, profile=profile)
+        self.assertEqual(json.loads(rc), {'exit-code': 0})
+
+    @patch.object(broker, 'get_pool_tiers',
+                  lambda service, pool_name: {'tiers': [], 'tier_of': None})
+    @patch.object(broker, 'pool_exists', lambda service, name: True)
+    @patch.object(broker, 'check_output', fake_check_output({}))
     @patch.object(broker, 'delete_pool')
     @patch.object(broker, 'log', lambda *args, **kwargs: None)
     def test_process_requests_delete_pool(self,
@@ -105,11 +193,12 @@ class TestCephOps(unittest.TestCase):
 
     @patch.object(broker, 'pool_exists')
     @patch.object(broker.ErasurePool, 'create')
-    @patch.object(broker, 'erasure_profile_exists')
+    @patch.object(broker, 'get_erasure_profile_registry')
     @patch.object(broker, 'log', lambda *args, **kwargs: None)
-    def test_process_requests_create_erasure_pool(self, mock_profile_exists,
+    def test_process_requests_create_erasure_pool(self, mock_registry,
                                                   mock_erasure_pool,
                                                   mock_pool_exists):
+        mock_profile_exists = mock_registry.return_value.exists
         mock_pool_exists.return_value = False
         reqs = json.dumps({'api-version': 1,
                            'ops': [{
@@ -119,7 +208,8 @@ class TestCephOps(unittest.TestCase):
                                'erasure-profile': 'default'
                            }]})
         rc = broker.process_requests(reqs)
-        mock_profile_exists.assert_called_with(service='admin', name='default')
+        mock_registry.assert_called_with(service='admin')
+        mock_profile_exists.assert_called_with('default')
         mock_pool_exists.assert_called_with(service='admin', name='foo')
         mock_erasure_pool.assert_called_with()
         self.assertEqual(json.loads(rc), {'exit-code': 0})
@@ -178,6 +268,9 @@ class TestCephOps(unittest.TestCase):
                                               snapshot_name='foo-snap1')
         self.assertEqual(json.loads(rc), {'exit-code': 0})
 
+    @patch.object(broker, 'pool_exists',
+                  lambda service, name: name == 'foo')
+    @patch.object(broker, 'check_output', fake_check_output({}))
     @patch.object(broker, 'rename_pool')
     @patch.object(broker, 'log', lambda *args, **kwargs: None)
     def test_rename_pool(self, mock_rename_pool):
@@ -239,3 +332,299 @@ class TestCephOps(unittest.TestCase):
                            }]})
         rc = broker.process_requests(reqs)
         self.assertEqual(json.loads(rc)['exit-code'], 1)
+
+    @patch.object(broker, 'check_call')
+    @patch.object(broker, 'monitor_key_set')
+    @patch.object(broker, 'check_output')
+    @patch.object(broker, 'log', lambda *args, **kwargs: None)
+    def test_add_permissions_to_key(self, mock_check_output,
+                                    mock_monitor_key_set, mock_check_call):
+        mock_check_output.side_effect = fake_check_output({
+            'cephx.groups.images': json.dumps({'pools': ['glance'],
+                                               'services': []}),
+        })
+        reqs = json.dumps({'api-version': 1,
+                           'ops': [{
+                               'op': 'add-permissions-to-key',
+                               'name': 'nova',
+                               'group': 'images',
+                               'group-permission': 'rwx',
+                           }]})
+        rc = broker.process_requests(reqs)
+        mock_check_output.assert_any_call(
+            ['ceph', '--id', 'admin', 'config-key', 'dump', 'cephx.'])
+        mock_monitor_key_set.assert_has_calls([
+            call(service='admin', key='cephx.groups.images',
+                 value=json.dumps({'pools': ['glance'],
+                                   'services': ['nova']}, sort_keys=True)),
+            call(service='admin', key='cephx.services.nova',
+                 value=json.dumps({'group_names': {'rwx': ['images']},
+                                   'groups': {}}, sort_keys=True)),
+        ])
+        mock_check_call.assert_called_once_with(
+            ['ceph', 'auth', 'caps', 'client.nova',
+             'mon', 'allow r', 'osd', 'allow rwx pool=glance'])
+        self.assertEqual(json.loads(rc), {'exit-code': 0})
+
+    @patch.object(broker, 'check_call')
+    @patch.object(broker, 'monitor_key_set')
+    @patch.object(broker, 'check_output')
+    @patch.object(broker, 'log', lambda *args, **kwargs: None)
+    def test_add_pool_to_group_unchanged(self, mock_check_output,
+                                         mock_monitor_key_set,
+                                         mock_check_call):
+        mock_check_output.side_effect = fake_check_output({
+            'cephx.groups.images': json.dumps({'pools': ['glance'],
+                                               'services': ['nova']},
+                                              sort_keys=True),
+            'cephx.services.nova': json.dumps(
+                {'group_names': {'rwx': ['images']}, 'groups': {}}),
+        })
+        broker.add_pool_to_group(pool='glance', group='images')
+        self.assertFalse(mock_monitor_key_set.called)
+        mock_check_call.assert_called_once_with(
+            ['ceph', 'auth', 'caps', 'client.nova',
+             'mon', 'allow r', 'osd', 'allow rwx pool=glance'])
+
+    @patch.object(broker, 'pool_exists')
+    @patch.object(broker, 'ReplicatedPool')
+    @patch.object(broker, 'check_call')
+    @patch.object(broker, 'monitor_key_set')
+    @patch.object(broker, 'check_output')
+    @patch.object(broker, 'log', lambda *args, **kwargs: None)
+    def test_process_requests_caps_updated_once(self, mock_check_output,
+                                                mock_monitor_key_set,
+                                                mock_check_call,
+                                                mock_replicated_pool,
+                                                mock_pool_exists):
+        mock_pool_exists.return_value = False
+        mock_check_output.side_effect = fake_check_output({
+            'cephx.groups.volumes': json.dumps({'pools': [],
+                                                'services': ['cinder']}),
+            'cephx.services.cinder': json.dumps(
+                {'group_names': {'rwx': ['volumes']}, 'groups': {}}),
+        })
+        reqs = json.dumps({'api-version': 1,
+                           'ops': [{
+                               'op': 'create-pool',
+                               'name': name,
+                               'replicas': 3,
+                               'group': 'volumes',
+                           } for name in ('foo', 'bar')]})
+        rc = broker.process_requests(reqs)
+        self.assertEqual(json.loads(rc), {'exit-code': 0})
+        mock_monitor_key_set.assert_called_once_with(
+            service='admin', key='cephx.groups.volumes',
+            value=json.dumps({'pools': ['foo', 'bar'],
+                              'services': ['cinder']}, sort_keys=True))
+        mock_check_call.assert_called_once_with(
+            ['ceph', 'auth', 'caps', 'client.cinder',
+             'mon', 'allow r', 'osd',
+             'allow rwx pool=foo, allow rwx pool=bar'])
+
+    @patch.object(broker, 'check_call')
+    @patch.object(broker, 'check_output')
+    @patch.object(broker, 'log', lambda *args, **kwargs: None)
+    def test_update_service_permissions_up_to_date(self, mock_check_output,
+                                                   mock_check_call):
+        mock_check_output.side_effect = fake_check_output(
+            {}, caps={'mon': 'allow r', 'osd': 'allow rwx pool=glance'})
+        broker.update_service_permissions(
+            'nova', {'group_names': {'rwx': ['images']},
+                     'groups': {'images': {'pools': ['glance']}}})
+        mock_check_output.assert_called_once_with(
+            ['ceph', 'auth', 'get', 'client.nova', '--format=json'])
+        self.assertFalse(mock_check_call.called)
+
+    @patch.object(broker, 'rename_pool')
+    @patch.object(broker, 'pool_exists')
+    @patch.object(broker, 'check_call')
+    @patch.object(broker, 'monitor_key_set')
+    @patch.object(broker, 'check_output')
+    @patch.object(broker, 'log', lambda *args, **kwargs: None)
+    def test_rename_pool_updates_groups(self, mock_check_output,
+                                        mock_monitor_key_set,
+                                        mock_check_call, mock_pool_exists,
+                                        mock_rename_pool):
+        mock_pool_exists.side_effect = lambda service, name: name == 'glance'
+        mock_check_output.side_effect = fake_check_output({
+            'cephx.groups.images': json.dumps({'pools': ['glance', 'other'],
+                                               'services': ['nova']}),
+            'cephx.groups.ns-images': json.dumps({'pools': ['glance'],
+                                                  'services': ['cinder']}),
+            'cephx.groups.volumes': json.dumps({'pools': ['cinder'],
+                                                'services': ['cinder']}),
+            'cephx.services.nova': json.dumps(
+                {'group_names': {'rwx': ['images']}, 'groups': {}}),
+            'cephx.services.cinder': json.dumps(
+                {'group_names': {'rwx': ['images']}, 'groups': {}}),
+        })
+        reqs = json.dumps({'api-version': 1,
+                           'ops': [{'op': 'rename-pool', 'name': 'glance',
+                                    'new-name': 'images'}]})
+        rc = broker.process_requests(reqs)
+        self.assertEqual(json.loads(rc), {'exit-code': 0})
+        mock_rename_pool.assert_called_once_with(
+            service='admin', old_name='glance', new_name='images')
+        mock_monitor_key_set.assert_has_calls([
+            call(service='admin', key='cephx.groups.images',
+                 value=json.dumps({'pools': ['images', 'other'],
+                                   'services': ['nova']}, sort_keys=True)),
+            call(service='admin', key='cephx.groups.ns-images',
+                 value=json.dumps({'pools': ['images'],
+                                   'services': ['cinder']}, sort_keys=True)),
+        ])
+        self.assertEqual(mock_monitor_key_set.call_count, 2)
+        mock_check_call.assert_has_calls([
+            call(['ceph', 'auth', 'caps', 'client.nova',
+                  'mon', 'allow r', 'osd',
+                  'allow rwx pool=images, allow rwx pool=other']),
+            call(['ceph', 'auth', 'caps', 'client.cinder',
+                  'mon', 'allow r', 'osd', 'allow rwx pool=images']),
+        ])
+
+    @patch.object(broker, 'rename_pool')
+    @patch.object(broker, 'pool_exists')
+    @patch.object(broker, 'check_call')
+    @patch.object(broker, 'monitor_key_set')
+    @patch.object(broker, 'check_output')
+    @patch.object(broker, 'log', lambda *args, **kwargs: None)
+    def test_rename_pool_rollback(self, mock_check_output,
+                                  mock_monitor_key_set, mock_check_call,
+                                  mock_pool_exists, mock_rename_pool):
+        mock_pool_exists.side_effect = lambda service, name: name == 'glance'
+        images = json.dumps({'pools': ['glance', 'other'],
+                             'services': ['nova']}, sort_keys=True)
+        ns_images = json.dumps({'pools': ['glance'], 'services': ['cinder']},
+                               sort_keys=True)
+        mock_check_output.side_effect = fake_check_output({
+            'cephx.groups.images': images,
+            'cephx.groups.ns-images': ns_images,
+            'cephx.services.nova': json.dumps(
+                {'group_names': {'rwx': ['images']}, 'groups': {}}),
+            'cephx.services.cinder': json.dumps(
+                {'group_names': {'rwx': ['images']}, 'groups': {}}),
+        })
+        # The second record fails to be written the first time round
+        mock_monitor_key_set.side_effect = [
+            None, CalledProcessError(1, 'config-key'), None, None]
+        self.assertRaises(CalledProcessError, broker.handle_rename_pool,
+                          {'name': 'glance', 'new-name': 'images'}, 'admin')
+        self.assertEqual(mock_rename_pool.call_args_list, [
+            call(service='admin', old_name='glance', new_name='images'),
+            call(service='admin', old_name='images', new_name='glance')])
+        # Both records are written back, including the one already updated
+        self.assertEqual(mock_monitor_key_set.call_args_list[2:], [
+            call(service='admin', key='cephx.groups.images', value=images),
+            call(service='admin', key='cephx.groups.ns-images',
+                 value=ns_images)])
+        mock_check_call.assert_has_calls([
+            call(['ceph', 'auth', 'caps', 'client.nova',
+                  'mon', 'allow r', 'osd',
+                  'allow rwx pool=glance, allow rwx pool=other']),
+            call(['ceph', 'auth', 'caps', 'client.cinder',
+                  'mon', 'allow r', 'osd', 'allow rwx pool=glance']),
+        ])
+
+    @patch.object(broker, 'delete_pool')
+    @patch.object(broker, 'Pool')
+    @patch.object(broker, 'pool_exists', lambda service, name: True)
+    @patch.object(broker, 'check_call')
+    @patch.object(broker, 'monitor_key_set')
+    @patch.object(broker, 'check_output')
+    @patch.object(broker, 'log', lambda *args, **kwargs: None)
+    def test_delete_cache_pool(self, mock_check_output, mock_monitor_key_set,
+                               mock_check_call, mock_pool, mock_delete_pool):
+        records = fake_check_output({
+            'cephx.groups.images': json.dumps({'pools': ['glance', 'hot'],
+                                               'services': []}),
+        })
+
+        def _check_output(cmd):
+            if 'dump' in cmd and 'osd' in cmd:
+                return json.dumps({'pools': [
+                    {'pool': 1, 'pool_name': 'glance', 'tiers': [2],
+                     'tier_of': -1},
+                    {'pool': 2, 'pool_name': 'hot', 'tiers': [],
+                     'tier_of': 1}]}).encode('UTF-8')
+            return records(cmd)
+        mock_check_output.side_effect = _check_output
+        broker.handle_delete_pool({'name': 'hot'}, service='admin')
+        mock_pool.assert_called_once_with(name='glance', service='admin')
+        mock_pool.return_value.remove_cache_tier.assert_called_once_with(
+            cache_pool='hot')
+        mock_delete_pool.assert_called_once_with(service='admin', name='hot')
+        mock_monitor_key_set.assert_called_once_with(
+            service='admin', key='cephx.groups.images',
+            value=json.dumps({'pools': ['glance'], 'services': []},
+                             sort_keys=True))
+
+    @patch.object(broker, 'monitor_key_get')
+    @patch.object(broker, 'check_output')
+    def test_permission_store_without_dump(self, mock_check_output,
+                                           mock_monitor_key_get):
+        records = {
+            'cephx.groups.images': json.dumps({'pools': ['glance'],
+                                               'services': ['nova']}),
+        }
+
+        def _check_output(cmd):
+            if 'list' in cmd:
+                return json.dumps(sorted(records)).encode('UTF-8')
+            raise CalledProcessError(22, cmd)
+        mock_check_output.side_effect = _check_output
+        mock_monitor_key_get.side_effect = (
+            lambda service, key: records.get(key))
+        store = broker.PermissionStore()
+        self.assertEqual(store.get_group('images'),
+                         {'pools': ['glance'], 'services': ['nova']})
+        self.assertEqual(store.get_group('volumes'),
+                         {'pools': [], 'services': []})
+        self.assertEqual(store.group_names(), ['images'])
+        store.get_group('images')
+        self.assertEqual(mock_monitor_key_get.call_count, 2)
+
+    @patch.object(broker, 'delete_pool')
+    @patch.object(broker, 'pool_exists', lambda service, name: False)
+    @patch.object(broker, 'check_output', fake_check_output({}))
+    @patch.object(broker, 'log', lambda *args, **kwargs: None)
+    def test_delete_pool_already_gone(self, mock_delete_pool):
+        reqs = json.dumps({'api-version': 1,
+                           'ops': [{'op': 'delete-pool', 'name': 'foo'}]})
+        rc = broker.process_requests(reqs)
+        self.assertEqual(json.loads(rc), {'exit-code': 0})
+        self.assertFalse(mock_delete_pool.called)
+
+    @patch.object(broker, 'rename_pool')
+    @patch.object(broker, 'check_output', fake_check_output({}))
+    @patch.object(broker, 'pool_exists')
+    @patch.object(broker, 'log', lambda *args, **kwargs: None)
+    def test_rename_pool_already_renamed(self, mock_pool_exists,
+                                         mock_rename_pool):
+        reqs = json.dumps({'api-version': 1,
+                           'ops': [{'op': 'rename-pool', 'name': 'foo',
+                                    'new-name': 'foo2'}]})
+        mock_pool_exists.side_effect = lambda service, name: name == 'foo2'
+        rc = broker.process_requests(reqs)
+        self.assertEqual(json.loads(rc), {'exit-code': 0})
+        self.assertFalse(mock_rename_pool.called)
+
+        mock_pool_exists.side_effect = lambda service, name: False
+        rc = json.loads(broker.process_requests(reqs))
+        self.assertEqual(rc['exit-code'], 1)
+
+    @patch.object(broker, 'check_output')
+    def test_erasure_profile_registry(self, mock_check_output):
+        mock_check_output.return_value = json.dumps({
+            'erasure_code_profiles': {
+                'default': {'k': '2', 'm': '1', 'plugin': 'jerasure'},
+                'broken': {'plugin': 'jerasure'},
+            }}).encode('UTF-8')
+        registry = broker.ErasureProfileRegistry()
+        self.assertTrue(registry.exists('default'))
+        self.assertFalse(registry.exists('fast'))
+        self.assertEqual(registry.get('default'),
+                         {'k': '2', 'm': '1', 'plugin': 'jerasure'})
+        self.assertIsNone(registry.get('fast'))
+        mock_check_output.assert_called_once_with(
+            ['ceph', '--id', 'admin', 'osd', 'dump', '--format=json'])
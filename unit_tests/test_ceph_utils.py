@@ -0,0 +1,192 @@
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from subprocess import CalledProcessError
+
+from mock import call, patch
+
+from charmhelpers.core import hookenv
+
+from ceph import utils
+
+
+@patch.object(utils, 'log', lambda *args, **kwargs: None)
+@patch.object(utils, 'cmp_pkgrevno', lambda *args: 0)
+class SubtreeFlagsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.records = {}
+        patcher = patch.object(utils, 'monitor_key_get',
+                               lambda service, key: self.records.get(key))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(utils, 'monitor_key_set', self.records_set)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def records_set(self, service, key, value):
+        self.records[key] = value
+
+    def flags(self):
+        return json.loads(self.records[utils.SUBTREE_FLAGS_KEY])
+
+    @patch.object(utils.subprocess, 'check_call')
+    def test_set_subtree_flags(self, check_call):
+        targets = utils.set_subtree_flags('rack1', ['noout'], 1000)
+        self.assertEqual(targets, {'noout': ['rack1']})
+        check_call.assert_called_once_with(
+            ['ceph', '--id', 'admin', 'osd', 'add-noout', 'rack1'])
+        self.assertEqual(self.flags(),
+                         {'rack1': {'expires': 1000,
+                                    'flags': {'noout': ['rack1']}}})
+
+    @patch.object(utils, 'get_crush_dump', lambda service: {})
+    @patch.object(utils, 'get_bucket_osds')
+    @patch.object(utils.subprocess, 'check_call')
+    def test_set_subtree_flags_per_osd(self, check_call, get_bucket_osds):
+        get_bucket_osds.return_value = set([3, 1])
+        # Luminous
+        with patch.object(utils, 'cmp_pkgrevno',
+                          lambda package, revno: -1 if revno == '14.0.0'
+                          else 0):
+            targets = utils.set_subtree_flags('rack1', ['noout', 'noin'],
+                                              1000)
+            get_bucket_osds.return_value = set()
+            self.assertRaises(ValueError, utils.set_subtree_flags,
+                              'rack9', ['noout'], 1000)
+        self.assertEqual(targets, {'noout': ['osd.1', 'osd.3'],
+                                   'noin': ['osd.1', 'osd.3']})
+        self.assertEqual(check_call.call_args_list, [
+            call(['ceph', '--id', 'admin', 'osd', 'add-noout', 'osd.1',
+                  'osd.3']),
+            call(['ceph', '--id', 'admin', 'osd', 'add-noin', 'osd.1',
+                  'osd.3'])])
+
+    @patch.object(utils.subprocess, 'check_call')
+    def test_set_subtree_flags_failure(self, check_call):
+        # Failures such as a bad bucket name are not hidden by retrying
+        # the flags per OSD
+        check_call.side_effect = [None, CalledProcessError(22, 'add-noin')]
+        self.assertRaises(CalledProcessError, utils.set_subtree_flags,
+                          'rack1', ['noout', 'noin'], 1000)
+        check_call.assert_called_with(
+            ['ceph', '--id', 'admin', 'osd', 'add-noin', 'rack1'])
+        # The flag which was set is still recorded for expiry
+        self.assertEqual(self.flags(),
+                         {'rack1': {'expires': 1000,
+                                    'flags': {'noout': ['rack1']}}})
+
+    def test_set_subtree_flags_invalid(self):
+        self.assertRaises(ValueError, utils.set_subtree_flags,
+                          'rack1', ['norebalance'], 1000)
+
+    @patch.object(utils.subprocess, 'check_call')
+    def test_expire_subtree_flags(self, check_call):
+        self.records[utils.SUBTREE_FLAGS_KEY] = json.dumps({
+            'rack1': {'expires': 1000, 'flags': {'noout': ['osd.1']}},
+            'rack2': {'expires': 3000, 'flags': {'noout': ['rack2']}}})
+        self.assertEqual(utils.expire_subtree_flags(now=2000), ['rack1'])
+        self.assertEqual(check_call.call_args_list, [
+            call(['ceph', '--id', 'admin', 'osd', 'rm-noout', 'osd.1'])])
+        self.assertEqual(list(self.flags()), ['rack2'])
+
+
+@patch.object(utils, 'log', lambda *args, **kwargs: None)
+@patch.object(utils, 'ceph_user', lambda: 'ceph')
+class OwnershipTestCase(unittest.TestCase):
+
+    @patch.object(utils.time, 'time')
+    @patch.object(utils, 'status_set')
+    @patch.object(utils, 'chownr')
+    def test_fix_ownership(self, chownr, status_set, mock_time):
+        mock_time.side_effect = [100, 105, 120, 130]
+
+        def fake_chownr(path, owner, group, follow_links, chowntopdir,
+                        progress):
+            progress(10, 5)
+            progress(4000, 3000)
+            return 4000, 3000
+
+        chownr.side_effect = fake_chownr
+        utils.fix_ownership('/var/lib/ceph')
+        self.assertEqual(status_set.call_args_list, [
+            call('maintenance', 'Updating ownership of /var/lib/ceph to ceph'),
+            call('maintenance', 'Updating ownership of /var/lib/ceph: 4000 '
+                                'checked, 3000 changed (200 entries/s)'),
+        ])
+
+    @patch.object(utils, 'fix_ownership')
+    @patch.object(utils.subprocess, 'check_call')
+    @patch.object(utils.os.path, 'isdir')
+    def test_update_owner(self, isdir, check_call, fix_ownership):
+        isdir.return_value = True
+        utils.update_owner('/var/lib/ceph/osd')
+        fix_ownership.assert_called_once_with('/var/lib/ceph/osd',
+                                              follow_links=False,
+                                              chowntopdir=True)
+        self.assertFalse(check_call.called)
+
+        isdir.return_value = False
+        utils.update_owner('/var/lib/ceph/osd/ceph-0/ready')
+        check_call.assert_called_once_with(
+            ['chown', 'ceph:ceph', '/var/lib/ceph/osd/ceph-0/ready'])
+
+    @patch.object(utils, '_gid_name')
+    @patch.object(utils, '_uid_name')
+    @patch.object(utils, '_child_dir_owners')
+    def test_dirs_need_ownership_update(self, child_dir_owners,
+                                        uid_name, gid_name):
+        names = {0: 'root', 64045: 'ceph'}
+        uid_name.side_effect = names.get
+        gid_name.side_effect = names.get
+        child_dir_owners.return_value = [('ceph-0', 64045, 64045),
+                                         ('ceph-1', 0, 0)]
+        self.assertTrue(utils.dirs_need_ownership_update('osd'))
+        child_dir_owners.assert_called_once_with('/var/lib/ceph/osd')
+
+        child_dir_owners.return_value = [('ceph-0', 64045, 64045),
+                                         ('ceph-1', 64045, 64045)]
+        self.assertFalse(utils.dirs_need_ownership_update('osd'))
+
+        # Only the group is wrong
+        child_dir_owners.return_value = [('ceph-0', 64045, 64045),
+                                         ('ceph-1', 64045, 0)]
+        self.assertTrue(utils.dirs_need_ownership_update('osd'))
+
+    @patch.object(utils.pwd, 'getpwuid')
+    def test_uid_name_cached(self, getpwuid):
+        hookenv.cache.clear()
+        self.addCleanup(hookenv.cache.clear)
+        getpwuid.return_value.pw_name = 'ceph'
+        utils._uid_name(64045)
+        self.assertEqual(utils._uid_name(64045), 'ceph')
+        getpwuid.assert_called_once_with(64045)
+
+    def test_child_dir_owners(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        os.mkdir(os.path.join(tmpdir, 'ceph-1'))
+        os.mkdir(os.path.join(tmpdir, 'ceph-0'))
+        open(os.path.join(tmpdir, 'file'), 'w').close()
+        st = os.stat(os.path.join(tmpdir, 'ceph-0'))
+        owners = utils._child_dir_owners(tmpdir)
+        self.assertEqual([owner[0] for owner in owners],
+                         ['ceph-0', 'ceph-1'])
+        self.assertEqual(owners[0], ('ceph-0', st.st_uid, st.st_gid))
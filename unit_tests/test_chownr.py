@@ -0,0 +1,86 @@
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock, patch
+
+from charmhelpers.core import host
+
+
+class ChownrTestCase(unittest.TestCase):
+    """Runs chownr over a real tree with the chown calls recorded, so the
+    tests do not need to run as root."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        os.makedirs(self.path('a', 'b'))
+        os.mkdir(self.path('c'))
+        for name in (('a', 'f1'), ('a', 'b', 'f2'), ('c', 'f3')):
+            open(self.path(*name), 'w').close()
+        os.symlink(self.tmpdir, self.path('c', 'loop'))
+        os.symlink(self.path('missing'), self.path('broken'))
+        self.uid = os.getuid()
+        self.gid = os.getgid()
+        self.chown = MagicMock()
+        self.lchown = MagicMock()
+        for name, mock in (('chown', self.chown), ('lchown', self.lchown)):
+            patcher = patch.object(host.os, name, mock)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def path(self, *names):
+        return os.path.join(self.tmpdir, *names)
+
+    def chownr(self, uid, gid, **kwargs):
+        with patch.object(host.pwd, 'getpwnam') as getpwnam, \
+                patch.object(host.grp, 'getgrnam') as getgrnam:
+            getpwnam.return_value.pw_uid = uid
+            getgrnam.return_value.gr_gid = gid
+            return host.chownr(self.tmpdir, 'ceph', 'ceph', **kwargs)
+
+    def changed(self, mock):
+        return sorted(os.path.relpath(args[0], self.tmpdir)
+                      for args, _ in mock.call_args_list)
+
+    def test_skips_entries_already_owned(self):
+        self.assertEqual(self.chownr(self.uid, self.gid), (7, 0))
+        self.assertFalse(self.chown.called)
+
+    def test_follow_links(self):
+        progress = MagicMock()
+        checked, changed = self.chownr(self.uid + 1, self.gid,
+                                       max_workers=2, progress=progress)
+        # The loop link is followed to the top directory, which is not
+        # scanned again, and the broken link is skipped.
+        self.assertEqual((checked, changed), (7, 7))
+        self.assertEqual(self.changed(self.chown),
+                         ['a', 'a/b', 'a/b/f2', 'a/f1', 'c', 'c/f3',
+                          'c/loop'])
+        self.assertFalse(self.lchown.called)
+        self.assertEqual(progress.call_args[0], (7, 7))
+        self.assertEqual(progress.call_count, 4)
+
+    def test_no_follow_links(self):
+        checked, changed = self.chownr(self.uid, self.gid + 1,
+                                       follow_links=False, chowntopdir=True)
+        self.assertEqual((checked, changed), (8, 8))
+        self.assertEqual(self.changed(self.lchown),
+                         ['.', 'a', 'a/b', 'a/b/f2', 'a/f1', 'c', 'c/f3',
+                          'c/loop'])
+        self.assertFalse(self.chown.called)
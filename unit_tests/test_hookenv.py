@@ -0,0 +1,154 @@
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from mock import call, patch
+
+from charmhelpers.core import hookenv
+
+
+class HookCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = hookenv.HookCache()
+        self.calls = []
+        patcher = patch.object(hookenv, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        @hookenv.cached
+        def relation_data(rid, unit):
+            self.calls.append((rid, unit))
+            return {'unit': unit}
+
+        self.relation_data = relation_data
+
+    def test_cached(self):
+        self.assertEqual(self.relation_data('mon:1', 'ceph-mon/0'),
+                         {'unit': 'ceph-mon/0'})
+        self.relation_data('mon:1', 'ceph-mon/0')
+        self.relation_data('mon:1', 'ceph-mon/1')
+        self.assertEqual(self.calls, [('mon:1', 'ceph-mon/0'),
+                                      ('mon:1', 'ceph-mon/1')])
+        self.assertEqual(len(self.cache), 2)
+
+    def test_unhashable_arguments(self):
+        @hookenv.cached
+        def echo(value):
+            self.calls.append(value)
+            return value
+
+        echo(['a'])
+        echo(['a'])
+        self.assertEqual(self.calls, [['a']])
+
+    def test_flush_by_argument(self):
+        self.relation_data('mon:1', 'ceph-mon/0')
+        self.relation_data('mon:1', 'ceph-mon/1')
+        self.relation_data('osd:2', 'ceph-osd/0')
+        hookenv.flush('ceph-mon/1')
+        self.assertEqual(len(self.cache), 2)
+        hookenv.flush('mon:1')
+        self.assertEqual(len(self.cache), 1)
+        self.relation_data('osd:2', 'ceph-osd/0')
+        self.assertEqual(len(self.calls), 3)
+        self.relation_data('mon:1', 'ceph-mon/0')
+        self.assertEqual(len(self.calls), 4)
+
+    def test_flush_by_function_name(self):
+        self.relation_data('mon:1', 'ceph-mon/0')
+        self.relation_data('osd:2', 'ceph-osd/0')
+        hookenv.flush('relation_data')
+        self.assertEqual(len(self.cache), 0)
+        # Unknown tags are ignored
+        hookenv.flush('relation_data')
+
+    @patch.object(hookenv, 'log')
+    def test_stats(self, log):
+        self.relation_data('mon:1', 'ceph-mon/0')
+        self.relation_data('mon:1', 'ceph-mon/0')
+        self.relation_data('mon:1', 'ceph-mon/0')
+        self.relation_data('mon:1', 'ceph-mon/1')
+        self.assertEqual(self.cache.stats(), {'relation_data': (2, 2)})
+        hookenv.log_cache_stats()
+        log.assert_called_once_with(
+            'Function cache hits/misses: relation_data 2/2',
+            level=hookenv.DEBUG)
+
+    @patch.object(hookenv, 'log')
+    def test_clear(self, log):
+        self.relation_data('mon:1', 'ceph-mon/0')
+        self.relation_data('mon:1', 'ceph-mon/0')
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats(), {})
+        self.assertEqual(dict(self.cache.index), {})
+        hookenv.log_cache_stats()
+        log.assert_not_called()
+
+
+@patch.object(hookenv, '_juju_log')
+class LogBufferTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        hookenv._log_buffer = None
+
+    def test_flush_batches_runs_of_levels(self, _juju_log):
+        buf = hookenv.LogBuffer()
+        buf.add('one', hookenv.INFO)
+        buf.add('two', hookenv.INFO)
+        buf.add('three', hookenv.WARNING)
+        buf.add('four', hookenv.INFO)
+        _juju_log.assert_not_called()
+        buf.flush()
+        _juju_log.assert_has_calls([
+            call('one\ntwo', hookenv.INFO),
+            call('three', hookenv.WARNING),
+            call('four', hookenv.INFO),
+        ])
+        self.assertEqual(_juju_log.call_count, 3)
+        self.assertEqual(buf.pending, [])
+
+    def test_flush_when_full(self, _juju_log):
+        buf = hookenv.LogBuffer(max_messages=2)
+        buf.add('one')
+        _juju_log.assert_not_called()
+        buf.add('two')
+        _juju_log.assert_called_once_with('one\ntwo', None)
+        self.assertEqual(buf.pending, [])
+
+    def test_min_level(self, _juju_log):
+        buf = hookenv.LogBuffer(min_level=hookenv.INFO)
+        buf.add('dropped', hookenv.DEBUG)
+        buf.add('kept', hookenv.ERROR)
+        self.assertEqual(buf.pending, [(hookenv.ERROR, 'kept')])
+
+    @patch.object(hookenv.sys_atexit, 'register')
+    def test_buffer_log(self, register, _juju_log):
+        buf = hookenv.buffer_log(max_messages=10)
+        self.assertIs(hookenv.buffer_log(), buf)
+        register.assert_called_once_with(hookenv.flush_log)
+        hookenv.log('debug', hookenv.DEBUG)
+        hookenv.log({'not': 'a string'})
+        _juju_log.assert_not_called()
+        hookenv.flush_log()
+        _juju_log.assert_has_calls([
+            call('debug', hookenv.DEBUG),
+            call("{'not': 'a string'}", None),
+        ])
+
+    def test_log_unbuffered(self, _juju_log):
+        hookenv.log('message', hookenv.WARNING)
+        _juju_log.assert_called_once_with('message', hookenv.WARNING)
@@ -0,0 +1,216 @@
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from mock import patch
+
+from charmhelpers.contrib.storage.linux import ceph as ceph_storage
+
+from ceph import crush_utils
+from ceph import pg_utils
+
+# Two hosts with two HDDs each under 'default' and one host with two SSDs
+# under 'ssd'.
+CRUSH_DUMP = {
+    'buckets': [
+        {'id': -1, 'name': 'default', 'items': [{'id': -2}, {'id': -3}]},
+        {'id': -2, 'name': 'host-a', 'items': [{'id': 0}, {'id': 1}]},
+        {'id': -3, 'name': 'host-b', 'items': [{'id': 2}, {'id': 3}]},
+        {'id': -4, 'name': 'ssd', 'items': [{'id': -5}]},
+        {'id': -5, 'name': 'host-c', 'items': [{'id': 4}, {'id': 5}]},
+    ],
+    'rules': [
+        {'rule_id': 0, 'rule_name': 'replicated_rule', 'ruleset': 0,
+         'type': 1,
+         'steps': [{'op': 'take', 'item': -1},
+                   {'op': 'chooseleaf_firstn', 'num': 0, 'type': 'host'},
+                   {'op': 'emit'}]},
+        {'rule_id': 1, 'rule_name': 'ssd', 'ruleset': 1, 'type': 1,
+         'steps': [{'op': 'take', 'item': -4},
+                   {'op': 'chooseleaf_firstn', 'num': 0, 'type': 'osd'},
+                   {'op': 'emit'}]},
+    ],
+}
+
+
+class CrushRuleTestCase(unittest.TestCase):
+
+    def test_get_rule_osds(self):
+        self.assertEqual(crush_utils.get_rule_osds(CRUSH_DUMP, 0),
+                         set([0, 1, 2, 3]))
+        self.assertEqual(crush_utils.get_rule_osds(CRUSH_DUMP, 'ssd'),
+                         set([4, 5]))
+        self.assertEqual(crush_utils.get_rule_osds(CRUSH_DUMP, 7), set())
+
+    def test_get_bucket_osds(self):
+        self.assertEqual(crush_utils.get_bucket_osds(CRUSH_DUMP, 'default'),
+                         set([0, 1, 2, 3]))
+        self.assertEqual(crush_utils.get_bucket_osds(CRUSH_DUMP, 'host-c'),
+                         set([4, 5]))
+        self.assertEqual(
+            crush_utils.get_bucket_osds(CRUSH_DUMP, 'default', 'nvme'),
+            set())
+
+    @patch.object(crush_utils, 'get_default_crush_rule')
+    @patch.object(crush_utils, 'get_crush_dump')
+    def test_crush_rule_resolver(self, get_crush_dump,
+                                 get_default_crush_rule):
+        get_crush_dump.return_value = CRUSH_DUMP
+        get_default_crush_rule.return_value = -1
+        self.assertEqual(
+            crush_utils.CrushRuleResolver().default_replicated_rule(), 0)
+        # Not a rule in the map
+        get_default_crush_rule.return_value = 7
+        self.assertEqual(
+            crush_utils.CrushRuleResolver().default_replicated_rule(), 0)
+        get_crush_dump.reset_mock()
+        get_default_crush_rule.reset_mock()
+        get_default_crush_rule.return_value = 1
+        resolver = crush_utils.CrushRuleResolver()
+        self.assertEqual(resolver.default_replicated_rule(), 1)
+        self.assertEqual(resolver.default_replicated_rule(), 1)
+        get_default_crush_rule.assert_called_once_with()
+        self.assertEqual(resolver.rule_osds(1), set([4, 5]))
+        self.assertEqual(resolver.rule_osds(1), set([4, 5]))
+        self.assertEqual(resolver.bucket_osds('ssd'), set([4, 5]))
+        get_crush_dump.assert_called_once_with(service='admin')
+
+    @patch.object(crush_utils, 'check_output')
+    def test_get_rule_mappings(self, check_output):
+        check_output.return_value = (b"CRUSH rule 0 x 0 [1,2,0]\n"
+                                     b"CRUSH rule 0 x 1 [2,2147483647,1]\n")
+        self.assertEqual(
+            crush_utils.get_rule_mappings('/tmp/map', 0, 3, 2),
+            [[1, 2, 0], [2, crush_utils.CRUSH_ITEM_NONE, 1]])
+        check_output.assert_called_once_with(
+            ['crushtool', '-i', '/tmp/map', '--test', '--show-mappings',
+             '--rule', '0', '--num-rep', '3', '--min-x', '0', '--max-x', '1'])
+
+
+class GetPgsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = {'pgs-per-osd': 100}
+        for name, kwargs in (('config', {'side_effect': self.settings.get}),
+                             ('get_osds', {'return_value': list(range(10))})):
+            patcher = patch.object(ceph_storage, name, **kwargs)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.pool = ceph_storage.Pool(service='admin', name='foo')
+
+    def test_rule_osd_count(self):
+        # 2 of the 10 OSDs at 100% of the data with 2 replicas
+        self.assertEqual(self.pool.get_pgs(2, 100.0, osd_count=2), 128)
+        self.assertFalse(self.get_osds.called)
+
+    def test_expected_osd_count_scaled_to_rule(self):
+        # The rule selects a fifth of the OSDs, so a fifth of the 100
+        # expected ones is used: 100 * 20 // 2 = 1000
+        self.settings['expected-osd-count'] = 100
+        self.assertEqual(self.pool.get_pgs(2, 100.0, osd_count=2), 1024)
+        # The whole cluster
+        self.assertEqual(self.pool.get_pgs(2, 100.0, osd_count=10), 4096)
+        # More OSDs than expected already
+        self.settings['expected-osd-count'] = 5
+        self.assertEqual(self.pool.get_pgs(2, 100.0, osd_count=2), 128)
+
+    def test_cluster_osd_count(self):
+        self.settings['expected-osd-count'] = 20
+        self.assertEqual(self.pool.get_pgs(2, 100.0), 1024)
+
+
+class PgPlanTestCase(unittest.TestCase):
+
+    def test_nearest_power_of_two(self):
+        self.assertEqual(pg_utils.nearest_power_of_two(0), 2)
+        self.assertEqual(pg_utils.nearest_power_of_two(70), 64)
+        self.assertEqual(pg_utils.nearest_power_of_two(90), 128)
+
+    def test_set_pool_weights(self):
+        pools = [{'name': 'a', 'rule': 0}, {'name': 'b', 'rule': 0},
+                 {'name': 'c', 'rule': 1}]
+        pg_utils.set_pool_weights(pools, {'a': 300, 'b': 100})
+        self.assertEqual([pool['weight'] for pool in pools],
+                         [75.0, 25.0, pg_utils.DEFAULT_POOL_WEIGHT])
+
+    def test_plan_pg_nums(self):
+        rule_osds = {0: set(range(100)), 1: set([100, 101])}
+        pools = [
+            {'name': 'volumes', 'rule': 0, 'size': 3, 'pg_num': 64,
+             'weight': 75.0},
+            {'name': 'images', 'rule': 0, 'size': 3, 'pg_num': 1024,
+             'weight': 25.0},
+            {'name': 'fast', 'rule': 1, 'size': 2, 'pg_num': 8,
+             'weight': 100.0},
+        ]
+        plan = pg_utils.plan_pg_nums(pools, rule_osds, pgs_per_osd=100,
+                                     max_pgs_per_osd=200)
+        self.assertEqual([pool['target_pg_num'] for pool in plan],
+                         [2048, 1024, 128])
+        self.assertEqual([pool['osd_count'] for pool in plan],
+                         [100, 100, 2])
+
+    def test_plan_pg_nums_max_pgs_per_osd(self):
+        rule_osds = {0: set(range(10))}
+        pools = [
+            {'name': 'a', 'rule': 0, 'size': 3, 'pg_num': 128,
+             'weight': 50.0},
+            {'name': 'b', 'rule': 0, 'size': 3, 'pg_num': 8,
+             'weight': 50.0},
+        ]
+        plan = pg_utils.plan_pg_nums(pools, rule_osds, pgs_per_osd=300,
+                                     max_pgs_per_osd=200)
+        load = pg_utils.get_pgs_per_osd(plan, rule_osds,
+                                        key='target_pg_num')
+        self.assertTrue(max(load.values()) <= 200)
+        self.assertEqual([pool['target_pg_num'] for pool in plan],
+                         [256, 256])
+
+    def test_plan_pg_nums_never_shrinks(self):
+        rule_osds = {0: set(range(10))}
+        pools = [{'name': 'a', 'rule': 0, 'size': 3, 'pg_num': 1024,
+                  'weight': 100.0}]
+        plan = pg_utils.plan_pg_nums(pools, rule_osds, pgs_per_osd=100,
+                                     max_pgs_per_osd=200)
+        self.assertEqual(plan[0]['target_pg_num'], 1024)
+
+
+class CrushSimulationTestCase(unittest.TestCase):
+
+    def test_count_moved_shards(self):
+        self.assertEqual(pg_utils.count_moved_shards([0, 1, 2], [2, 1, 0]),
+                         0)
+        self.assertEqual(pg_utils.count_moved_shards([0, 1, 2], [2, 1, 0],
+                                                     erasure=True), 2)
+        self.assertEqual(pg_utils.count_moved_shards([0, 1], [0, 3]), 1)
+
+    def test_compare_mappings(self):
+        pools = [{'name': 'rbd', 'rule': 0, 'size': 2, 'pg_num': 2,
+                  'type': 1},
+                 {'name': 'ec', 'rule': 1, 'size': 2, 'pg_num': 1,
+                  'type': pg_utils.POOL_TYPE_ERASURE}]
+        current = {(0, 2): [[0, 1], [1, 2]], (1, 2): [[3, 4]]}
+        proposed = {(0, 2): [[1, 0], [1, 3]], (1, 2): [[4, 3]]}
+        report = pg_utils.compare_mappings(pools, {'rbd': 4000}, current,
+                                           proposed)
+        self.assertEqual(report['pools'][0],
+                         {'name': 'rbd', 'pg_num': 2, 'pgs_remapped': 1,
+                          'shards_moved': 1, 'bytes_moved': 1000})
+        self.assertEqual(report['pools'][1]['shards_moved'], 2)
+        self.assertEqual(report['total']['pgs_remapped'], 2)
+        self.assertEqual(report['osd_load']['proposed']['max'], 2)
+        self.assertEqual(
+            report['osd_load']['proposed']['most_loaded'][0],
+            {'osd': 1, 'shards': 2})
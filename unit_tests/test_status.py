@@ -35,10 +35,12 @@ TO_PATCH = [
     'is_relation_made',
     'relation_ids',
     'relation_get',
+    'prefetch_relation_data',
     'related_units',
     'local_unit',
     'application_version_set',
     'get_upstream_version',
+    'flush_status_message',
 ]
 
 NO_PEERS = {
@@ -61,6 +63,7 @@ ENOUGH_PEERS_COMPLETE = {
 class ServiceStatusTestCase(test_utils.CharmTestCase):
     def setUp(self):
         super(ServiceStatusTestCase, self).setUp(hooks, TO_PATCH)
+        self.flush_status_message.return_value = ''
         self.config.side_effect = self.test_config.get
         self.test_config.set('monitor-count', 3)
         self.local_unit.return_value = 'ceph-mon1'
@@ -0,0 +1,177 @@
+# Copyright 2018 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import six
+
+from charmhelpers.core import unitdata
+
+
+class StorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'unit-state.db')
+        self.kv = unitdata.Storage(self.path)
+        self.addCleanup(self.kv.close)
+
+    def reopen(self):
+        """A second connection, which only sees committed writes."""
+        kv = unitdata.Storage(self.path)
+        self.addCleanup(kv.close)
+        return kv
+
+    def revisions(self, key):
+        return [(revision, data)
+                for revision, _, data, _, _ in self.kv.gethistory(key)]
+
+    def test_wal_mode(self):
+        self.kv.cursor.execute('pragma journal_mode')
+        self.assertEqual(self.kv.cursor.fetchone()[0], 'wal')
+
+    def test_set_and_update(self):
+        self.kv.set('a', 1)
+        self.kv.update({'b': [1, 2], 'c': {'d': None}}, prefix='x.')
+        self.assertEqual(self.kv.get('a'), 1)
+        self.assertEqual(self.kv.get('x.b'), [1, 2])
+        self.assertEqual(self.kv.get('x.c'), {'d': None})
+        self.assertEqual(self.reopen().get('a'), None)
+        self.kv.flush()
+        self.assertEqual(self.reopen().get('a'), 1)
+
+    def test_upsert_records_changes_only(self):
+        with self.kv.hook_scope('one') as revision:
+            self.kv.set('a', 1)
+            self.kv.update({'a': 1, 'b': 2})
+        with self.kv.hook_scope('two') as second:
+            self.kv.update({'a': 1, 'b': 3})
+        self.assertEqual(self.revisions('a'), [(revision, '1')])
+        self.assertEqual(self.revisions('b'),
+                         [(revision, '2'), (second, '3')])
+        self.assertEqual(self.reopen().get('b'), 3)
+
+    def test_transaction_commits(self):
+        with self.kv.transaction():
+            self.kv.set('a', 1)
+        self.assertEqual(self.reopen().get('a'), 1)
+
+    def test_transaction_rollback(self):
+        self.kv.set('a', 1)
+        with self.assertRaises(ValueError):
+            with self.kv.transaction():
+                self.kv.set('a', 2)
+                self.kv.set('b', 2)
+                raise ValueError()
+        self.assertEqual(self.kv.get('a'), 1)
+        self.assertEqual(self.kv.get('b'), None)
+        # The write made before the block is still pending
+        self.assertEqual(self.reopen().get('a'), None)
+        self.kv.flush()
+        self.assertEqual(self.reopen().get('a'), 1)
+
+    def test_nested_transaction_rollback(self):
+        with self.kv.transaction():
+            self.kv.set('outer', 1)
+            with self.assertRaises(ValueError):
+                with self.kv.transaction():
+                    self.kv.set('inner', 1)
+                    raise ValueError()
+            with self.kv.transaction():
+                self.kv.set('kept', 1)
+        self.assertEqual(self.kv._savepoints, 0)
+        kv = self.reopen()
+        self.assertEqual(kv.get('outer'), 1)
+        self.assertEqual(kv.get('inner'), None)
+        self.assertEqual(kv.get('kept'), 1)
+
+    def test_outer_rollback_discards_inner(self):
+        with self.assertRaises(ValueError):
+            with self.kv.transaction():
+                with self.kv.transaction():
+                    self.kv.set('inner', 1)
+                raise ValueError()
+        self.assertEqual(self.kv.get('inner'), None)
+
+    def test_transaction_in_hook_scope(self):
+        with self.kv.hook_scope('hook'):
+            with self.kv.transaction():
+                self.kv.set('a', 1)
+            self.assertEqual(self.reopen().get('a'), None)
+        self.assertEqual(self.reopen().get('a'), 1)
+
+    def test_prune_revisions(self):
+        for value in range(5):
+            with self.kv.hook_scope('hook-%d' % value):
+                self.kv.set('a', value)
+                if value == 0:
+                    self.kv.set('b', value)
+        self.assertEqual(self.kv.prune_revisions(keep=2), 3)
+        self.assertEqual([data for _, data in self.revisions('a')],
+                         ['3', '4'])
+        self.assertEqual([data for _, data in self.revisions('b')], ['0'])
+        # Hooks without revisions left are removed
+        self.kv.cursor.execute('select hook from hooks order by version')
+        self.assertEqual([hook for hook, in self.kv.cursor.fetchall()],
+                         ['hook-0', 'hook-3', 'hook-4'])
+
+    def test_compact(self):
+        self.kv.update(dict(('k%d' % i, 'x' * 1000) for i in range(200)))
+        self.kv.flush()
+        self.kv.compact()
+        self.kv.cursor.execute('pragma auto_vacuum')
+        self.assertEqual(self.kv.cursor.fetchone()[0], 2)
+        self.kv.unsetrange(prefix='k')
+        self.kv.flush()
+        self.kv.cursor.execute('pragma freelist_count')
+        self.assertGreater(self.kv.cursor.fetchone()[0], 0)
+        self.kv.compact(pages=1)
+        self.kv.cursor.execute('pragma freelist_count')
+        free = self.kv.cursor.fetchone()[0]
+        self.assertGreater(free, 0)
+        self.kv.compact()
+        self.kv.cursor.execute('pragma freelist_count')
+        self.assertEqual(self.kv.cursor.fetchone()[0], 0)
+
+    def test_getrange(self):
+        self.kv.update({'a.1': 1, 'a.2': 2, 'a_1': 3, 'ab': 4, 'b': 5})
+        self.assertEqual(self.kv.getrange('a.'), {'a.1': 1, 'a.2': 2})
+        self.assertEqual(self.kv.getrange('a.', strip=True),
+                         {'1': 1, '2': 2})
+        # LIKE wildcards are matched literally
+        self.assertEqual(self.kv.getrange('a_'), {'a_1': 3})
+        self.kv.set('a%b', 6)
+        self.assertEqual(self.kv.getrange('a%'), {'a%b': 6})
+        self.assertEqual(len(self.kv.getrange('')), 6)
+        self.assertEqual(self.kv.getrange('c'), {})
+
+    def test_getrange_max_unicode(self):
+        prefix = 'a' + six.unichr(sys.maxunicode)
+        self.kv.update({prefix: 1, prefix + 'b': 2, 'b': 3})
+        self.assertEqual(self.kv.getrange(prefix), {prefix: 1,
+                                                    prefix + 'b': 2})
+
+    def test_unsetrange(self):
+        self.kv.update({'a.1': 1, 'a.2': 2, 'a_1': 3})
+        with self.kv.hook_scope('hook') as revision:
+            self.kv.unsetrange(prefix='a.')
+        self.assertEqual(self.kv.getrange('a'), {'a_1': 3})
+        self.assertEqual(self.revisions('a.%'), [(revision, '"DELETED"')])
+        self.kv.unsetrange(['1'], prefix='a_')
+        self.assertEqual(self.kv.getrange('a'), {})